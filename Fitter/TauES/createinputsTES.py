@@ -9,6 +9,8 @@ sys.path.append("../Plotter/") # for config.samples
 from config.samples_v12 import *
 from TauFW.Plotter.plot.utils import LOG as PLOG
 from TauFW.Fitter.plot.datacard import createinputs, plotinputs
+from TauFW.Plotter.sample.Variation import Variation
+from TauFW.Plotter.sample.ResultScheduler import ResultScheduler
 from TauFW.Fitter.plot.rebinning import rebinning
 import yaml
 
@@ -139,21 +141,37 @@ def main(args):
 
     fname   = "%s/%s_%s_tes_$OBS%s.inputs-%s-%s.root"%(outdir,analysis,chshort,DM,era,tag)
 
+    # book all histograms first, and run them in one go to keep all threads busy
+    scheduler = ResultScheduler()
+
+    # weight-only shape systematics are filled in the same event loop as the nominal
+    weightvars = [ ] # list of Variation objects
+    if "systematics" in setup:
+      for sys in setup["systematics"]:
+        sysDef = setup["systematics"][sys]
+        if sysDef["effect"]!="shape" or "altWeights" not in sysDef or any(sysDef.get("sampleAppend",[ ])):
+          continue
+        weights = [(sysDef["nomWeight"],w) for w in sysDef["altWeights"]]
+        weightvars.append(Variation(sysDef["name"],weight=weights,tags=sysDef["variations"],procs=sysDef["processes"]))
+    weightsysts = [v.name for v in weightvars]
+
     print("Nominal inputs")
-    createinputs(fname, sampleset, observables, bins, filter=setup["processes"], dots=True, parallel=parallel)
+    if weightvars:
+      print("Weight variations: %s"%(', '.join(weightsysts)))
+    createinputs(fname, sampleset, observables, bins, filter=setup["processes"], variations=weightvars, dots=True, parallel=parallel, scheduler=scheduler)
 
     if "TESvariations" in setup:
       for var in setup["TESvariations"]["values"]:
         print("Variation: TES = %f"%var)
 
         newsampleset = sampleset.shift(setup["TESvariations"]["processes"], ("_TES%.3f"%var).replace(".","p"), "_TES%.3f"%var, " %.1d"%((1.-var)*100.)+"% TES", split=True,filter=False,share=True)
-        createinputs(fname,newsampleset, observables, bins, filter=setup["TESvariations"]["processes"], dots=True, parallel=parallel)
+        createinputs(fname,newsampleset, observables, bins, filter=setup["TESvariations"]["processes"], variations=weightvars, dots=True, parallel=parallel, scheduler=scheduler)
 
     if "systematics" in setup:
       for sys in setup["systematics"]:
 
         sysDef = setup["systematics"][sys]
-        if sysDef["effect"] != "shape":
+        if sysDef["effect"] != "shape" or sysDef["name"] in weightsysts: # weight variations already done above
           continue
         print("Systematic: %s"%sys)
 
@@ -165,7 +183,7 @@ def main(args):
           weightReplaced = [sysDef["nomWeight"],sysDef["altWeights"][iSysVar]] if "altWeights" in sysDef else ["",""]
           # Create a new sample set with systematic variations
           newsampleset_sys = sampleset.shift(sysDef["processes"], sampleAppend, "_"+sysDef["name"]+sysDef["variations"][iSysVar], sysDef["title"], split=True,filter=False,share=True)
-          createinputs(fname,newsampleset_sys, observables, bins, filter=sysDef["processes"], replaceweight=weightReplaced, dots=True, parallel=parallel)
+          createinputs(fname,newsampleset_sys, observables, bins, filter=sysDef["processes"], replaceweight=weightReplaced, dots=True, parallel=parallel, scheduler=scheduler)
 
           # Check for overlap with TES variations in setup
           if "TESvariations" in setup:
@@ -175,7 +193,10 @@ def main(args):
               for var in setup["TESvariations"]["values"]:
                 print("Variation: TES = %f"%var)
                 newsampleset_TESsys = sampleset.shift(overlap_TES_sys, ("_TES%.3f"%var).replace(".","p")+sampleAppend, "_TES%.3f"%var+"_"+sysDef["name"]+sysDef["variations"][iSysVar], " %.1d"%((1.-var)*100.)+"% TES" + sysDef["title"], split=True,filter=False,share=True)
-                createinputs(fname,newsampleset_TESsys, observables, bins, filter=overlap_TES_sys, replaceweight=weightReplaced, dots=True, parallel=parallel)
+                createinputs(fname,newsampleset_TESsys, observables, bins, filter=overlap_TES_sys, replaceweight=weightReplaced, dots=True, parallel=parallel, scheduler=scheduler)
+
+      # RUN all booked histograms and write them to file
+      scheduler.run()
 
       ############
       #   PLOT   #
@@ -208,6 +229,8 @@ def main(args):
         plotinputs(fname,varprocs,observables,bins,text=text,
                    pname=pname,tag=tag,group=groups, parallel=parallel, mean=True) 
 
+    scheduler.run() # if not run yet (no systematics)
+
 if __name__ == "__main__":
   from argparse import ArgumentParser
   description = """Create input histograms for datacards"""
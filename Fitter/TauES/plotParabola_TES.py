@@ -9,6 +9,7 @@ import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
 from ROOT import gROOT, gPad, gStyle, Double, TFile, TCanvas, TLegend, TLatex, TF1, TGraph, TGraph2D, TPolyMarker3D, TGraphAsymmErrors, TLine,\
                  kBlack, kBlue, kRed, kGreen, kYellow, kOrange, kMagenta, kTeal, kAzure, TMath
 from TauFW.Plotter.sample.utils import CMSStyle
+from TauFW.Fitter.plot.scan import readscan, findminimum, padscans, analyzescans, measurescans
 from itertools import combinations
 from math import sqrt, log, ceil, floor
 
@@ -50,33 +51,15 @@ def plotParabola(setup,var,region,year,**kwargs):
     for i, (bdtag,bdtitle) in enumerate(breakdown):
       breakdown[i] = (bdtag, bdtitle,filename.replace("higgsCombine.","higgsCombine.%s-"%bdtag))
     print '>>>   file "%s"'%(filename)
-    file = ensureTFile(filename)
-    tree = file.Get('limit')
     
     # GET DeltaNLL
-    list_nll = [ ]
-    list_tes = [ ]
     if MDFslices:
       tes = "tes_%s"%region
       MDFslices = { t:v for t,v in MDFslices.iteritems() if t!=tes }
-      for i, event in enumerate(tree):
-        if i==0: continue
-        if tree.quantileExpected<0: continue
-        if tree.deltaNLL == 0: continue
-        if any(abs(getattr(tree,t)-v)>0.000001 for t,v in MDFslices.iteritems()): continue
-        list_tes.append(getattr(tree,tes))
-        list_nll.append(2*tree.deltaNLL)
-      list_nll = [n for _,n in sorted(zip(list_tes,list_nll), key=lambda p: p[0])]
-      list_tes.sort()
+      list_tes, list_nll = readscan(filename,poi=tes,slices=MDFslices)
     else:
-      for i, event in enumerate(tree):
-        if i==0: continue
-        if tree.quantileExpected<0: continue
-        if tree.deltaNLL == 0: continue
-        #if tree.tes < 0.97: continue
-        list_tes.append(tree.tes)
-        list_nll.append(2*tree.deltaNLL)
-    file.Close()
+      list_tes, list_nll = readscan(filename,poi='tes')
+    list_tes, list_nll = list(list_tes), list(list_nll)
     nllmin    = min(list_nll)
     list_dnll = map(lambda n: n-nllmin, list_nll) # DeltaNLL
     
@@ -90,20 +73,11 @@ def plotParabola(setup,var,region,year,**kwargs):
     if len(list_dnll_left)==0 or len(list_dnll_right)==0 : 
       print "ERROR! Parabola does not have minimum within given range !!!"
       exit(1)
-    tmin_left = -1
-    tmin_right = -1
     
     # FIND crossings of 1 sigma line
-    # |-----<---min---------|
-    for i, val in reversed(list(enumerate(list_dnll_left))):
-      if val > (dnllmin+1):
-          tmin_left = list_tes_left[i]
-          break
-    # |---------min--->-----|
-    for i, val in enumerate(list_dnll_right):
-      if val > (dnllmin+1):
-          tmin_right = list_tes_right[i]
-          break
+    crossings  = analyzescans(*padscans([(list_tes,list_dnll)]),level=1,interp=None)
+    tmin_left  = -1 if numpy.isnan(crossings['xdown'][0]) else crossings['xdown'][0]
+    tmin_right = -1 if numpy.isnan(crossings['xup'][0]) else crossings['xup'][0]
     
     tes         = round(list_tes[min_index],4)
     tes_errDown = round((tes-tmin_left)*10000)/10000
@@ -477,149 +451,52 @@ def createParabolaFromLists(list_tes,list_dnll,fit=False):
     
 def createParabola(filename):
     """Create TGraph of DeltaNLL parabola vs. tes from MultiDimFit file."""
-    file = ensureTFile(filename)
-    tree = file.Get('limit')
-    tes, nll = [ ], [ ]
-    for i, event in enumerate(tree):
-      if i==0: continue
-      tes.append(tree.tes)
-      nll.append(2*tree.deltaNLL)
-    file.Close()
-    minnll = min(nll)
-    mintes = tes[nll.index(minnll)]
-    dnll   = map(lambda x: x-minnll, nll) # DeltaNLL
+    tes, nll = readscan(filename,poi='tes')
+    imin   = numpy.argmin(nll)
+    mintes = tes[imin]
+    dnll   = nll-nll[imin] # DeltaNLL
     graph  = TGraph(len(tes), array('d',tes), array('d',dnll))
     return graph, mintes
     
-def findMultiDimSlices(channel,var,**kwargs):
+def findMultiDimSlices(channel,var,year,**kwargs):
     """Find minimum of multidimensional parabola in MultiDimFit file and return
     dictionary of the corresponding values of POI's."""
-    tag      = kwargs.get('tag', "" )
+    indir    = kwargs.get('indir', "output_%s"%year )
+    tag      = kwargs.get('tag',   ""               )
     filename = '%s/higgsCombine.%s_%s-%s%s-13TeV.MultiDimFit.mH90.root'%(indir,channel,var,'MDF',tag)
-    file     = ensureTFile(filename)
-    tree     = file.Get('limit')
-    pois     = [b.GetName() for b in tree.GetListOfBranches() if 'tes_DM' in b.GetName()]
-    slices   = { }
-    nnlmin   = 10e10
-    for event in tree:
-      nnl = 2*event.deltaNLL
-      if nnl<nnlmin:
-        nnlmin = nnl
-        for poi in pois:
-          slices[poi] = getattr(event,poi)
-        #print nnlmin, slices
-    file.Close()
-    #print nnlmin, slices
+    nnlmin, slices = findminimum(filename,pois='tes_DM')
     return nnlmin, slices
     
 
 
-def measureTES(filename,unc=False,fit=False,asymmetric=True):
-    """Create TGraph of DeltaNLL parabola vs. tes from MultiDimFit file."""
+def measureTES(filename,unc=False,fit=False,asymmetric=True,interp=None):
+    """Measure tes and its uncertainty from the DeltaNLL parabola in a MultiDimFit file.
+    By default, the 1 sigma crossings are the first scan points beyond the DeltaNLL=1 line;
+    use interp='linear' or 'spline' to interpolate between scan points instead.
+    Results are cached per file checksum, see TauFW.Fitter.plot.scan.measurescans."""
     if fit:
        return measureTES_fit(filename,asymmetric=asymmetric,unc=unc)
-    file = ensureTFile(filename)
-    tree = file.Get('limit')
-    tes, nll = [ ], [ ]
-    for event in tree:
-      tes.append(tree.tes)
-      nll.append(2*tree.deltaNLL)
-    file.Close()
-    nllmin = min(nll)
-    imin   = nll.index(nllmin)
-    tesmin = tes[imin]
-    
+    result = measurescans([filename],poi='tes',bestfit=True,interp=interp)[0]
+    tesmin = result['x']
     if unc:
-      nll_left  = nll[:imin]
-      tes_left  = tes[:imin]
-      nll_right = nll[imin:]
-      tes_right = tes[imin:]
-      if len(nll_left)==0 or len(nll_right)==0 : 
+      if result['errdown']==None or result['errup']==None:
         print "ERROR! measureTES: Parabola does not have a minimum within given range!"
         exit(1)
-      tmin_left = -1
-      tmin_right = -1
-      
-      # FIND crossings of 1 sigma line
-      # |-----<---min---------|
-      for i, val in reversed(list(enumerate(nll_left))):
-        if val > (nllmin+1):
-          tmin_left = tes_left[i]
-          break
-      # |---------min--->-----|
-      for i, val in enumerate(nll_right):
-        if val > (nllmin+1):
-          tmin_right = tes_right[i]
-          break
-      
-      tes_errDown = tesmin-tmin_left
-      tes_errUp   = tmin_right-tesmin
-      return tesmin, tes_errDown, tes_errUp
-    
+      return tesmin, result['errdown'], result['errup']
     return tesmin
     
 
 
 def measureTES_fit(filename,asymmetric=True,unc=False):
-    """Create TGraph of DeltaNLL parabola vs. tes from MultiDimFit file."""
-    file = ensureTFile(filename)
-    tree = file.Get('limit')
-    xmin, xmax = 0.945, 1.08
-    ymin, ymax = 0.0,  10.
-    
-    # GET DeltaNLL
-    list_nll = [ ]
-    list_tes = [ ]
-    for i, event in enumerate(tree):
-      if i==0: continue
-      if tree.quantileExpected<0: continue
-      if tree.deltaNLL==0: continue
-      list_tes.append(tree.tes)
-      list_nll.append(2*tree.deltaNLL)
-    file.Close()
-    nllmin    = min(list_nll)
-    list_dnll = map(lambda n: n-nllmin, list_nll) # DeltaNLL
-    
-    # MINIMUM
-    dnllmin         = min(list_dnll) # should be 0.0 by definition
-    min_index       = list_dnll.index(dnllmin)
-    list_dnll_left  = list_dnll[:min_index]
-    list_tes_left   = list_tes[:min_index]
-    list_dnll_right = list_dnll[min_index:]
-    list_tes_right  = list_tes[min_index:]
-    if len(list_dnll_left)==0 or len(list_dnll_right)==0 : 
-      print "ERROR! Parabola does not have minimum within given range !!!"
-      exit(1)
-    tmin_left = -1
-    tmin_right = -1
-    
-    # FIND crossings of 1 sigma line
-    # |-----<---min---------|
-    for i, val in reversed(list(enumerate(list_dnll_left))):
-      if val > (dnllmin+1):
-          tmin_left = list_tes_left[i]
-          break
-    # |---------min--->-----|
-    for i, val in enumerate(list_dnll_right):
-      if val > (dnllmin+1):
-          tmin_right = list_tes_right[i]
-          break
-    
-    tes   = round(list_tes[min_index],4)
-    graph = createParabolaFromLists(list_tes,list_dnll,fit=True)
-    para  = fitParabola(xmin,xmax,tes,list_tes_left,list_dnll_left,list_tes_right,list_dnll_right,asymmetric=asymmetric)
-    fit   = graph.Fit("fit",'R0')
-    tesf  = para.GetParameter(1)
+    """Measure tes and its uncertainty by fitting an (asymmetric) parabola
+    to the DeltaNLL points in a MultiDimFit file."""
+    result = measurescans([filename],poi='tes',fit=True,asymmetric=asymmetric)[0]
+    tesf   = result['x']
     if unc:
-      if asymmetric:
-        yline = 1+para.GetParameter(2)
-        tesf_errDown = tesf-para.GetX(yline,tesf-0.02,tesf)
-        tesf_errUp   = para.GetX(yline,tesf,tesf+0.02)-tesf
-      else:
-        tesf_errUp   = round( sqrt( 1./(1000.*para.GetParameter(0)) )*10000)/10000 # TODO: propagate fit uncertainties with GetParError(i) !
-        tesf_errDown = round( sqrt( 1./(1000.*para.GetParameter(0)) )*10000)/10000  
-      return tesf, tesf_errDown, tesf_errUp
-    
+      if result['errdown']==None or result['errup']==None:
+        print "ERROR! measureTES_fit: Fitted parabola does not have a minimum!"
+        exit(1)
+      return tesf, result['errdown'], result['errup']
     return tesf
     
 
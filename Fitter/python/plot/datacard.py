@@ -44,6 +44,13 @@ def createinputs(fname,sampleset,obsset,bins,syst="",**kwargs):
        obsset:    list of Variables objects
        bins:      list of Selection objects
        syst:      tag for histogram name for this systematic
+     Systematic variations of weights or columns that do not need separate files,
+     can be passed as a list of Variation objects (variations=[...]) to fill
+     the nominal and all up/down histograms in a single event loop per file.
+     If a ResultScheduler is passed (scheduler=...), histograms are written after
+     ResultScheduler.run, so many calls (e.g. for shifted samples) share one event loop.
+     By default (lazy=True), histograms are only retrieved when written, and freed afterwards,
+     so only one observable and bin are kept in memory at the same time.
   """
   #LOG.header("createinputs")
   htag          = syst
@@ -56,6 +63,7 @@ def createinputs(fname,sampleset,obsset,bins,syst="",**kwargs):
   nthreads      = kwargs.get('nthreads',      nthreads ) # alias
   recreate      = kwargs.get('recreate',      False  ) # recreate ROOT file
   replaceweight = kwargs.get('replaceweight', None   ) # replace weight (e.g. for syst. variations)
+  variations    = kwargs.get('variations',    None   ) # list of Variation objects (systematic variations with RDataFrame.Vary)
   replacenames  = kwargs.get('replacename',   [ ]    ) # replace name (regular expressions)
   extraweight   = kwargs.get('weight',        ""     ) # extraweight
   shift         = kwargs.get('shift',         ""     ) # shift variable (e.g. for syst. variations)
@@ -63,6 +71,8 @@ def createinputs(fname,sampleset,obsset,bins,syst="",**kwargs):
   shiftQCD      = kwargs.get('shiftQCD',      0      ) # e.g 0.30 for 30%
   noneg         = kwargs.get('noneg',         True   ) # suppress negative bin values (for fit stability)
   dots          = kwargs.get('dots',          False  ) # replace 'p' with '.' in histogram names with floats
+  scheduler     = kwargs.get('scheduler',     None   ) # ResultScheduler to write after running with other calls
+  lazy          = kwargs.get('lazy',          True   ) # retrieve histograms only when writing, and free them afterwards
   verbosity     = kwargs.get('verb',          0      ) # verbosity level
   option        = 'RECREATE' if recreate else 'UPDATE'
   method        = 'QCD_OSSS' if filters==None or 'QCD' in filters else None
@@ -70,7 +80,6 @@ def createinputs(fname,sampleset,obsset,bins,syst="",**kwargs):
   replacenames  = ensurelist(replacenames)
   
   # FILE LOGISTICS: prepare file and directories
-  files = { }
   ensuredir(outdir)
   fname = os.path.join(outdir,fname)
   if shift: # shift observable name
@@ -82,79 +91,105 @@ def createinputs(fname,sampleset,obsset,bins,syst="",**kwargs):
   if shiftjme: # shift jet/MET variables, e.g. shiftjme='jec', 'jer', 'unclen'
     obsset = [o.shiftjme(shiftjme,keepfile=True) for o in obsset]
     bins = [s.shiftjme(shiftjme,keepfile=True) for s in bins]
-  for obs in obsset:
-    obsname = obs.filename
-    ftag    = tag+obs.tag
-    fname_  = repkey(fname,OBS=obsname,TAG=tag) # replace keys
-    file    = TFile.Open(fname_,option)
-    if recreate:
-      print(">>> created file %s"%(fname_))
-    for selection in bins:
-      if not obs.plotfor(selection): continue
-      obs.changecontext(selection) # update contextual cuts, binning, name, title, ...
-      ensureTDirectory(file,selection.filename,cd=True,verb=verbosity)
-      if recreate:
-        string = joincuts(selection.selection,obs.cut)
-        TNamed("selection",string).Write() # write exact selection string to ROOT file for the record / debugging
-        #TNamed("weight",sampleset.weight).Write()
-        LOG.verb("%s selection %r: %r"%(obsname,selection.name,string),verbosity,1)
-    files[obs] = file
   
-  # GET HISTS
-  # TODO: We can now run bins/selections in parallel, using RDF
-  for selection in bins:
-    bin = selection.filename # bin name
-    print(">>>\n>>> "+color(" %s "%(bin),'magenta',bold=True,ul=True))
-    if htag: # hist tag for systematic
-      print(">>> systematic uncertainty: %s"%(color(htag.lstrip('_'),'grey')))
-    if recreate or verbosity>=1:
-      print(">>> %r"%(selection.selection))
-    for obs in obsset: # update contextual cuts, binning, name, title, ...
-      obs.changecontext(selection)
-    hists = sampleset.gethists(obsset,selection,method=method,split=True,nthreads=nthreads,
-                               filter=filters,veto=vetoes,replaceweight=replaceweight)
+  # GET HISTS for all bins at once, so each file is only looped over once
+  if htag: # hist tag for systematic
+    print(">>> systematic uncertainty: %s"%(color(htag.lstrip('_'),'grey')))
+  hists = sampleset.gethists(obsset,list(bins),method=method,split=True,nthreads=nthreads,
+                             filter=filters,veto=vetoes,replaceweight=replaceweight,variations=variations,
+                             scheduler=scheduler,lazy=lazy)
+  
+  def writeinputs(hists):
+    """Write histograms to file per observable and bin."""
+    
+    # FILE LOGISTICS: prepare file and directories
+    files = { }
+    for obs in obsset:
+      obsname = obs.filename
+      ftag    = tag+obs.tag
+      fname_  = repkey(fname,OBS=obsname,TAG=tag) # replace keys
+      file    = TFile.Open(fname_,option)
+      if recreate:
+        print(">>> created file %s"%(fname_))
+      for selection in bins:
+        if not obs.plotfor(selection): continue
+        obs.changecontext(selection) # update contextual cuts, binning, name, title, ...
+        ensureTDirectory(file,selection.filename,cd=True,verb=verbosity)
+        if recreate:
+          string = joincuts(selection.selection,obs.cut)
+          TNamed("selection",string).Write() # write exact selection string to ROOT file for the record / debugging
+          #TNamed("weight",sampleset.weight).Write()
+          LOG.verb("%s selection %r: %r"%(obsname,selection.name,string),verbosity,1)
+      files[obs] = file
     
-    # SAVE HIST
-    wobs  = max([10]+[len(o.printbins(filename=True)) for o in hists]) # extra space
-    wproc = 4+max(11,len(htag)) # extra space
-    TAB   = LOG.table(f"%11.1f %10d  %-{wobs}s  %s")
-    TAB.printheader('Events','Entries','Observable','Process'.ljust(wproc))
-    for obs, histset in hists.items():
-      for hist in histset:
-        hname = hist.GetName() # = $VAR_$BIN_$NAME (created by makehistname in Sample.getrdframe)
-        hname = lreplace(hname,obs.filename).strip('_') # remove variable prefix
-        hname = lreplace(hname,selection.filename).strip('_') # remove selection prefix
-        hname = hname.replace('.', 'p')
-        if not hname.endswith(htag):
-          hname += htag # HIST = $PROCESS_$SYSTEMATIC
-        hname = repkey(hname,BIN=bin)
-        if dots and 'p' in hname: # replace 'p' with '.' in float
-          hname = re.sub(r"(\d+)p(\d+)",r"\1.\2",hname)
-        for exp, sub in replacenames: # replace regular expressions
-          hname = re.sub(exp,sub,hname)
-        drawopt = 'E1' if 'data' in hname else 'EHIST'
-        lcolor  = kBlack if any(s in hname for s in ['data','ST','VV']) else hist.GetFillColor()
-        hist.SetOption(drawopt)
-        hist.SetLineColor(lcolor)
-        hist.SetFillStyle(0) # no fill in ROOT file
-        hist.SetName(hname)
-        hist.GetXaxis().SetTitle(obs.title)
-        if noneg:
-          for i, yval in enumerate(hist):
-            if yval<0: # manually delete negative bin values
-              print(f">>> Set negative value of {hname!r} bin {i} ({yval:.3f}<0) to 0") #hist.GetName()
-              hist.SetBinContent(i,0)
-        if files[obs].cd(bin): # $FILE:$BIN/$PROCESS_$SYSTEMATC
-          hist.Write(hname,TH1.kOverwrite)
-        TAB.printrow(hist.GetSumOfWeights(),hist.GetEntries(),obs.printbins(filename=True),hname)
-        #if not parallel: # avoid segmentation faults for parallel
-        #  deletehist(hist) # clean histogram from memory
+    # SAVE HIST per bin
+    for selection in bins:
+      bin = selection.filename # bin name
+      print(">>>\n>>> "+color(" %s "%(bin),'magenta',bold=True,ul=True))
+      if recreate or verbosity>=1:
+        print(">>> %r"%(selection.selection))
+      if selection not in hists:
+        LOG.warn("createinputs: No histograms for bin %r..."%(bin))
+        continue
+      wobs  = max([10]+[len(o.printbins(filename=True)) for o in hists[selection]]) # extra space
+      wproc = 4+max(11,len(htag)) # extra space
+      TAB   = LOG.table(f"%11.1f %10d  %-{wobs}s  %s")
+      TAB.printheader('Events','Entries','Observable','Process'.ljust(wproc))
+      for obs, histset in hists[selection].items():
+        obs.changecontext(selection) # update contextual cuts, binning, name, title, ...
+        writehists(files[obs],bin,obs,selection,histset,htag,TAB,
+                   dots=dots,noneg=noneg,replacenames=replacenames)
+        for variation, varset in sorted(histset.variations.items()): # systematic variations
+          vartag = htag+'_'+variation.replace(':','') # e.g. 'shape_tes:Up' -> '_shape_tesUp'
+          writehists(files[obs],bin,obs,selection,varset,vartag,TAB,
+                     dots=dots,noneg=noneg,replacenames=replacenames)
+        if lazy: # remove from memory
+          histset.free()
+    
+    # CLOSE
+    for obs, file in files.items():
+      file.Close()
+    return hists
   
-  # CLOSE
-  for obs, file in files.items():
-    file.Close()
+  # WRITE now, or after running ResultScheduler
+  if scheduler!=None:
+    return hists.addcallback(writeinputs) # ScheduledResult
+  return writeinputs(hists)
   
 
+def writehists(file,bin,obs,selection,histset,htag,TAB,dots=False,noneg=True,replacenames=[ ]):
+  """Help function to rename and write histograms of a HistSet to a ROOT file
+  for given bin (selection) and observable (variable)."""
+  for hist in histset:
+    hname = hist.GetName() # = $VAR_$NAME(_$VARIATION) (created by makehistname in Sample.getrdframe)
+    hname = lreplace(hname,obs.filename).strip('_') # remove variable prefix
+    hname = lreplace(hname,selection.filename).strip('_') # remove selection prefix
+    hname = hname.replace('.', 'p')
+    if not hname.endswith(htag):
+      hname += htag # HIST = $PROCESS_$SYSTEMATIC
+    hname = repkey(hname,BIN=bin)
+    if dots and 'p' in hname: # replace 'p' with '.' in float
+      hname = re.sub(r"(\d+)p(\d+)",r"\1.\2",hname)
+    for exp, sub in replacenames: # replace regular expressions
+      hname = re.sub(exp,sub,hname)
+    drawopt = 'E1' if 'data' in hname else 'EHIST'
+    lcolor  = kBlack if any(s in hname for s in ['data','ST','VV']) else hist.GetFillColor()
+    hist.SetOption(drawopt)
+    hist.SetLineColor(lcolor)
+    hist.SetFillStyle(0) # no fill in ROOT file
+    hist.SetName(hname)
+    hist.GetXaxis().SetTitle(obs.title)
+    if noneg:
+      for i, yval in enumerate(hist):
+        if yval<0: # manually delete negative bin values
+          print(f">>> Set negative value of {hname!r} bin {i} ({yval:.3f}<0) to 0") #hist.GetName()
+          hist.SetBinContent(i,0)
+    if file.cd(bin): # $FILE:$BIN/$PROCESS_$SYSTEMATC
+      hist.Write(hname,TH1.kOverwrite)
+    TAB.printrow(hist.GetSumOfWeights(),hist.GetEntries(),obs.printbins(filename=True),hname)
+    #if not parallel: # avoid segmentation faults for parallel
+    #  deletehist(hist) # clean histogram from memory
+  
 
 def plotinputs(fname,varprocs,obsset,bins,**kwargs):
   """Plot histogram inputs from ROOT file for datacards, and write to ROOT file.
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# Author: Izaak Neutelings (November 2023)
+# Description: Vectorized analysis of likelihood scans from combine's MultiDimFit output:
+#              bulk-read (POI, deltaNLL) arrays from many higgsCombine*.root files, and compute minima,
+#              crossings of the 1 sigma line, and (asymmetric) parabola fits of all scans at once.
+# Usage:
+#   from TauFW.Fitter.plot.scan import readscan, measurescans
+#   x, dnll = readscan("higgsCombine.mt_m_vis-DM0-13TeV.MultiDimFit.mH90.root",poi='tes')
+#   results = measurescans(fnames,poi='tes',fit=True) # list of dicts with 'x', 'errdown', 'errup'
+from __future__ import print_function # for python2 compatibility
+import os, re, json, hashlib
+import numpy as np
+try:
+  import uproot
+except ImportError:
+  uproot = None
+cachedir = os.environ.get('TAUFW_SCANCACHE',"~/.cache/TauFW/scans") # cache of results per file checksum
+version  = 1 # increase when the scan analysis changes, to invalidate old cached results
+
+
+###############
+#   READING   #
+###############
+
+def readarrays(fname,branches,tree='limit'):
+  """Bulk-read branches of a tree into a dictionary of NumPy arrays,
+  with uproot if available, or else with RDataFrame."""
+  if uproot!=None:
+    with uproot.open(fname) as file:
+      return file[tree].arrays(branches,library='np')
+  import ROOT
+  rdframe = ROOT.RDataFrame(tree,fname)
+  return { b: np.asarray(a) for b, a in rdframe.AsNumpy(branches).items() }
+
+
+def getbranches(fname,pattern=None,tree='limit'):
+  """Return list of branch names matching a regular expression, e.g. POIs like 'tes_DM'."""
+  if uproot!=None:
+    with uproot.open(fname) as file:
+      branches = list(file[tree].keys())
+  else:
+    import ROOT
+    branches = [str(b) for b in ROOT.RDataFrame(tree,fname).GetColumnNames()]
+  if pattern:
+    branches = [b for b in branches if re.search(pattern,b)]
+  return branches
+
+
+def readscan(fname,poi='tes',slices=None,bestfit=False,tree='limit'):
+  """Read likelihood scan from MultiDimFit file. Return arrays of POI values and 2*deltaNLL, sorted by POI.
+  By default, drop the best-fit point (quantileExpected<0 or deltaNLL==0).
+  For multidimensional fits, only keep points in a slice through the other POIs, e.g. slices={'tes_DM1': 0.98}."""
+  slices   = slices or { }
+  branches = [poi,'deltaNLL','quantileExpected']+[p for p in slices if p!=poi]
+  arrays   = readarrays(fname,branches,tree=tree)
+  mask     = np.ones(len(arrays[poi]),dtype=bool)
+  if not bestfit:
+    mask &= (arrays['quantileExpected']>=0) & (arrays['deltaNLL']!=0)
+  for key, val in slices.items():
+    if key!=poi:
+      mask &= np.abs(arrays[key]-val)<=1e-6
+  xvals = arrays[poi][mask].astype(np.float64)
+  yvals = 2*arrays['deltaNLL'][mask].astype(np.float64)
+  order = np.argsort(xvals,kind='stable')
+  return xvals[order], yvals[order]
+
+
+def findminimum(fname,pois='tes_DM',tree='limit'):
+  """Find the minimum of 2*deltaNLL in a (multidimensional) scan.
+  Return the minimum and a dictionary of the corresponding values of the POIs,
+  which are given as a list, or a regular expression."""
+  if not isinstance(pois,(list,tuple)):
+    pois = getbranches(fname,pois,tree=tree)
+  arrays = readarrays(fname,list(pois)+['deltaNLL'],tree=tree)
+  nll    = 2*arrays['deltaNLL']
+  imin   = int(np.argmin(nll))
+  return float(nll[imin]), { p: float(arrays[p][imin]) for p in pois }
+
+
+def padscans(scans):
+  """Pad list of (x,y) scans into two 2D arrays of shape (nscans,npoints), sorted by x, padded with NaN."""
+  npoints = max([len(x) for x, y in scans]+[1])
+  xvals   = np.full((len(scans),npoints),np.nan)
+  yvals   = np.full((len(scans),npoints),np.nan)
+  for i, (x, y) in enumerate(scans):
+    order = np.argsort(x,kind='stable')
+    xvals[i,:len(x)] = np.asarray(x)[order]
+    yvals[i,:len(y)] = np.asarray(y)[order]
+  return xvals, yvals
+
+
+################
+#   ANALYSIS   #
+################
+
+def getslopes(xvals,yvals):
+  """Return slopes at each point for a cubic Hermite spline,
+  averaging the secants on each side (one-sided at the edges)."""
+  secants = (yvals[:,1:]-yvals[:,:-1])/(xvals[:,1:]-xvals[:,:-1])
+  left    = np.concatenate([np.full((len(xvals),1),np.nan),secants],axis=1)
+  right   = np.concatenate([secants,np.full((len(xvals),1),np.nan)],axis=1)
+  return np.where(np.isnan(left),right,np.where(np.isnan(right),left,(left+right)/2.))
+
+
+def hermite(t,y0,y1,m0,m1,dx):
+  """Evaluate cubic Hermite spline on the unit interval."""
+  t2, t3 = t*t, t*t*t
+  return (2*t3-3*t2+1)*y0 + (t3-2*t2+t)*dx*m0 + (-2*t3+3*t2)*y1 + (t3-t2)*dx*m1
+
+
+def interpolate(xvals,yvals,slopes,ilow,level,interp='spline',niters=40):
+  """Find crossing with level between points ilow and ilow+1 for each scan.
+  If interp=None, return the point that is furthest from the minimum (no interpolation)."""
+  rows = np.arange(len(xvals))
+  ilow = np.clip(ilow,0,xvals.shape[1]-2)
+  x0, x1 = xvals[rows,ilow], xvals[rows,ilow+1]
+  y0, y1 = yvals[rows,ilow], yvals[rows,ilow+1]
+  with np.errstate(all='ignore'):
+    if interp=='linear':
+      return x0+(level-y0)*(x1-x0)/(y1-y0)
+    elif interp=='spline': # bisection on cubic Hermite spline, vectorized over all scans
+      m0, m1 = slopes[rows,ilow], slopes[rows,ilow+1]
+      tlow, tupp = np.zeros(len(xvals)), np.ones(len(xvals))
+      sign = np.sign(y0-level)
+      for i in range(niters):
+        tmid  = (tlow+tupp)/2.
+        above = np.sign(hermite(tmid,y0,y1,m0,m1,x1-x0)-level)==sign
+        tlow  = np.where(above,tmid,tlow)
+        tupp  = np.where(above,tupp,tmid)
+      return x0+(tlow+tupp)/2.*(x1-x0)
+  raise ValueError("interpolate: Did not recognize interp=%r! Use None, 'linear' or 'spline'."%(interp))
+
+
+def analyzescans(xvals,yvals,level=1.,interp='spline'):
+  """Compute minimum and crossings of the (minimum+level) line for all scans at once,
+  where xvals and yvals are 2D arrays (nscans,npoints) from padscans, with y=2*deltaNLL.
+  Return dictionary of arrays: 'x', 'ymin', 'imin', 'xdown', 'xup', 'errdown', 'errup'.
+  Crossings that are not found within the scan range are NaN."""
+  nscans, npoints = xvals.shape
+  rows   = np.arange(nscans)
+  valid  = ~np.isnan(yvals)
+  imin   = np.argmin(np.where(valid,yvals,np.inf),axis=1)
+  ymin   = yvals[rows,imin]
+  xmin   = xvals[rows,imin]
+  dnll   = yvals-ymin[:,None]
+  index  = np.arange(npoints)[None,:]
+  above  = valid & (dnll>level)
+  left   = above & (index<imin[:,None]) # |-----<---min---------|
+  right  = above & (index>imin[:,None]) # |---------min--->-----|
+  ileft  = np.where(left.any(axis=1),npoints-1-np.argmax(left[:,::-1],axis=1),-1) # last point above level left of minimum
+  iright = np.where(right.any(axis=1),np.argmax(right,axis=1),-1) # first point above level right of minimum
+  if interp:
+    slopes = getslopes(xvals,dnll) if interp=='spline' else None
+    xdown  = interpolate(xvals,dnll,slopes,ileft,level,interp=interp)
+    xup    = interpolate(xvals,dnll,slopes,iright-1,level,interp=interp)
+  else: # first scan point beyond the crossing
+    xdown  = xvals[rows,ileft]
+    xup    = xvals[rows,iright]
+  xdown  = np.where(ileft>=0,xdown,np.nan)
+  xup    = np.where(iright>=0,xup,np.nan)
+  return { 'x': xmin, 'ymin': ymin, 'imin': imin, 'xdown': xdown, 'xup': xup,
+           'errdown': xmin-xdown, 'errup': xup-xmin }
+
+
+def getpointerrors(yvals,ymax=6.):
+  """Help function to estimate the uncertainty of each scan point for fitting,
+  from the average difference with its neighbors (as in createParabolaFromLists)."""
+  errors = np.ones(yvals.shape)
+  diffs  = np.abs(yvals[:,1:]-yvals[:,:-1])
+  inner  = np.maximum(0.1,(diffs[:,:-1]+diffs[:,1:])/2.)
+  errors[:,1:-1] = np.where(yvals[:,1:-1]<ymax,inner,1.0)
+  return np.where(np.isnan(errors),1.0,errors)
+
+
+def fitscans(xvals,yvals,asymmetric=True,ymax=5.,nsteps=41,nrefine=2):
+  """Fit (asymmetric) parabolas to all scans at once with weighted linear least squares:
+    f(x) = c + wdown*(x-b)**2  if x < b
+    f(x) = c + wup*(x-b)**2    if x > b
+  For a fixed minimum b, the parameters (c,wdown,wup) are linear, so each scan is solved for a grid of
+  b values around the scan minimum, which is refined around the best b a few times.
+  Only points with 2*deltaNLL-min<=ymax are used. Return dictionary of arrays:
+  'x' (=b), 'yoffset' (=c), 'wdown', 'wup', 'chi2', 'errdown', 'errup' (=1/sqrt(w), i.e. crossing of c+1)."""
+  nscans = len(xvals)
+  rows   = np.arange(nscans)
+  ana    = analyzescans(xvals,yvals,interp=None)
+  dnll   = yvals-ana['ymin'][:,None]
+  mask   = ~np.isnan(dnll) & (dnll<=ymax)
+  weight = np.where(mask,1./getpointerrors(dnll)**2,0.)
+  yfit   = np.where(mask,dnll,0.)
+  xfit   = np.where(mask,xvals,0.)
+  with np.errstate(all='ignore'):
+    step = np.nanmedian(np.diff(xvals,axis=1),axis=1) # typical spacing of scan points
+  step   = np.where(np.isnan(step)|(step<=0),1e-3,step)
+  center, width = ana['x'], step
+  for irefine in range(nrefine+1):
+    bvals = center[:,None]+np.linspace(-1,1,nsteps)[None,:]*width[:,None] # (nscans,nsteps)
+    delta = xfit[:,None,:]-bvals[:,:,None] # (nscans,nsteps,npoints)
+    quad  = delta**2
+    if asymmetric:
+      cols = [np.ones(quad.shape),np.where(delta<0,quad,0.),np.where(delta>=0,quad,0.)]
+    else:
+      cols = [np.ones(quad.shape),quad]
+    design = np.stack(cols,axis=-1) # (nscans,nsteps,npoints,npars)
+    wdes   = design*weight[:,None,:,None]
+    lhs    = np.einsum('sbpi,sbpj->sbij',wdes,design)+1e-12*np.eye(len(cols)) # normal equations
+    rhs    = np.einsum('sbpi,sp->sbi',wdes,yfit)
+    pars   = np.linalg.solve(lhs,rhs[...,None])[...,0] # (nscans,nsteps,npars)
+    resid  = yfit[:,None,:]-np.einsum('sbpi,sbi->sbp',design,pars)
+    chi2   = np.sum(weight[:,None,:]*resid**2,axis=2)
+    ibest  = np.argmin(chi2,axis=1)
+    center = bvals[rows,ibest]
+    width  = 2*width/(nsteps-1) # zoom in around best b
+  best   = pars[rows,ibest]
+  wdown  = best[:,1]
+  wup    = best[:,2] if asymmetric else best[:,1]
+  with np.errstate(all='ignore'):
+    errdown = np.where(wdown>0,1./np.sqrt(wdown),np.nan)
+    errup   = np.where(wup>0,1./np.sqrt(wup),np.nan)
+  return { 'x': center, 'yoffset': best[:,0], 'wdown': wdown, 'wup': wup, 'chi2': chi2[rows,ibest],
+           'errdown': errdown, 'errup': errup }
+
+
+###############
+#   CACHING   #
+###############
+
+def getchecksum(fname,blocksize=1<<20):
+  """Return SHA1 checksum of file content, or None if it is not a local file."""
+  if not os.path.isfile(fname):
+    return None
+  sha1 = hashlib.sha1()
+  with open(fname,'rb') as file:
+    for block in iter(lambda: file.read(blocksize),b''):
+      sha1.update(block)
+  return sha1.hexdigest()
+
+
+def getcachepath(fname,**opts):
+  """Return path of cached result of a file for given options, or None if the file cannot be cached."""
+  if not cachedir:
+    return None
+  checksum = getchecksum(fname)
+  if checksum==None:
+    return None
+  key = hashlib.sha1(("%s %s %s"%(version,checksum,sorted(opts.items()))).encode('utf-8')).hexdigest()
+  return os.path.join(os.path.expanduser(os.path.expandvars(cachedir)),key[:2],key+".json")
+
+
+def measurescans(fnames,poi='tes',slices=None,fit=False,asymmetric=True,level=1.,interp='spline',
+                 bestfit=False,cache=True,verb=0):
+  """Measure POI and its uncertainties for a list of MultiDimFit files.
+  All files that are not cached yet are read and analyzed in one vectorized pass,
+  and the results are cached per file checksum and options.
+  Return list of dictionaries with 'x', 'errdown', 'errup' (and fit parameters if fit=True)."""
+  if not isinstance(fnames,(list,tuple)):
+    fnames = [fnames]
+  opts    = dict(poi=poi,slices=sorted((slices or { }).items()),fit=fit,asymmetric=asymmetric,
+                 level=level,interp=interp,bestfit=bestfit)
+  results = [None]*len(fnames)
+  paths   = [getcachepath(f,**opts) if cache else None for f in fnames]
+  todo    = [ ]
+  for i, (fname, path) in enumerate(zip(fnames,paths)):
+    if path and os.path.isfile(path):
+      with open(path) as file:
+        results[i] = json.load(file)
+      if verb>=2:
+        print(">>> measurescans: Loaded result for %s from %s"%(fname,path))
+    else:
+      todo.append(i)
+  if todo:
+    scans = [readscan(fnames[i],poi=poi,slices=slices,bestfit=bestfit) for i in todo]
+    xvals, yvals = padscans(scans)
+    if fit:
+      arrays = fitscans(xvals,yvals,asymmetric=asymmetric)
+    else:
+      arrays = analyzescans(xvals,yvals,level=level,interp=interp)
+    for j, i in enumerate(todo):
+      result = { k: (None if np.isnan(v[j]) else float(v[j])) for k, v in arrays.items() }
+      results[i] = result
+      if paths[i]:
+        if not os.path.isdir(os.path.dirname(paths[i])):
+          os.makedirs(os.path.dirname(paths[i]))
+        with open(paths[i],'w') as file:
+          json.dump(result,file)
+      if verb>=1:
+        print(">>> measurescans: %s = %s -%s +%s in %s"%(poi,result['x'],result['errdown'],result['errup'],fnames[i]))
+  return results
+
@@ -0,0 +1,426 @@
+# Author: Izaak Neutelings (November 2023)
+# Description: Columnar version of ModuleMuTau: pre-select mutau events in chunks with awkward arrays
+#              Run with processors/picojob_columnar.py instead of picojob.py
+import sys
+from TauFW.PicoProducer.analysis.ModuleMuTau import *
+from TauFW.PicoProducer.analysis.utils import getmetbranches, getmetfilterlist
+from TauFW.PicoProducer.analysis.columnar import *
+
+
+class ModuleMuTauColumnar(ColumnarModule,ModuleMuTau):
+  """Select mutau events like ModuleMuTau, but process chunks of events at once.
+  Selections, pairing, lepton vetoes, gen-matching, jet cleaning & counting, and the MET & dilepton variables
+  are computed with array operations; correction tools are only evaluated for the selected events.
+  Module options are passed on to ModuleTauPair, e.g. -E btagtable=True to evaluate b tag SFs from lookup tables."""
+
+  def __init__(self, fname, **kwargs):
+    ensurecolumnar()
+    super(ModuleMuTauColumnar,self).__init__(fname,**kwargs)
+    if self.dojec or self.dojecsys:
+      raise NotImplementedError("ModuleMuTauColumnar: JEC variations are not implemented in columnar mode! Please use ModuleMuTau.")
+    if self.dopdf:
+      raise NotImplementedError("ModuleMuTauColumnar: PDF weights are not implemented in columnar mode! Please use ModuleMuTau.")
+
+    # TRIGGERS (array versions of ModuleMuTau)
+    if self.year==2016:
+      self.trigbranches = ['HLT_IsoMu24','HLT_IsoTkMu24']
+      self.trigger      = lambda e: e.HLT_IsoMu24 | e.HLT_IsoTkMu24
+    elif self.year==2017:
+      self.trigbranches = ['HLT_IsoMu24','HLT_IsoMu27']
+      self.trigger      = lambda e: e.HLT_IsoMu24 | e.HLT_IsoMu27
+      self.muonCutPt    = lambda e: np.where(e.HLT_IsoMu24,26,29)
+    else:
+      self.trigbranches = ['HLT_IsoMu24','HLT_IsoMu27']
+      self.trigger      = lambda e: e.HLT_IsoMu24 | e.HLT_IsoMu27
+
+    # BRANCHES
+    self.metbranches  = getmetbranches(self.era,useT1=self.useT1)
+    self.metfilters   = getmetfilterlist(self.era,self.isdata)
+    self.muonfields   = ['pt','eta','phi','mass','dxy','dz','charge','pfRelIso04_all','tkRelIso','mediumId','tightId','highPtId']
+    self.taufields    = ['pt','eta','phi','mass','dxy','dz','charge','decayMode','jetIdx',
+                         'rawIso','chargedIso','neutralIso','leadTkPtOverTauPt','photonsOutsideSignalCone','puCorr',
+                         'idDecayMode','idDecayModeNewDMs',
+                         'idDeepTau2017v2p1VSe','idDeepTau2017v2p1VSmu','idDeepTau2017v2p1VSjet',
+                         'rawDeepTau2017v2p1VSe','rawDeepTau2017v2p1VSmu','rawDeepTau2017v2p1VSjet']
+    self.jetfields    = ['pt','eta','phi','jetId','btagDeepFlavB']
+    if self.ismc:
+      self.muonfields += ['genPartFlav']
+      self.taufields  += ['genPartFlav']
+      self.jetfields  += ['partonFlavour']
+    self.branches  = ['run','luminosityBlock','event','PV_npvs','PV_npvsGood']
+    self.branches += self.trigbranches+self.metfilters+list(self.metbranches)
+    self.branches += ['Muon_'+f for f in self.muonfields]+['Tau_'+f for f in self.taufields]+['Jet_'+f for f in self.jetfields]
+    self.branches += getvetobranches(self.era)
+    if self.ismc:
+      self.branches += ['genWeight','Pileup_nPU','Pileup_nTrueInt','GenMET_pt','GenMET_phi','LHE_Njets',
+                        'Jet_genJetIdx','GenJet_pt','GenVisTau_pt','GenVisTau_eta','GenVisTau_phi','GenVisTau_status']
+      if self.domutau or self.dozpt or self.dotoppt:
+        self.branches += ['GenPart_'+f for f in ['pdgId','status','statusFlags','genPartIdxMother','pt','eta','phi','mass']]
+    self.branches = list(dict.fromkeys(self.branches)) # remove duplicates, keep order
+
+    # MISSING BRANCHES (like ModuleTauPair.beginFile for nanoAODv9 & v10)
+    self.aliases = {
+      'Muon_isTracker':                  [True],
+      'Electron_lostHits':               [0],
+      'Electron_mvaFall17V2Iso_WPL':     ('Electron_mvaFall17Iso_WPL','Electron_mvaIso_WPL'),
+      'Electron_mvaFall17V2Iso_WP90':    ('Electron_mvaFall17Iso_WP90','Electron_mvaIso_WP90'),
+      'Tau_idDecayMode':                 [True], # not available anymore in nanoAODv9
+      'Tau_idDecayModeNewDMs':           [True], # not available anymore in nanoAODv9
+      'LHE_Njets':                       -1,
+    }
+    if self.year==2016:
+      for trigger in self.trigbranches:
+        self.aliases[trigger] = False
+
+
+  def fillhists(self, events):
+    """Fill common histograms (cutflow etc.) before any cuts for a chunk of events.
+    Return mask of events that pass."""
+    nevts = len(events)
+    self.out.cutflow.fill('none',nevts)
+    if self.isdata:
+      passed = ak.to_numpy(events.PV_npvs>0) # for pre-UL 2017 bug in 0 PU
+      self.out.cutflow.fill('weight',nevts)
+      self.out.cutflow.fill('weight_no0PU',passed.sum())
+    else: # ismc
+      genweight = ak.to_numpy(events.genWeight)
+      passed    = ak.to_numpy(events.Pileup_nTrueInt>0) # bug in pre-UL 2017 caused small fraction of events with nPU<=0
+      self.out.cutflow.fill('weight',genweight.sum())
+      fillhist(self.out.pileup,events.Pileup_nTrueInt)
+      self.out.cutflow.fill('weight_no0PU',genweight[passed].sum())
+      if self.domutau: # mutau filter efficiencies for stitching of different DY samples (DYJetsToTauTauToMuTauh)
+        ismutau = filtermutau(events)
+        events['ismutau'] = ismutau # store with events for later filtering
+        weights = (genweight*ismutau)[passed]
+        nup     = ak.to_numpy(events.LHE_Njets)[passed]
+        self.out.cutflow.fill('weight_mutaufilter',weights.sum())
+        self.out.cutflow.fill('weight_mutaufilter_NUP0orp4',weights[(nup==0) | (nup>4)].sum())
+        for njets in range(1,5):
+          self.out.cutflow.fill('weight_mutaufilter_NUP%d'%(njets),weights[nup==njets].sum())
+    return passed
+
+
+  def applyes(self, taus):
+    """Apply tau energy scale (TES), and lepton/jet -> tau fake energy scale to jagged array of taus."""
+    counts   = ak.num(taus)
+    genmatch = ak.to_numpy(ak.flatten(taus.genPartFlav))
+    es       = np.ones(len(genmatch))
+    real     = genmatch==5 # real tau
+    if self.tes!=None: # user-defined energy scale (for TES studies)
+      es[real] = self.tes
+    else: # recommended energy scale (apply by default)
+      pts, dms = ak.to_numpy(ak.flatten(taus.pt))[real], ak.to_numpy(ak.flatten(taus.decayMode))[real]
+      es[real] = [self.tesTool.getTES(pt,dm,unc=self.tessys) for pt, dm in zip(pts,dms)]
+    if self.ltf: # lepton -> tau fake
+      es[(genmatch>0) & (genmatch<5)] = self.ltf
+    if self.jtf!=1.0: # jet -> tau fake
+      es[genmatch==0] = self.jtf
+    es = ak.unflatten(es,counts)
+    taus['pt']   = taus.pt*es
+    taus['mass'] = taus.mass*es
+    taus['es']   = es # store for propagating to MET
+    return taus
+
+
+  def process(self, events):
+    """Process and pre-select a chunk of events; fill branches of all events that pass."""
+    sys.stdout.flush()
+
+
+    ##### NO CUT #####################################
+    events = events[self.fillhists(events)]
+
+
+    ##### TRIGGER ####################################
+    events = events[ak.to_numpy(self.trigger(events))]
+    self.out.cutflow.fill('trig',len(events))
+
+
+    ##### MUON #######################################
+    muons = getcollection(events,'Muon',self.muonfields)
+    muons = muons[(muons.pt>=self.muonCutPt(events)) & (abs(muons.eta)<=self.muonCutEta(events)) &
+                  (abs(muons.dz)<=0.2) & (abs(muons.dxy)<=0.045) & muons.mediumId & (muons.pfRelIso04_all<=0.50)]
+    mask   = ak.to_numpy(ak.num(muons)>0)
+    events, muons = events[mask], muons[mask]
+    self.out.cutflow.fill('muon',len(events))
+
+
+    ##### TAU ########################################
+    taus = getcollection(events,'Tau',self.taufields)
+    dm   = taus.decayMode
+    taus = taus[(abs(taus.eta)<=self.tauCutEta) & (abs(taus.dz)<=0.2) & ((dm==0) | (dm==1) | (dm==10) | (dm==11)) &
+                (abs(taus.charge)==1) & (taus.idDeepTau2017v2p1VSe>=1) & (taus.idDeepTau2017v2p1VSmu>=1) &
+                (taus.idDeepTau2017v2p1VSjet>=self.tauwp)]
+    if self.ismc:
+      taus = self.applyes(taus)
+    taus = taus[taus.pt>=self.tauCutPt]
+    mask = ak.to_numpy(ak.num(taus)>0)
+    events, muons, taus = events[mask], muons[mask], taus[mask]
+    self.out.cutflow.fill('tau',len(events))
+
+
+    ##### MUTAU PAIR #################################
+    pairs = ak.cartesian({ 'mu': muons, 'tau': taus },axis=1)
+    pairs = pairs[deltaR(pairs.mu.eta,pairs.mu.phi,pairs.tau.eta,pairs.tau.phi)>=0.5]
+    mask  = ak.to_numpy(ak.num(pairs)>0)
+    events, pairs = events[mask], pairs[mask]
+    order = ak.zip({ 'pt1': pairs.mu.pt, 'pt2': pairs.tau.pt, 'iso1': pairs.mu.pfRelIso04_all, 'iso2': pairs.tau.rawDeepTau2017v2p1VSjet })
+    pairs = ak.flatten(pairs[getbest(order,[('pt1',True),('pt2',True),('iso1',False),('iso2',True)])]) # like LeptonTauPair.__gt__
+    muon, tau = pairs.mu, pairs.tau
+    self.out.cutflow.fill('pair',len(events))
+
+
+    # VETOES
+    vetoes_notau = getlepvetoes(events,muon.idx,None,tau,self.channel,self.era)
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(events,muon.idx,None,None,self.channel,self.era)
+    lepton_vetoes       = extramuon_veto | extraelec_veto | dilepton_veto
+    lepton_vetoes_notau = vetoes_notau[0] | vetoes_notau[1] | vetoes_notau[2]
+
+    # TIGHTEN PRE-SELECTION
+    if self.dotight: # do not save all events to reduce disk space
+      mask = np.ones(len(events),dtype=bool)
+      fail = (lepton_vetoes & lepton_vetoes_notau) | ak.to_numpy((tau.idDeepTau2017v2p1VSjet<1) |\
+             (tau.idDeepTau2017v2p1VSmu<2) | (tau.idDeepTau2017v2p1VSe<1))
+      if self.ismc and (self.tes not in [1,None] or self.tessys!=None):
+        mask &= ~fail & ak.to_numpy(tau.genPartFlav==5)
+      if self.ismc and (self.ltf not in [1,None] or self.fes!=None):
+        mask &= ak.to_numpy((tau.genPartFlav>=1) & (tau.genPartFlav<=4))
+      events, muon, tau = events[mask], muon[mask], tau[mask]
+      extramuon_veto, extraelec_veto, dilepton_veto = extramuon_veto[mask], extraelec_veto[mask], dilepton_veto[mask]
+      lepton_vetoes, lepton_vetoes_notau = lepton_vetoes[mask], lepton_vetoes_notau[mask]
+    nevts = len(events)
+    if nevts==0:
+      return 0
+
+    # EVENT
+    cols = { }
+    cols['extramuon_veto']      = extramuon_veto
+    cols['extraelec_veto']      = extraelec_veto
+    cols['dilepton_veto']       = dilepton_veto
+    cols['lepton_vetoes']       = lepton_vetoes
+    cols['lepton_vetoes_notau'] = lepton_vetoes_notau
+    self.fillEventColumns(events,cols)
+
+
+    # MUON
+    cols['pt_1']                       = muon.pt
+    cols['eta_1']                      = muon.eta
+    cols['phi_1']                      = muon.phi
+    cols['m_1']                        = muon.mass
+    cols['y_1']                        = getrapidity(muon.pt,muon.eta,muon.mass)
+    cols['dxy_1']                      = muon.dxy
+    cols['dz_1']                       = muon.dz
+    cols['q_1']                        = muon.charge
+    cols['iso_1']                      = muon.pfRelIso04_all # relative isolation
+    cols['tkRelIso_1']                 = muon.tkRelIso
+    cols['idMedium_1']                 = muon.mediumId
+    cols['idTight_1']                  = muon.tightId
+    cols['idHighPt_1']                 = muon.highPtId
+
+
+    # TAU
+    cols['pt_2']                       = tau.pt
+    cols['eta_2']                      = tau.eta
+    cols['phi_2']                      = tau.phi
+    cols['m_2']                        = tau.mass
+    cols['y_2']                        = getrapidity(tau.pt,tau.eta,tau.mass)
+    cols['dxy_2']                      = tau.dxy
+    cols['dz_2']                       = tau.dz
+    cols['q_2']                        = tau.charge
+    cols['dm_2']                       = tau.decayMode
+    cols['iso_2']                      = tau.rawIso
+    cols['idiso_2']                    = getidiso(ak.to_numpy(tau.rawIso),ak.to_numpy(tau.photonsOutsideSignalCone),ak.to_numpy(tau.pt)) # cut-based tau isolation (rawIso)
+    cols['rawDeepTau2017v2p1VSe_2']    = tau.rawDeepTau2017v2p1VSe
+    cols['rawDeepTau2017v2p1VSmu_2']   = tau.rawDeepTau2017v2p1VSmu
+    cols['rawDeepTau2017v2p1VSjet_2']  = tau.rawDeepTau2017v2p1VSjet
+    cols['idDecayMode_2']              = tau.idDecayMode
+    cols['idDecayModeNewDMs_2']        = tau.idDecayModeNewDMs
+    cols['idDeepTau2017v2p1VSe_2']     = tau.idDeepTau2017v2p1VSe
+    cols['idDeepTau2017v2p1VSmu_2']    = tau.idDeepTau2017v2p1VSmu
+    cols['idDeepTau2017v2p1VSjet_2']   = tau.idDeepTau2017v2p1VSjet
+    cols['chargedIso_2']               = tau.chargedIso
+    cols['neutralIso_2']               = tau.neutralIso
+    cols['leadTkPtOverTauPt_2']        = tau.leadTkPtOverTauPt
+    cols['photonsOutsideSignalCone_2'] = tau.photonsOutsideSignalCone
+    cols['puCorr_2']                   = tau.puCorr
+
+
+    # GENERATOR
+    if self.ismc:
+      cols['genmatch_1']         = muon.genPartFlav
+      cols['genmatch_2']         = tau.genPartFlav
+      cols['genvistaupt_2'], cols['genvistaueta_2'], cols['genvistauphi_2'], cols['gendm_2'] = matchgenvistau(events,tau)
+      if self.domutau:
+        cols['mutaufilter']      = events.ismutau # for stitching DYJetsToTauTauToMuTauh
+
+
+    # JETS
+    jets = self.fillJetColumns(events,muon,tau,cols)
+    cols['jpt_match_2'], jpt_genmatch = matchtaujet(events,tau,self.ismc)
+    if self.ismc:
+      cols['jpt_genmatch_2'] = jpt_genmatch
+
+
+    # WEIGHTS
+    if self.ismc:
+      self.fillCommonCorrColumns(events,jets,cols)
+      mask = ak.to_numpy((muon.pfRelIso04_all<0.50) & (tau.idDeepTau2017v2p1VSjet>=2))
+      self.btagTool.fillEffMaps(getobjects(ak.flatten(jets[mask])),usejec=self.dojec)
+
+      # MUON WEIGHTS
+      pts, etas = ak.to_numpy(muon.pt), ak.to_numpy(muon.eta)
+      cols['trigweight']    = self.muSFs.getTriggerSFs(pts,etas) # assume leading muon was triggered on
+      cols['idisoweight_1'] = self.muSFs.getIdIsoSFs(pts,etas)
+
+      # TAU WEIGHTS
+      self.fillTauWeightColumns(tau,cols)
+      cols['weight'] = cols['genweight']*cols['puweight']*cols['trigweight']*cols['idisoweight_1']
+    elif self.isembed:
+      dm = ak.to_numpy(tau.decayMode)
+      cols['genweight']   = events.genWeight
+      cols['trackweight'] = np.select([dm==0,dm==1,dm==10,dm==11],[0.975,1.0247,0.927,0.974],1.0)
+
+
+    # MET & DILEPTON VARIABLES
+    self.fillMETAndDiLeptonColumns(events,muon,tau,cols)
+
+
+    return self.fillcolumns(cols,nevts)
+
+
+  def fillEventColumns(self, events, cols):
+    """Help function to compute common event variables, like ModuleTauPair.fillEventBranches."""
+    cols['evt']      = events.event
+    cols['run']      = events.run
+    cols['lumi']     = events.luminosityBlock
+    cols['npv']      = events.PV_npvs
+    cols['npv_good'] = events.PV_npvsGood
+    cols['metfilter'] = np.all([ak.to_numpy(events[f]) for f in self.metfilters],axis=0)
+    if self.ismc:
+      cols['genmet']    = events.GenMET_pt
+      cols['genmetphi'] = events.GenMET_phi
+      cols['npu']       = events.Pileup_nPU
+      cols['npu_true']  = events.Pileup_nTrueInt
+      cols['NUP']       = events.LHE_Njets
+
+
+  def fillJetColumns(self, events, tau1, tau2, cols):
+    """Help function to select jets and b tags, after removing overlap with tau decay candidates,
+    and compute the jet variables, like ModuleTauPair.fillJetBranches. Return selected jets."""
+    jets  = getcollection(events,'Jet',self.jetfields)
+    jets  = jets[(abs(jets.eta)<=4.7) & (deltaR(jets.eta,jets.phi,tau1.eta,tau1.phi)>=0.5) &
+                 (deltaR(jets.eta,jets.phi,tau2.eta,tau2.phi)>=0.5) & (jets.jetId>=2) & (jets.pt>=self.jetCutPt)]
+    jets  = jets[ak.argsort(jets.pt,ascending=False,stable=True)]
+    bjets = jets[(jets.btagDeepFlavB>self.deepjet_wp.medium) & (abs(jets.eta)<self.bjetCutEta)]
+    central = abs(jets.eta)<=2.4
+    cols['njets']      = ak.num(jets)
+    cols['njets50']    = ak.sum(jets.pt>50,axis=1)
+    cols['nfjets']     = ak.sum(~central,axis=1)
+    cols['ncjets']     = ak.sum(central,axis=1)
+    cols['ncjets50']   = ak.sum(central & (jets.pt>50),axis=1)
+    cols['nbtag']      = ak.num(bjets)
+
+    # LEADING JETS
+    jets_ = ak.pad_none(jets,2)
+    for i in [0,1]:
+      cols['jpt_%d'%(i+1)]      = tonumpy(jets_.pt[:,i],-1.)
+      cols['jeta_%d'%(i+1)]     = tonumpy(jets_.eta[:,i],-9.)
+      cols['jphi_%d'%(i+1)]     = tonumpy(jets_.phi[:,i],-9.)
+      cols['jdeepjet_%d'%(i+1)] = tonumpy(jets_.btagDeepFlavB[:,i],-9.)
+
+    # LEADING B JETS
+    bjets_ = ak.pad_none(bjets,2)
+    for i in [0,1]:
+      cols['bpt_%d'%(i+1)]      = tonumpy(bjets_.pt[:,i],-1.)
+      cols['beta_%d'%(i+1)]     = tonumpy(bjets_.eta[:,i],-9.)
+
+    return jets
+
+
+  def fillCommonCorrColumns(self, events, jets, cols):
+    """Help function to apply common corrections, and compute weights, like ModuleTauPair.fillCommonCorrBranches."""
+    if self.dozpt:
+      cols['pt_moth'], cols['m_moth'] = getzboson(events)
+      cols['zptweight']  = np.array([self.zptTool.getZptWeight(pt,m) for pt, m in zip(cols['pt_moth'],cols['m_moth'])])
+    elif self.dotoppt:
+      cols['pt_moth1'], cols['pt_moth2'] = gettoppt(events)
+      cols['ttptweight'] = np.array([getTopPtWeight(pt1,pt2) for pt1, pt2 in zip(cols['pt_moth1'],cols['pt_moth2'])])
+    cols['genweight'] = ak.to_numpy(events.genWeight)
+    cols['puweight']  = self.puTool.getWeights(ak.to_numpy(events.Pileup_nTrueInt))
+
+    # B TAG WEIGHT: product of SFs of all jets within the b tag acceptance
+    flat = ak.flatten(jets)
+    cols['btagweight'] = self.btagTool.getWeights(ak.to_numpy(flat.pt),ak.to_numpy(flat.eta),ak.to_numpy(flat.partonFlavour),
+                                                  ak.to_numpy(self.btagTool.tagged(flat)),ak.to_numpy(ak.num(jets)))
+
+
+  def fillTauWeightColumns(self, tau, cols):
+    """Help function to compute tau ID and lepton -> tau fake SFs for the selected taus."""
+    nevts = len(tau)
+    keys  = ['idweight_2','idweight_dm_2','idweight_medium_2','ltfweight_2']
+    if self.dosys:
+      keys += ['idweightUp_2','idweightDown_2','idweightUp_dm_2','idweightDown_dm_2','ltfweightUp_2','ltfweightDown_2']
+    for key in keys: # DEFAULTS
+      cols[key] = np.ones(nevts)
+    pts, etas = ak.to_numpy(tau.pt), ak.to_numpy(tau.eta)
+    dms, gms  = ak.to_numpy(tau.decayMode), ak.to_numpy(tau.genPartFlav)
+    for i in np.nonzero(gms==5)[0]: # real tau
+      cols['idweight_2'][i]          = self.tauSFsT.getSFvsPT(pts[i])
+      cols['idweight_medium_2'][i]   = self.tauSFsM.getSFvsPT(pts[i])
+      cols['idweight_dm_2'][i]       = self.tauSFsT_dm.getSFvsDM(pts[i],dms[i])
+      if self.dosys:
+        cols['idweightUp_2'][i]      = self.tauSFsT.getSFvsPT(pts[i],unc='Up')
+        cols['idweightDown_2'][i]    = self.tauSFsT.getSFvsPT(pts[i],unc='Down')
+        cols['idweightUp_dm_2'][i]   = self.tauSFsT_dm.getSFvsDM(pts[i],dms[i],unc='Up')
+        cols['idweightDown_dm_2'][i] = self.tauSFsT_dm.getSFvsDM(pts[i],dms[i],unc='Down')
+    for gms_, sftool in [((1,3),self.etfSFs),((2,4),self.mtfSFs)]: # lepton -> tau fake
+      for i in np.nonzero(np.isin(gms,gms_))[0]:
+        cols['ltfweight_2'][i]       = sftool.getSFvsEta(etas[i],gms[i])
+        if self.dosys:
+          cols['ltfweightUp_2'][i]   = sftool.getSFvsEta(etas[i],gms[i],unc='Up')
+          cols['ltfweightDown_2'][i] = sftool.getSFvsEta(etas[i],gms[i],unc='Down')
+
+
+  def fillMETAndDiLeptonColumns(self, events, tau1, tau2, cols):
+    """Help function to compute variables related to the MET and visible tau candidates,
+    like ModuleTauPair.fillMETAndDiLeptonBranches."""
+    pt1, eta1, phi1, m1 = [ak.to_numpy(tau1[f]) for f in ['pt','eta','phi','mass']]
+    pt2, eta2, phi2, m2 = [ak.to_numpy(tau2[f]) for f in ['pt','eta','phi','mass']]
+    metpt, metphi = [ak.to_numpy(events[b]) for b in self.metbranches]
+    metpx, metpy  = metpt*np.cos(metphi), metpt*np.sin(metphi)
+
+    # PROPAGATE TES/LTF/JTF shift to MET (assume shift is already applied to object)
+    if self.ismc:
+      es     = ak.to_numpy(tau2.es)
+      scale  = pt2*(1.-1./es)
+      metpx  = metpx - scale*np.cos(phi2)
+      metpy  = metpy - scale*np.sin(phi2)
+      metpt  = np.sqrt(metpx**2+metpy**2)
+      metphi = np.arctan2(metpy,metpx)
+
+    # MET
+    cols['met']       = metpt
+    cols['metphi']    = metphi
+    cols['mt_1']      = np.sqrt(2*pt1*metpt*(1-np.cos(deltaPhi(phi1,metphi))))
+    cols['mt_2']      = np.sqrt(2*pt2*metpt*(1-np.cos(deltaPhi(phi2,metphi))))
+
+    # PZETA
+    zetax, zetay      = np.cos(phi1)+np.cos(phi2), np.sin(phi1)+np.sin(phi2) # bisector of visible tau candidates
+    norm              = np.sqrt(zetax**2+zetay**2)
+    zetax, zetay      = zetax/norm, zetay/norm
+    px1, py1, pz1, e1 = getp4(pt1,eta1,phi1,m1)
+    px2, py2, pz2, e2 = getp4(pt2,eta2,phi2,m2)
+    pzetavis          = (px1+px2)*zetax + (py1+py2)*zetay # projection of visible ditau momentum onto zeta axis
+    pzetamiss         = metpx*zetax + metpy*zetay # projection of MET onto zeta axis
+    cols['pzetamiss'] = pzetamiss
+    cols['pzetavis']  = pzetavis
+    cols['dzeta']     = pzetamiss - 0.85*pzetavis
+
+    # DILEPTON
+    cols['m_vis']     = getmass(px1+px2,py1+py2,pz1+pz2,e1+e2)
+    cols['pt_ll']     = np.sqrt((px1+px2)**2+(py1+py2)**2)
+    cols['dR_ll']     = deltaR(eta1,phi1,eta2,phi2)
+    cols['dphi_ll']   = deltaPhi(phi1,phi2)
+    cols['deta_ll']   = abs(eta1-eta2)
+    cols['chi']       = np.exp(abs(getrapidity(pt1,eta1,m1)-getrapidity(pt2,eta2,m2)))
+
@@ -55,6 +55,8 @@ class ModuleTauPair(Module):
     self.dojec      = kwargs.get('jec',      False          ) and self.ismc #and self.year==2016 #False
     self.dojecsys   = kwargs.get('jecsys',   self.dojec     ) and self.ismc and self.dosys #and self.dojec #and False
     self.useT1      = kwargs.get('useT1',    False          ) # MET T1 for backwards compatibility with old nanoAOD-tools JME corrector
+    self.btagtable  = kwargs.get('btagtable', False         ) # tabulate b tag SFs instead of evaluating the reader per jet (see BTagSFTable)
+    self.buffer     = kwargs.get('buffer',   0              ) # number of events to buffer before filling the tree in bulk
     self.verbosity  = kwargs.get('verb',     0              ) # verbosity
     self.jetCutPt   = 30
     self.bjetCutEta = 2.4 if self.year==2016 else 2.5
@@ -74,7 +76,8 @@ class ModuleTauPair(Module):
     self.metUncLabels = [ ]
     if self.ismc:
       self.puTool      = PileupWeightTool(era=self.era,sample=self.filename,verb=self.verbosity)
-      self.btagTool    = BTagWeightTool('DeepJet','medium',era=self.era,channel=self.channel,maxeta=self.bjetCutEta) #,loadsys=not self.dotight
+      self.btagTool    = BTagWeightTool('DeepJet','medium',era=self.era,channel=self.channel,maxeta=self.bjetCutEta,
+                                        usetable=self.btagtable) #,loadsys=not self.dotight
       if self.dozpt:
         self.zptTool  = ZptCorrectionTool(era=self.era)
       #if self.dorecoil:
@@ -123,6 +126,7 @@ class ModuleTauPair(Module):
     print(">>> %-12s = %s"%('dosys',     self.dosys))
     print(">>> %-12s = %s"%('dotight',   self.dotight))
     print(">>> %-12s = %s"%('useT1',     self.useT1))
+    print(">>> %-12s = %s"%('btagtable', self.btagtable))
     print(">>> %-12s = %s"%('jetCutPt',  self.jetCutPt))
     print(">>> %-12s = %s"%('bjetCutEta',self.bjetCutEta))
     
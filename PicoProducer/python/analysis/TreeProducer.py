@@ -11,6 +11,7 @@
 #   Float_t   'F'     'f'/'float32'        32-bit float
 #   Double_t  'D'     'd'/'float64'/float  64-bit float
 import numpy as np
+import ROOT
 from ROOT import TTree, TFile, TH1D, TH2D, gDirectory, kRed
 from TauFW.common.tools.root import ensureTFile
 from TauFW.PicoProducer.analysis.Cutflow import Cutflow
@@ -31,6 +32,30 @@ np_dtype = { # ROOT -> numpy data type
 }
 
 
+_fillcode = """
+#include "TTree.h"
+#include <cstring>
+namespace TauFW {
+  // fill tree from buffer of records, copying each record to the branch addresses
+  Long64_t fillTreeFromBuffer(TTree* tree, ULong64_t record, ULong64_t buffer, ULong64_t itemsize, Long64_t nevts) {
+    char* rec = reinterpret_cast<char*>(record);
+    const char* buf = reinterpret_cast<const char*>(buffer);
+    for (Long64_t i=0; i<nevts; ++i) {
+      std::memcpy(rec,buf+i*itemsize,itemsize);
+      tree->Fill();
+    }
+    return nevts;
+  }
+}
+"""
+def fillfrombuffer(tree,record,buffer,nevts):
+  """Fill tree with the first nevts records of a structured numpy array in C++,
+  given that the branch addresses point to the fields of a single record."""
+  if not hasattr(ROOT,'TauFW') or not hasattr(ROOT.TauFW,'fillTreeFromBuffer'):
+    ROOT.gInterpreter.Declare(_fillcode)
+  return ROOT.TauFW.fillTreeFromBuffer(tree,record.ctypes.data,buffer.ctypes.data,record.dtype.itemsize,nevts)
+  
+
 class TreeProducer(object):
   """Base class to create and prepare a custom output file & tree for analysis modules."""
   
@@ -48,6 +73,11 @@ class TreeProducer(object):
     self.pileup    = TH1D('pileup', 'pileup', 100, 0, 100)
     self.tree      = TTree('tree','tree')
     self.hists     = { } #OrderedDict() # extra histograms to be drawn
+    self.bufsize   = kwargs.get('buffer',getattr(module,'buffer',0)) or 0 # number of events to buffer before filling the tree in bulk
+    self.branches  = [ ] # list of (branch name, array name) for buffering
+    self.record    = None # structured array with branch addresses of a single event
+    self.buffer    = None # structured array with buffered events
+    self.nbuffered = 0 # number of buffered events
   
   def addHist(self,name,*args,**kwargs):
     """Add a histogram. Call as
@@ -132,6 +162,9 @@ class TreeProducer(object):
       raise IOError("Class attribute or branch with name %r already exists! Please rename this branch..."%(name))
     if not arrname:
       arrname = name
+    if self.record is not None: # rebuild record and buffer with new branch
+      self.flush()
+      self.record = self.buffer = None
     arrlen = kwargs.get('len',None) # make vector branch
     if arrlen: # vector branch
       if isinstance(arrlen,int): # integer: vector branch with fixed length
@@ -171,8 +204,47 @@ class TreeProducer(object):
           print(">>> TreeProducer.addBranch: Set default value %s to single value %r: %r"%(arrname,default,address))
     if title:
       branch.SetTitle(title)
+    self.branches.append((name,arrname))
     return branch
   
+  def initbuffer(self,size=None):
+    """Move the addresses of all branches into the fields of a single structured record,
+    and create a buffer of records to fill the tree in bulk."""
+    size    = max(size or 0,self.bufsize,1)
+    fields  = [(a,getattr(self,a).dtype,getattr(self,a).shape if len(getattr(self,a))>1 else ()) for b, a in self.branches]
+    record  = np.zeros(1,dtype=np.dtype(fields,align=True))
+    for bname, arrname in self.branches:
+      address = getattr(self,arrname)
+      view    = record[arrname][0] if len(address)>1 else record[arrname] # view of field in record
+      view[:] = address # copy default value
+      setattr(self,arrname,view)
+      self.tree.GetBranch(bname).SetAddress(view)
+    if self.verbosity>=1:
+      print(">>> TreeProducer.initbuffer: Buffering %d events of %d branches (%d bytes per event)"%(size,len(self.branches),record.dtype.itemsize))
+    self.record    = record
+    self.buffer    = np.zeros(size,dtype=record.dtype)
+    self.nbuffered = 0
+    return self.buffer
+  
+  def flush(self):
+    """Fill tree with all buffered events."""
+    if self.nbuffered>0:
+      fillfrombuffer(self.tree,self.record,self.buffer,self.nbuffered)
+      self.nbuffered = 0
+  
+  def fillcolumns(self,columns,nevts):
+    """Fill tree in bulk with a dictionary of arrays of nevts events, { branch name: array },
+    e.g. from a columnar module. Branches that are not given keep their current value."""
+    if self.record is None:
+      self.initbuffer(nevts)
+    self.flush()
+    buffer = self.buffer if len(self.buffer)>=nevts else np.zeros(nevts,dtype=self.record.dtype)
+    buffer[:nevts] = self.record[0] # current values, e.g. defaults
+    arrnames = dict(self.branches)
+    for bname, array in columns.items():
+      buffer[arrnames.get(bname,bname)][:nevts] = array
+    return fillfrombuffer(self.tree,self.record,buffer,nevts)
+  
   def setAlias(self,newbranch,oldbranch):
     """Set an alias for a variable or mathematical expression of the other branches."""
     # https://root.cern.ch/doc/master/classTTree.html#a7c505db0d8ed56b5581e683375eb78e1
@@ -185,11 +257,20 @@ class TreeProducer(object):
     """Fill tree."""
     if hname: # fill histograms for this key
       return self.hists[hname].Fill(*args)
+    elif self.bufsize>0: # copy current values to buffer, and fill trees in bulk
+      if self.record is None:
+        self.initbuffer()
+      self.buffer[self.nbuffered] = self.record[0]
+      self.nbuffered += 1
+      if self.nbuffered>=len(self.buffer):
+        self.flush()
+      return 1
     else: # fill trees
       return self.tree.Fill()
   
   def endJob(self):
     """Write and close files after the job ends."""
+    self.flush()
     if self.cutflow and self.display:
       nfinal = self.tree.GetEntries() if self.tree else None
       self.cutflow.display(nfinal=nfinal,final="stored in tree")
@@ -0,0 +1,347 @@
+# Author: Izaak Neutelings (November 2023)
+# Description: Help functions for columnar (array-at-a-time) processing of nanoAOD with awkward arrays
+# Sources:
+#   https://awkward-array.org/doc/main/
+#   https://uproot.readthedocs.io/en/latest/uproot.behaviors.TBranch.iterate.html
+import json
+from types import SimpleNamespace
+from math import pi
+from TauFW.common.tools.log import Logger
+LOG = Logger('Columnar')
+try:
+  import numpy as np
+  import awkward as ak
+  import uproot
+except ImportError: # checked by ensurecolumnar
+  np = ak = uproot = None
+
+
+def ensurecolumnar():
+  """Check if the packages needed for columnar processing are available."""
+  if np==None or ak==None or uproot==None:
+    LOG.throw(ImportError,"Columnar processing requires numpy, awkward and uproot! Please install them, e.g. with 'pip install awkward uproot'.")
+
+
+def iterevents(filenames,branches,treename='Events',chunksize=100000,firstevt=0,maxevts=None,aliases={ },verb=0):
+  """Iterate over chunks of events of a list of nanoAOD files with uproot, reading only the given branches.
+  Missing branches are redirected to another branch (or the first existing one of a tuple of branches),
+  or set to a default value (a list like [True] for a jagged branch), similar to ensurebranches.
+  Yields awkward arrays of records with the flat nanoAOD branch names as fields, e.g. events.Muon_pt."""
+  ensurecolumnar()
+  nread = 0
+  for filename in filenames:
+    if maxevts!=None and maxevts>0 and nread>=maxevts: break
+    LOG.verb("iterevents: Opening %s..."%(filename),verb,1)
+    with uproot.open(filename) as file:
+      tree   = file[treename]
+      nevts  = tree.num_entries
+      start  = min(firstevt,nevts)
+      stop   = nevts if maxevts==None or maxevts<0 else min(nevts,start+maxevts-nread)
+      firstevt = max(0,firstevt-nevts) # first event index of next file
+      exists = set(tree.keys())
+      redirs = { } # new -> old branch name
+      for branch in branches:
+        if branch in exists: continue
+        alias = aliases.get(branch,None)
+        if isinstance(alias,(str,tuple)):
+          olds = [b for b in ((alias,) if isinstance(alias,str) else alias) if b in exists]
+          if olds:
+            LOG.verb("iterevents: directing %r -> %r"%(branch,olds[0]),verb,1)
+            redirs[branch] = olds[0]
+      toread = set(b for b in branches if b in exists) | set(redirs.values())
+      LOG.verb("iterevents: Reading %d/%d branches of events %d-%d..."%(len(toread),len(exists),start,stop),verb,1)
+      for events in tree.iterate(sorted(toread),entry_start=start,entry_stop=stop,step_size=chunksize,library='ak'):
+        nread += len(events)
+        for branch in branches: # redirect missing branches
+          if branch in exists: continue
+          alias = aliases.get(branch,None)
+          if branch in redirs: # rename
+            events[branch] = events[redirs[branch]]
+          elif isinstance(alias,list): # jagged default value, e.g. [True] for each object
+            counts = events['n'+branch.split('_')[0]] # e.g. nTau for Tau_*
+            events[branch] = ak.unflatten(np.full(int(ak.sum(counts)),alias[0]),counts)
+          elif alias!=None and not isinstance(alias,(str,tuple)): # flat default value
+            events[branch] = np.full(len(events),alias)
+          else:
+            LOG.throw(IOError,"iterevents: Branch %r does not exist in %s, and no alias or default value was given!"%(branch,filename))
+        yield events
+
+
+def getcollection(events,name,fields,mask=None):
+  """Zip flat nanoAOD branches of a collection into records, e.g. getcollection(events,'Muon',['pt','eta'])
+  to use muons.pt, muons.eta, ... Also store the index of each object in the original collection."""
+  coll = ak.zip({f: events[name+'_'+f] for f in fields})
+  coll['idx'] = ak.local_index(events[name+'_'+fields[0]])
+  if mask is not None:
+    coll = coll[mask]
+  return coll
+
+
+def deltaPhi(phi1,phi2):
+  """Compute DeltaPhi in range [-pi,pi] for arrays."""
+  return (phi1-phi2+pi)%(2*pi)-pi
+
+
+def deltaR(eta1,phi1,eta2,phi2):
+  """Compute DeltaR for arrays."""
+  return np.sqrt((eta1-eta2)**2+deltaPhi(phi1,phi2)**2)
+
+
+def getp4(pt,eta,phi,mass):
+  """Return cartesian four-momentum (px,py,pz,E) for arrays."""
+  px = pt*np.cos(phi)
+  py = pt*np.sin(phi)
+  pz = pt*np.sinh(eta)
+  en = np.sqrt(px**2+py**2+pz**2+mass**2)
+  return px, py, pz, en
+
+
+def getmass(px,py,pz,en):
+  """Return invariant mass of four-momentum for arrays."""
+  return np.sqrt(np.maximum(en**2-px**2-py**2-pz**2,0))
+
+
+def getrapidity(pt,eta,mass):
+  """Return rapidity for arrays."""
+  px, py, pz, en = getp4(pt,eta,0*eta,mass)
+  return 0.5*np.log((en+pz)/(en-pz))
+
+
+def getbest(pairs,keys):
+  """Return index of the best pair per event for a lexicographic ordering on a list
+  of (field,descending) keys, e.g. [('pt1',True),('pt2',True),('iso1',False),('iso2',True)]
+  for the ordering of LeptonTauPair.__gt__. Uses stable sorts from the last to the first key.
+  The index is a jagged array with zero or one entry per event, to be used as pairs[index]."""
+  order = ak.local_index(pairs[keys[0][0]])
+  for field, descending in reversed(keys):
+    values = pairs[field][order]
+    order  = order[ak.argsort(values,ascending=not descending,stable=True)]
+  return order[:,:1]
+
+
+def getbyindex(values,index,default=-1):
+  """Return value of a jagged array at a given index per event, e.g. Jet_pt[Tau_jetIdx],
+  or a default value if the index is out of range (e.g. -1)."""
+  values = values[ak.local_index(values)==index]
+  return tonumpy(ak.firsts(values),default)
+
+
+def tonumpy(array,default=-1):
+  """Convert flat awkward array to numpy, replacing missing values by a default."""
+  return ak.to_numpy(ak.fill_none(array,default))
+
+
+def fillhist(hist,values,weights=None):
+  """Fill ROOT histogram with a flat array at once."""
+  values = np.asarray(values,dtype='float64')
+  if len(values)==0:
+    return hist
+  if weights is None:
+    weights = np.ones(len(values),dtype='float64')
+  else:
+    weights = np.asarray(weights,dtype='float64')
+  hist.FillN(len(values),values,weights)
+  return hist
+
+
+def sumperparent(values,parents,counts):
+  """Sum jagged values into their parent object given by a jagged index (e.g. GenPart_genPartIdxMother),
+  returning a jagged array with the same structure as the parent collection."""
+  offsets = np.cumsum(np.concatenate([[0],ak.to_numpy(counts)[:-1]])) # first global index per event
+  gparent = ak.flatten(parents+offsets) # global parent index
+  flatval = ak.to_numpy(ak.flatten(values))
+  mask    = ak.to_numpy(ak.flatten(parents))>=0
+  sums    = np.zeros(int(ak.sum(counts)),dtype=flatval.dtype)
+  np.add.at(sums,ak.to_numpy(gparent)[mask],flatval[mask])
+  return ak.unflatten(sums,counts)
+
+
+def getlumimask(jsonfile):
+  """Return function to check if (run,lumi) arrays pass a JSON file of certified luminosity sections."""
+  with open(jsonfile) as file:
+    lumis = json.load(file)
+  runs   = np.array([int(r) for r in lumis for _ in lumis[r]],dtype='int64')
+  firsts = np.array([l[0] for r in lumis for l in lumis[r]],dtype='int64')
+  lasts  = np.array([l[1] for r in lumis for l in lumis[r]],dtype='int64')
+  keys   = (runs<<32)+firsts # sortable key of (run, first lumi)
+  order  = np.argsort(keys)
+  keys, lasts, runs = keys[order], lasts[order], runs[order]
+  def lumimask(run,lumi):
+    run  = ak.to_numpy(run).astype('int64')
+    lumi = ak.to_numpy(lumi).astype('int64')
+    idx  = np.searchsorted(keys,(run<<32)+lumi,side='right')-1 # last range starting before (run,lumi)
+    idx_ = np.maximum(idx,0)
+    return (idx>=0) & (runs[idx_]==run) & (lumi<=lasts[idx_])
+  return lumimask
+
+
+
+def getidiso(rawiso,photons,pt):
+  """Compute WPs of cut-based tau isolation for arrays, like analysis.utils.idIso."""
+  wps  = np.select([rawiso>4.5,rawiso>3.5,rawiso>2.5,rawiso>1.5,rawiso>0.8],[0,1,3,7,15],31) # VVLoose, VLoose, Loose, Medium, Tight
+  wps_ = np.select([rawiso>4.5,rawiso>3.5],[0,1],3) # VVLoose, VLoose
+  return np.where(photons/pt<0.10,wps,wps_)
+
+
+def matchgenvistau(events,tau,dRmin=0.5):
+  """Match one tau object per event to the closest GenVisTau within dRmin, like analysis.utils.matchgenvistau.
+  Return arrays of pt, eta, phi, status, with defaults -1, -9, -9, -1 if there is no match."""
+  genvistaus = getcollection(events,'GenVisTau',['pt','eta','phi','status'])
+  dR    = deltaR(genvistaus.eta,genvistaus.phi,tau.eta,tau.phi)
+  match = ak.firsts(genvistaus[dR<dRmin][ak.argmin(dR[dR<dRmin],axis=1,keepdims=True)])
+  return tonumpy(match.pt,-1), tonumpy(match.eta,-9), tonumpy(match.phi,-9), tonumpy(match.status,-1)
+
+
+def matchtaujet(events,tau,ismc):
+  """Match one tau object per event to a (gen) jet, like analysis.utils.matchtaujet."""
+  jpt_match = getbyindex(events.Jet_pt,tau.jetIdx,-1)
+  if ismc:
+    genjetidx    = getbyindex(events.Jet_genJetIdx,tau.jetIdx,-1)
+    jpt_genmatch = getbyindex(events.GenJet_pt,genjetidx,-1)
+    return jpt_match, jpt_genmatch
+  return jpt_match, None
+
+
+def hasbit(values,bit):
+  """Check if i'th bit is set for arrays."""
+  return (values & (1 << bit))>0
+
+
+def filtermutau(events):
+  """Vectorized version of analysis.utils.filtermutau: Filter mutau final state with mu pt>18, |eta|<2.5
+  and tauh pt>18, |eta|<2.5 to find overlap between DY samples for stitching."""
+  parts = getcollection(events,'GenPart',['pdgId','status','statusFlags','genPartIdxMother','pt','eta','phi','mass'])
+  pid   = abs(parts.pdgId)
+  
+  # MUON from hard-process tau decay
+  muons = parts[(pid==13) & (hasbit(parts.statusFlags,9) | hasbit(parts.statusFlags,10))]
+  muon  = ak.firsts(muons)
+  
+  # VISIBLE TAU: sum visible (non-leptonic) decay products of last-copy, hard-process taus
+  istau = (pid==15) & hasbit(parts.statusFlags,8) & (parts.status==2)
+  mothers = parts.genPartIdxMother
+  ismothtau = istau[ak.where(mothers>=0,mothers,0)] & (mothers>=0) # mother is selected tau
+  isvis = (pid>16) & ismothtau
+  px, py, pz, en = getp4(parts.pt,parts.eta,parts.phi,parts.mass)
+  counts = ak.num(parts)
+  vis = [sumperparent(ak.where(isvis,p,0.),mothers,counts) for p in (px,py,pz,en)]
+  taus = ak.zip({ 'pdgId': parts.pdgId, 'px': vis[0], 'py': vis[1], 'pz': vis[2] })[istau]
+  taupt  = np.sqrt(taus.px**2+taus.py**2)
+  taueta = np.arcsinh(taus.pz/ak.where(taupt>0,taupt,1e-10))
+  
+  # FILTER
+  passmu  = (ak.num(muons)==1) & ak.fill_none((muon.pt>18) & (abs(muon.eta)<2.5),False)
+  passtau = ak.any((taus.pdgId*ak.fill_none(muon.pdgId,0)<0) & (taupt>18) & (abs(taueta)<2.5),axis=1)
+  return ak.to_numpy(passmu & (ak.num(taus)==2) & passtau)
+
+
+def getzboson(events):
+  """Calculate Z boson pT and mass for arrays, like corrections.RecoilCorrectionTool.getzboson."""
+  parts = getcollection(events,'GenPart',['pdgId','status','statusFlags','pt','eta','phi','mass'])
+  pid   = abs(parts.pdgId)
+  mask  = (((pid==11) | (pid==13)) & (parts.status==1) & hasbit(parts.statusFlags,8)) |\
+          ((pid==15) & (parts.status==2) & hasbit(parts.statusFlags,8))
+  parts = parts[mask]
+  px, py, pz, en = [ak.sum(p,axis=1) for p in getp4(parts.pt,parts.eta,parts.phi,parts.mass)]
+  return ak.to_numpy(np.sqrt(px**2+py**2)), ak.to_numpy(getmass(px,py,pz,en))
+
+
+def gettoppt(events):
+  """Calculate top pT for arrays, like corrections.RecoilCorrectionTool.gettoppt.
+  Return the leading and subleading top pT, or -1 if not found."""
+  mask   = (abs(events.GenPart_pdgId)==6) & (events.GenPart_status==62)
+  toppts = ak.sort(events.GenPart_pt[mask],ascending=False)
+  toppts = ak.pad_none(toppts,2)
+  return tonumpy(toppts[:,0],-1), tonumpy(toppts[:,1],-1)
+
+
+def getlepvetoes(events,muonidx,elecidx,tau,channel,era):
+  """Vectorized version of analysis.utils.getlepvetoes: Check if events have extra electrons or muons.
+  The indices of the selected muon and electron (or None), and the selected tau (or None) are given per event."""
+  # https://twiki.cern.ch/twiki/bin/viewauth/CMS/HiggsToTauTauWorkingLegacyRun2#Common_lepton_vetoes
+  
+  # EXTRA MUON VETO
+  muons = getcollection(events,'Muon',['pt','eta','phi','dz','dxy','pfRelIso04_all','mediumId','isPFcand','isGlobal','isTracker','charge'])
+  mask  = (muons.pt>=10) & (abs(muons.eta)<=2.4) & (abs(muons.dz)<=0.2) & (abs(muons.dxy)<=0.045) & (muons.pfRelIso04_all<=0.3)
+  if tau is not None:
+    mask = mask & (deltaR(muons.eta,muons.phi,tau.eta,tau.phi)>=0.4)
+  extramuon = mask & muons.mediumId
+  if muonidx is not None:
+    extramuon = extramuon & (muons.idx!=muonidx)
+  extramuon_veto = ak.any(extramuon,axis=1)
+  looseMuons = muons[mask & (muons.pt>15) & muons.isPFcand & muons.isGlobal & muons.isTracker]
+  
+  # EXTRA ELECTRON VETO
+  isoname90, isoname = getelectronisobranches(era)
+  electrons = getcollection(events,'Electron',['pt','eta','phi','dz','dxy','pfRelIso03_all','convVeto','lostHits','cutBased','charge'])
+  electrons['iso90'] = events[isoname90]
+  electrons['iso']   = events[isoname]
+  mask  = (electrons.pt>=10) & (abs(electrons.eta)<=2.5) & (abs(electrons.dz)<=0.2) & (abs(electrons.dxy)<=0.045) & (electrons.pfRelIso03_all<=0.3)
+  if tau is not None:
+    mask = mask & (deltaR(electrons.eta,electrons.phi,tau.eta,tau.phi)>=0.4)
+  extraelec = mask & (electrons.convVeto==1) & (electrons.lostHits<=1) & (electrons.iso90!=0)
+  if elecidx is not None:
+    extraelec = extraelec & (electrons.idx!=elecidx)
+  extraelec_veto = ak.any(extraelec,axis=1)
+  looseElectrons = electrons[mask & (electrons.pt>15) & (electrons.cutBased>0) & (electrons.iso!=0)]
+  
+  # DILEPTON VETO
+  dilepton_veto = np.zeros(len(events),dtype=bool)
+  if channel=='mutau':
+    pairs = ak.combinations(looseMuons,2)
+    dR    = deltaR(pairs['0'].eta,pairs['0'].phi,pairs['1'].eta,pairs['1'].phi)
+    dilepton_veto = ak.any((pairs['0'].charge*pairs['1'].charge<0) & (dR>0.15),axis=1)
+  elif channel=='eletau' or channel=='etau':
+    pairs = ak.combinations(looseElectrons,2)
+    dR    = deltaR(pairs['0'].eta,pairs['0'].phi,pairs['1'].eta,pairs['1'].phi)
+    dilepton_veto = ak.any((pairs['0'].charge*pairs['1'].charge<0) & (dR>0.20),axis=1)
+  
+  return ak.to_numpy(extramuon_veto), ak.to_numpy(extraelec_veto), ak.to_numpy(dilepton_veto)
+
+
+def getelectronisobranches(era):
+  """Return era-dependent electron MVA isolation branches used for the lepton vetoes (WP90, loose)."""
+  if '2022' in era:
+    return 'Electron_mvaIso_Fall17V2_WP90', 'Electron_mvaIso_Fall17V2_WPL'
+  elif '2023' in era:
+    return 'Electron_mvaIso_WP90', 'Electron_mvaIso'
+  return 'Electron_mvaFall17V2Iso_WP90', 'Electron_mvaFall17V2Iso_WPL'
+
+
+def getvetobranches(era):
+  """Return list of input branches needed for getlepvetoes."""
+  branches  = ['Muon_'+f for f in ['pt','eta','phi','dz','dxy','pfRelIso04_all','mediumId','isPFcand','isGlobal','isTracker','charge']]
+  branches += ['Electron_'+f for f in ['pt','eta','phi','dz','dxy','pfRelIso03_all','convVeto','lostHits','cutBased','charge']]
+  branches += list(getelectronisobranches(era))
+  return branches
+
+
+def getobjects(collection):
+  """Convert flat array of records to list of simple objects with attributes,
+  to pass to correction tools that expect nanoAOD-tools objects, e.g. BTagWeightTool.fillEffMaps."""
+  return [SimpleNamespace(**obj) for obj in ak.to_list(collection)]
+
+
+class ColumnarModule(object):
+  """Mixin class for analysis modules that process chunks of events at once with awkward arrays,
+  run by processors/picojob_columnar.py instead of nanoAOD-tools' PostProcessor:
+    class ModuleMuTauColumnar(ColumnarModule,ModuleMuTau):
+      def process(self,events):
+        ... # select events with array operations
+        self.fillcolumns({ 'pt_1': pt_1, ... },nevts)
+  Subclasses define the input branches to read in self.branches,
+  and the redirections or defaults of missing branches in self.aliases (see iterevents)."""
+  columnar = True # flag for pico.py to use processors/picojob_columnar.py
+  
+  def analyze(self, event):
+    """Not used in columnar mode."""
+    raise NotImplementedError("%s does not process events one by one! Please use processors/picojob_columnar.py"%(self.__class__.__name__))
+  
+  def process(self, events):
+    """Process chunk of events (awkward array), and fill the output tree for all selected events."""
+    raise NotImplementedError("%s.process not implemented!"%(self.__class__.__name__))
+  
+  def fillcolumns(self, columns, nevts):
+    """Fill output tree in bulk with a dictionary of arrays { branch name: array } of selected events."""
+    self.out.fillcolumns({ b: np.asarray(a) for b, a in columns.items() },nevts)
+    return nevts
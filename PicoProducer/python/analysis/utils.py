@@ -267,10 +267,10 @@ def deltaPhi(phi1, phi2):
   return res
   
 
-def getmet(era,var="",useT1=False,verb=0):
-  """Return year-dependent MET recipe."""
+def getmetbranches(era,var="",useT1=False):
+  """Return names of year-dependent MET pt and phi branches."""
   if not isinstance(era,str):
-    LOG.warn(">>> getmet: Got era=%r (type==%s), but expected string! Converting..."%(era,type(era)))
+    LOG.warn(">>> getmetbranches: Got era=%r (type==%s), but expected string! Converting..."%(era,type(era)))
     era = str(era)
   if '2017' in era and 'UL' not in era :
     branch  = 'METFixEE2017'
@@ -288,6 +288,12 @@ def getmet(era,var="",useT1=False,verb=0):
   if var:
     pt  += '_'+var
     phi += '_'+var
+  return pt, phi
+  
+
+def getmet(era,var="",useT1=False,verb=0):
+  """Return year-dependent MET recipe."""
+  pt, phi = getmetbranches(era,var,useT1=useT1)
   funcstr = "lambda e: TLorentzVector(e.%s*cos(e.%s),e.%s*sin(e.%s),0,e.%s)"%(pt,phi,pt,phi,pt)
   if verb>=1:
     LOG.verb(">>> getmet: %r"%(funcstr))
@@ -302,8 +308,8 @@ def correctmet(met,dp):
   return met
   
 
-def getmetfilters(era,isdata,verb=0):
-  """Return a method to check if an event passes the recommended MET filters."""
+def getmetfilterlist(era,isdata):
+  """Return list of recommended MET filter branches."""
   # https://twiki.cern.ch/twiki/bin/viewauth/CMS/MissingETOptionalFiltersRun2
   #if '2017' in era or '2018' in era:
   #  if isdata:
@@ -340,8 +346,12 @@ def getmetfilters(era,isdata,verb=0):
     filters.extend(['Flag_ecalBadCalibFilter'])
     filters.remove('Flag_HBHENoiseFilter')
     filters.remove('Flag_HBHENoiseIsoFilter')
+  return filters
   
 
+def getmetfilters(era,isdata,verb=0):
+  """Return a method to check if an event passes the recommended MET filters."""
+  filters = getmetfilterlist(era,isdata)
   funcstr = "lambda e: e."+' and e.'.join(filters)
   if verb>=1:
     LOG.verb(">>> getmetfilters: %r"%(funcstr))
@@ -5,6 +5,7 @@ import os, re
 import importlib
 from TauFW.common.tools.utils import execute
 from abc import ABCMeta, abstractmethod
+_jobcache = { } # global index of queued jobs per batch system, shared by all instances: { system: { (jobid,taskid): Job } }
 
 
 class BatchSystem(object):
@@ -62,6 +63,28 @@ class BatchSystem(object):
         print(repr(job))
     return jobs
   
+  def getjobs(self,jobids=[],refresh=False,**kwargs):
+    """Get job status from a cached index of all the user's jobs, return JobList object.
+    The batch system is only queried once per process (or if refresh=True), so checking
+    the status of many samples costs one call to condor_q or squeue instead of one per sample."""
+    verbosity = kwargs.get('verb',self.verbosity)
+    if not isinstance(jobids,list):
+      jobids  = [jobids]
+    if refresh or self.system not in _jobcache:
+      index   = { }
+      for job in self.jobs(verb=verbosity): # query all jobs of user
+        index[(job.jobid,job.taskid)] = job
+      _jobcache[self.system] = index
+      if verbosity>=2:
+        print(">>> BatchSystem.getjobs: Cached %d jobs from %s"%(len(index),self.system))
+    index = _jobcache[self.system]
+    if jobids: # filter by cluster ID
+      jobids = set(int(j) for j in jobids)
+      jobs = [j for (jobid, taskid), j in index.items() if jobid in jobids]
+    else:
+      jobs = list(index.values())
+    return JobList(sorted(jobs,key=lambda j: (j.jobid,j.taskid)))
+  
   @abstractmethod
   def submit(self,script=None,taskfile=None,**kwargs):
     """Submit a script with some optional parameters."""
@@ -81,8 +104,8 @@ class BatchSystem(object):
 class JobList(object):
   """Job list container class."""
   
-  def __init__(self,jobs=[ ],verb=0):
-    self.jobs      = jobs
+  def __init__(self,jobs=None,verb=0):
+    self.jobs      = jobs if jobs!=None else [ ]
     self.verbosity = verb
   
   def __iter__(self):
@@ -68,7 +68,7 @@ class HTCondor(BatchSystem):
     subcmd  = "condor_q -wide %s"%(jobid)
     return self.execute(subcmd)
   
-  def jobs(self,jobids,**kwargs):
+  def jobs(self,jobids=[],**kwargs):
     """Get job status, return JobList object."""
     if not isinstance(jobids,list):
       jobids  = [jobids]
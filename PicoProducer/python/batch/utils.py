@@ -1,17 +1,23 @@
 # Author: Izaak Neutelings (May 2020)
 from past.builtins import basestring # for python2 compatibility
-import os, re, glob
+import os, re, glob, json
 import importlib
 import platform
+from TauFW.PicoProducer import basedir
 from TauFW.PicoProducer.batch import moddir
 from TauFW.common.tools.log import Logger
-from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.string import repkey
 from TauFW.common.tools.math import partition_by_max, ceil, floor
 from TauFW.common.tools.LoadingBar import LoadingBar
 from TauFW.PicoProducer.storage.Sample import Sample
+from TauFW.PicoProducer.storage.utils import getnevents
 LOG = Logger('Storage')
 evtsplitexp = re.compile(r"(.+\.root):(\d+):(\d+)$") # input file split by events
+rateexps    = [ # patterns of (time, nevts) in job logs
+  re.compile(r"Total time ([\d.]+) sec\. to process (\d+) events"), # nanoAOD-tools PostProcessor
+  re.compile(r"Processed (\d+) events, selected \d+ events after ([\d.]+) seconds"), # picojob_columnar.py (cumulative)
+]
+ratefile    = os.path.join(basedir,"config/throughput.json") # measured event rates per channel, module & data type
 
 
 def guess_batch():
@@ -56,10 +62,8 @@ def chunkify_by_evts(fnames,maxevts,evenly=True,evtdict=None,verb=0):
       nevts = evtdict[fname]
       if verb>=4:
         print(">>> %10d %s (dict)"%(nevts,fname))
-    else: # get number of events from file
-      file  = ensureTFile(fname,'READ')
-      nevts = file.Get('Events').GetEntries()
-      file.Close()
+    else: # get number of events from file (or file index)
+      nevts = getnevents(fname,'Events')
       if isinstance(evtdict,dict):
         evtdict[fname] = nevts # store for possible later reuse (if same sample is submitted multiple times)
       if verb>=4:
@@ -112,6 +116,77 @@ def chunkify_by_evts(fnames,maxevts,evenly=True,evtdict=None,verb=0):
   return ntot, result
 
 
+def parsetime(string):
+  """Convert time string, e.g. '90', '90s', '45m', '2h', '1d' or '02:30:00', to seconds."""
+  string = str(string).strip()
+  if ':' in string: # HH:MM:SS or MM:SS
+    seconds = 0
+    for part in string.split(':'):
+      seconds = 60*seconds + float(part)
+    return seconds
+  units = { 's': 1, 'm': 60, 'h': 3600, 'd': 86400 }
+  if string[-1].lower() in units:
+    return float(string[:-1])*units[string[-1].lower()]
+  return float(string)
+  
+
+def getlograte(logname):
+  """Parse job log file for processing time and number of processed events.
+  Return (nevts,seconds), or None if the job did not finish."""
+  with open(logname,'r') as file:
+    text = file.read()
+  matches = rateexps[0].findall(text)
+  if matches: # nanoAOD-tools PostProcessor
+    return sum(int(n) for t, n in matches), sum(float(t) for t, n in matches)
+  matches = rateexps[1].findall(text)
+  if matches: # columnar processor: cumulative count, take last
+    return int(matches[-1][0]), float(matches[-1][1])
+  return None
+  
+
+def loadrates():
+  """Load dictionary of measured event rates: { key: { logdir: [nevts,seconds,njobs] } }"""
+  if not os.path.isfile(ratefile):
+    return { }
+  try:
+    with open(ratefile,'r') as file:
+      return json.load(file)
+  except ValueError as err: # corrupted JSON
+    LOG.warning("loadrates: Could not read %s: %s"%(ratefile,err))
+    return { }
+  
+
+def updaterate(key,logdir,verb=0):
+  """Update measured event rate for a key (e.g. 'channel:module:dtype') from all finished jobs in a log directory.
+  Each log directory is counted once, so it is safe to call this repeatedly."""
+  nevts, seconds, njobs = 0, 0., 0
+  for logname in glob.glob(os.path.join(logdir,"*.log")):
+    result = getlograte(logname)
+    if result and result[0]>0 and result[1]>0:
+      nevts   += result[0]
+      seconds += result[1]
+      njobs   += 1
+  if njobs<1:
+    return None
+  rates = loadrates()
+  rates.setdefault(key,{ })[os.path.abspath(logdir)] = [nevts,seconds,njobs]
+  with open(ratefile,'w') as file:
+    json.dump(rates,file,indent=2)
+  LOG.verb("updaterate: %d events in %.1f seconds (%.1f Hz) for %d jobs in %s"%(nevts,seconds,nevts/seconds,njobs,logdir),verb,1)
+  return nevts/seconds
+  
+
+def getrate(key,verb=0):
+  """Get average event rate (in Hz) for a key (e.g. 'channel:module:dtype'), or None if not measured yet."""
+  entries = loadrates().get(key,{ }).values()
+  nevts   = sum(e[0] for e in entries)
+  seconds = sum(e[1] for e in entries)
+  if nevts<=0 or seconds<=0:
+    return None
+  LOG.verb("getrate: %d events in %.1f seconds (%.1f Hz) for %r"%(nevts,seconds,nevts/seconds,key),verb,2)
+  return nevts/seconds
+  
+
 def getbatch(arg,verb=0):
   """Get BatchSystem (subclass) instance and check if it exists."""
   if isinstance(arg,basestring):
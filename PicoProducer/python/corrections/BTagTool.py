@@ -5,13 +5,16 @@
 #   https://twiki.cern.ch/twiki/bin/view/CMS/BtagRecommendation
 #   nanoAOD-tools/python/postprocessing/modules/btv/btagSFProducer.py
 #   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/modules/btv/btagSFProducer.py
-import os
+import os, hashlib
 from array import array
+import numpy as np
 import ROOT
 #ROOT.gROOT.ProcessLine('.L ./BTagCalibrationStandalone.cpp+')
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.root import ensureTFile
+from TauFW.common.tools.file import ensuredir
 from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.ScaleFactorTool import HistLookup
 from ROOT import TH2D, BTagCalibration, BTagCalibrationReader
 from ROOT.BTagEntry import OP_LOOSE, OP_MEDIUM, OP_TIGHT, OP_RESHAPING # enum 0, 1, 2, 3
 from ROOT.BTagEntry import FLAV_B, FLAV_C, FLAV_UDSG # enum: 0, 1, 2
@@ -99,10 +102,149 @@ class BTagWPs:
       raise IOError("BTagWPs: Did not recognize tagger %s for era %s"%(tagger,era))
     
 
+class BTagSFTable:
+  """Lookup table of b tag SFs, tabulated from BTagCalibrationReader on a (flavor, |eta|, pt) grid,
+  so SFs for whole arrays of jets and all uncertainties are evaluated at once with numpy indexing.
+  The eta dependence is piecewise constant (evaluated in the center of each eta cell),
+  and the pt dependence is linearly interpolated within each pt cell, from its lower edge to just below its upper edge,
+  so the table reproduces the reader as long as the eta and pt bin edges of the CSV file
+  are multiples of etastep and ptstep. SFs for pt below minpt are evaluated with the reader directly.
+  The tables can be saved to and loaded from a numpy file to reuse them across jobs.
+  After building or loading, the tables are validated against the reader on random points,
+  and an error is raised if the largest relative difference exceeds tol."""
+  version = 1 # increase to invalidate old cache files after changing the grid or storage format
+  
+  def __init__(self,readers,maxeta,maxpt,minpt=20.,etastep=0.05,ptstep=2.,filename=None,tol=1e-3,verb=0):
+    self.readers   = readers # { unc: BTagCalibrationReader }
+    self.uncs      = sorted(readers.keys())
+    self.maxeta    = maxeta
+    self.maxpt     = maxpt
+    self.minpt     = minpt
+    self.etastep   = etastep
+    self.ptstep    = ptstep
+    self.neta      = int(np.ceil(maxeta/etastep-1e-6))
+    self.npt       = int(np.ceil((maxpt-minpt)/ptstep-1e-6))
+    self.verbosity = verb
+    if not filename or not self.load(filename):
+      self.tabulate()
+      if filename:
+        self.save(filename)
+    if tol!=None:
+      self.validate(tol=tol)
+  
+  def __repr__(self):
+    return "<%s(%s,neta=%s,npt=%s) at %s>"%(self.__class__.__name__,self.uncs,self.neta,self.npt,hex(id(self)))
+  
+  def tabulate(self):
+    """Evaluate the readers on the grid."""
+    LOG.verb("BTagSFTable.tabulate: Tabulating %d x %d x %d SFs for %s..."%(3,self.neta,self.npt,self.uncs),self.verbosity,1)
+    shape  = (len(self.uncs),3,self.neta,self.npt) # FLAV_B, FLAV_C, FLAV_UDSG = 0, 1, 2
+    etas   = (np.arange(self.neta)+0.5)*self.etastep # center of eta cells
+    ptlow  = self.minpt+np.arange(self.npt)*self.ptstep # lower edge of pt cells
+    pthigh = np.minimum(ptlow+self.ptstep,self.maxpt)-1e-4 # just below upper edge of pt cells
+    self.low  = np.zeros(shape,dtype='float64')
+    self.high = np.zeros(shape,dtype='float64')
+    self.top  = np.zeros(shape[:3],dtype='float64') # at pt = maxpt
+    for iunc, unc in enumerate(self.uncs):
+      reader = self.readers[unc]
+      for FLAV in [FLAV_B,FLAV_C,FLAV_UDSG]:
+        for ieta, eta in enumerate(etas):
+          self.low[iunc,FLAV,ieta]  = [reader.eval(FLAV,eta,pt) for pt in ptlow]
+          self.high[iunc,FLAV,ieta] = [reader.eval(FLAV,eta,pt) for pt in pthigh]
+          self.top[iunc,FLAV,ieta]  = reader.eval(FLAV,eta,self.maxpt)
+  
+  def compare(self,npoints=2000,seed=1):
+    """Compare table to the readers for random (flavor, |eta|, pt) points.
+    Return the largest relative difference, and the corresponding point."""
+    rng    = np.random.RandomState(seed)
+    FLAV   = rng.randint(0,3,npoints)
+    abseta = rng.uniform(0,self.maxeta,npoints)
+    pt     = np.exp(rng.uniform(np.log(self.minpt),np.log(1.2*self.maxpt),npoints)) # more points at low pt
+    pt     = np.minimum(pt,self.maxpt) # pt is capped at maxpt by BTagWeightTool.getSFs
+    sfs    = self.eval(FLAV,abseta,pt,uncs=self.uncs)
+    maxdiff, worst = 0., None
+    for iunc, unc in enumerate(self.uncs):
+      reader = self.readers[unc]
+      for i in range(npoints):
+        sf   = reader.eval(int(FLAV[i]),abseta[i],pt[i])
+        diff = abs(sfs[iunc,i]-sf)/max(abs(sf),1e-6)
+        if diff>maxdiff:
+          maxdiff, worst = diff, (unc,int(FLAV[i]),abseta[i],pt[i],sf,sfs[iunc,i])
+    return maxdiff, worst
+  
+  def validate(self,tol=1e-3,npoints=2000):
+    """Check that the table reproduces the readers within a relative tolerance, or raise an error."""
+    maxdiff, worst = self.compare(npoints=npoints)
+    LOG.verb("BTagSFTable.validate: Largest relative difference with reader is %.3g"%(maxdiff),self.verbosity,1)
+    if maxdiff>tol:
+      LOG.throw(ValueError,"BTagSFTable.validate: Table differs from BTagCalibrationReader by %.3g > %.3g "%(maxdiff,tol)+
+                           "for unc=%r, FLAV=%d, |eta|=%.3f, pt=%.2f: reader=%.6f, table=%.6f! "%worst+
+                           "Please use a finer grid, or usetable=False.")
+    return maxdiff
+  
+  def getkey(self):
+    """Return tuple of settings that need to match the tables stored in a file."""
+    return (self.version,tuple(self.uncs),self.maxeta,self.maxpt,self.minpt,self.etastep,self.ptstep)
+  
+  def load(self,filename):
+    """Load tables from numpy file. Return False if it does not exist or does not match."""
+    if not os.path.isfile(filename):
+      return False
+    try:
+      with np.load(filename) as data:
+        if data['key'].tolist()!=repr(self.getkey()):
+          LOG.warning("BTagSFTable.load: Settings of %s do not match! Tabulating again..."%(filename))
+          return False
+        self.low, self.high, self.top = data['low'], data['high'], data['top']
+    except (IOError,OSError,KeyError,ValueError) as err: # corrupt file, e.g. from an interrupted write
+      LOG.warning("BTagSFTable.load: Could not read %s: %s"%(filename,err))
+      return False
+    LOG.verb("BTagSFTable.load: Loaded tables from %s"%(filename),self.verbosity,1)
+    return True
+  
+  def save(self,filename):
+    """Save tables to numpy file."""
+    tmpname = "%s.%s.tmp.npz"%(filename,os.getpid()) # write to temporary file first to avoid corrupt files
+    try:
+      ensuredir(os.path.dirname(filename))
+      np.savez(tmpname,key=repr(self.getkey()),low=self.low,high=self.high,top=self.top)
+      os.replace(tmpname,filename)
+    except (IOError,OSError) as err: # e.g. read-only file system on batch node
+      LOG.warning("BTagSFTable.save: Could not save tables to %s: %s"%(filename,err))
+      return None
+    LOG.verb("BTagSFTable.save: Saved tables to %s"%(filename),self.verbosity,1)
+    return filename
+  
+  def eval(self,FLAV,abseta,pt,uncs=['Nom']):
+    """Evaluate SFs for arrays of jets (BTagEntry flavor, |eta|, pt)
+    for a list of uncertainties. Return array of shape (len(uncs),njets)."""
+    FLAV   = np.asarray(FLAV,dtype='int64')
+    abseta = np.asarray(abseta,dtype='float64')
+    pt     = np.asarray(pt,dtype='float64')
+    iuncs  = [self.uncs.index(u) for u in uncs]
+    ieta   = np.clip((abseta/self.etastep).astype('int64'),0,self.neta-1)
+    ptpos  = (np.clip(pt,self.minpt,self.maxpt)-self.minpt)/self.ptstep
+    ipt    = np.clip(ptpos.astype('int64'),0,self.npt-1)
+    frac   = ptpos-ipt
+    low    = self.low[iuncs][:,FLAV,ieta,ipt]
+    high   = self.high[iuncs][:,FLAV,ieta,ipt]
+    sfs    = low+frac*(high-low)
+    over   = pt>=self.maxpt
+    if np.any(over):
+      sfs[:,over] = self.top[iuncs][:,FLAV[over],ieta[over]]
+    for i in np.nonzero(pt<self.minpt)[0]: # outside grid
+      for j, unc in enumerate(uncs):
+        sfs[j,i] = self.readers[unc].eval(int(FLAV[i]),abseta[i],pt[i])
+    return sfs
+  
+
 class BTagWeightTool:
   
-  def __init__(self,tagger,wp,era,channel='all',maxeta=None,loadsys=False,type_bc='comb',spliteras=False,filltags=[""]):
-    """Load b tag weights from CSV file."""
+  def __init__(self,tagger,wp,era,channel='all',maxeta=None,loadsys=False,type_bc='comb',spliteras=False,filltags=[""],
+                     usetable=False,cachedir=None):
+    """Load b tag weights from CSV file. If usetable is set, the SFs are tabulated once (see BTagSFTable),
+    and the tables are cached in cachedir to be reused by later jobs. The tables approximate the reader,
+    and are validated against it when they are built or loaded."""
     
     #assert(year in [2016,2017,2018]), "You must choose a year from: 2016, 2017, or 2018."
     assert(tagger in ['DeepCSV','DeepJet']), "BTagWeightTool: You must choose a tagger from: DeepCSV, DeepJet!"
@@ -271,20 +413,47 @@ class BTagWeightTool:
     self.loadsys  = loadsys
     self.jetmaps  = jetmaps
     self.effmaps  = effmaps
+    self.efftables = { f: HistLookup(h,clamp=True) for f, h in effmaps.items() } # for arrays
     self.maxeta   = maxeta
     self.maxpt    = maxpt
+    
+    # LOOKUP TABLES of SFs
+    self.sftable  = None
+    if usetable:
+      if cachedir==None:
+        cachedir  = os.environ.get('TAUFW_BTAGCACHE',"~/.cache/TauFW/btag")
+      cachefile = None
+      if cachedir:
+        csvstat   = [(f,os.path.getmtime(f)) for f in sorted(set([csvname,csvname_bc])) if os.path.isfile(f)]
+        key       = hashlib.sha1(repr((csvstat,type_bc,type_udsg)).encode('utf-8')).hexdigest()[:10]
+        cachefile = os.path.join(os.path.expanduser(os.path.expandvars(cachedir)),"btagsf_%s_%s_%s_%s.npz"%(tagger,wp,era,key))
+      self.sftable = BTagSFTable(readers,maxeta,maxpt,filename=cachefile)
   
   def getWeight(self,jets,unc='Nom'):
     """Get b tagging event weight for a given set of jets."""
-    weight = 1.
-    for jet in jets:
-      if abs(jet.eta)<self.maxeta:
-        weight *= self.getSF(jet.pt,jet.eta,jet.partonFlavour,self.tagged(jet),unc=unc)
-        ###print(">>> BTagWeightTool.getWeight: sf=%8.5f pt=%8.3f eta=%6.3f flavor=%2d tagged=%5r score=%8.5f wp=%8.4f"%()
-        ###  sf,jet.pt,jet.eta,jet.partonFlavour,self.tagged(jet),jet.btagDeepFlavB,self.wp)
+    if not jets:
+      return 1.
+    pts, etas, flavors, tagged = zip(*[(j.pt,j.eta,j.partonFlavour,self.tagged(j)) for j in jets])
+    weight = float(self.getWeights(pts,etas,flavors,tagged,[len(jets)],unc=unc)[0])
     ###print(">>> BTagWeightTool.getWeight: weight=%.6f"%(weight))
     return weight
   
+  def getWeights(self,pt,eta,flavor,tagged,counts,unc='Nom'):
+    """Get b tagging event weights for flat arrays of jets (pt, eta, flavor, tagged),
+    with the number of jets per event given by counts.
+    If unc is a list of uncertainties, return an array of shape (len(unc),nevts)."""
+    uncs    = unc if isinstance(unc,(list,tuple)) else [unc]
+    counts  = np.asarray(counts,dtype='int64')
+    eta     = np.asarray(eta,dtype='float64')
+    weights = np.ones((len(uncs),len(counts)))
+    evtidx  = np.repeat(np.arange(len(counts)),counts) # event index of each jet
+    mask    = np.abs(eta)<self.maxeta
+    if np.any(mask):
+      sfs = self.getSFs(np.asarray(pt)[mask],eta[mask],np.asarray(flavor)[mask],np.asarray(tagged)[mask],unc=uncs)
+      for weights_, sfs_ in zip(weights,sfs):
+        np.multiply.at(weights_,evtidx[mask],sfs_)
+    return weights if uncs is unc else weights[0]
+  
   def getHeavyFlavorWeight(self,jets,unc='Nom'):
     """Get b tagging event weight for a given set of jets for heavy flavors only."""
     weight_bc = 1. # heavy flavor
@@ -308,40 +477,54 @@ class BTagWeightTool:
   
   def getSF(self,pt,eta,flavor,tagged,unc='Nom'):
     """Get b tag SF for a single jet."""
-    FLAV = flavorToFLAV(flavor)
-    if   eta>=+self.maxeta: eta = self.maxeta-0.001 # BTagCalibrationReader returns zero if |eta| > 2.4
-    elif eta<=-self.maxeta: eta = 0.001-self.maxeta
-    if pt>=self.maxpt:
-      sf = self.readers[unc].eval(FLAV,abs(eta),self.maxpt)
-      if unc!='Nom': # double uncertainty
-        # https://twiki.cern.ch/twiki/bin/viewauth/CMS/BtagRecommendation94X#AK4_jets
-        sfnom = self.readers['Nom'].eval(FLAV,abs(eta),self.maxpt)
-        sf = 2*sf - sfnom # = sfnom + 2*(sf-sfnom) = 2*sf - sfnom
-    else:
-      sf = self.readers[unc].eval(FLAV,abs(eta),pt) # newer versions: use eval_auto_bounds instead !
-    if not tagged:
-      eff = self.getEff(pt,eta,flavor)
-      if eff>=1. or eff<0.:
-        LOG.warning("BTagWeightTool.getSF: MC efficiency is %.3f <0 or >=1 for untagged jet with pt=%s, eta=%s, flavor=%s, sf=%s"%(eff,pt,eta,flavor,sf))
-        return 1.
-      else:
-        sf = (1.-sf*eff)/(1.-eff)
-    return sf
+    return float(self.getSFs([pt],[eta],[flavor],[tagged],unc=unc)[0])
+  
+  def getSFs(self,pt,eta,flavor,tagged,unc='Nom'):
+    """Get b tag SFs for arrays of jets.
+    If unc is a list of uncertainties, return an array of shape (len(unc),njets)."""
+    uncs   = unc if isinstance(unc,(list,tuple)) else [unc]
+    pt     = np.asarray(pt,dtype='float64')
+    eta    = np.clip(np.asarray(eta,dtype='float64'),0.001-self.maxeta,self.maxeta-0.001) # BTagCalibrationReader returns zero if |eta| > 2.4
+    tagged = np.asarray(tagged,dtype=bool)
+    FLAVs  = flavorsToFLAV(flavor)
+    abseta = np.abs(eta)
+    ptmax  = np.minimum(pt,self.maxpt)
+    over   = pt>=self.maxpt
+    dosys  = any(u!='Nom' for u in uncs) and np.any(over)
+    if self.sftable: # lookup tables
+      sfs   = self.sftable.eval(FLAVs,abseta,ptmax,uncs=uncs)
+      sfnom = self.sftable.eval(FLAVs[over],abseta[over],ptmax[over])[0] if dosys else None
+    else: # evaluate each jet
+      sfs   = np.array([[self.readers[u].eval(int(F),e,p) for F, e, p in zip(FLAVs,abseta,ptmax)] for u in uncs],dtype='float64') # newer versions: use eval_auto_bounds instead !
+      sfnom = np.array([self.readers['Nom'].eval(int(F),e,self.maxpt) for F, e in zip(FLAVs[over],abseta[over])]) if dosys else None
+    if dosys: # double uncertainty
+      # https://twiki.cern.ch/twiki/bin/viewauth/CMS/BtagRecommendation94X#AK4_jets
+      for i, u in enumerate(uncs):
+        if u!='Nom':
+          sfs[i,over] = 2*sfs[i,over] - sfnom # = sfnom + 2*(sf-sfnom) = 2*sf - sfnom
+    if not np.all(tagged):
+      effs = self.getEffs(pt,eta,flavor)
+      bad  = ~tagged & ((effs>=1.) | (effs<0.))
+      for i in np.nonzero(bad)[0]:
+        LOG.warning("BTagWeightTool.getSFs: MC efficiency is %.3f <0 or >=1 for untagged jet with pt=%s, eta=%s, flavor=%s, sf=%s"%(effs[i],pt[i],eta[i],flavor[i],sfs[0,i]))
+      untagged = ~tagged & ~bad
+      sfs[:,untagged] = (1.-sfs[:,untagged]*effs[untagged])/(1.-effs[untagged])
+      sfs[:,bad] = 1.
+    return sfs if uncs is unc else sfs[0]
   
   def getEff(self,pt,eta,flavor):
     """Get b tag efficiency for a single jet in MC."""
-    flavor = flavorToString(flavor)
-    hist   = self.effmaps[flavor]
-    xbin   = hist.GetXaxis().FindBin(pt)
-    ybin   = hist.GetYaxis().FindBin(eta)
-    if xbin==0: xbin = 1
-    elif xbin>hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>hist.GetYaxis().GetNbins(): ybin -= 1
-    eff    = hist.GetBinContent(xbin,ybin)
-    ###if eff==1:
-    ###  print("Warning! BTagWeightTool.getEff: MC efficiency is 1 for pt=%s, eta=%s, flavor=%s, sf=%s"%(pt,eta,flavor,sf))
-    return eff
+    return float(self.efftables[flavorToString(flavor)](pt,eta))
+  
+  def getEffs(self,pt,eta,flavor):
+    """Get b tag efficiencies for arrays of jets in MC."""
+    pt, eta = np.asarray(pt,dtype='float64'), np.asarray(eta,dtype='float64')
+    absflav = np.abs(np.asarray(flavor))
+    effs    = np.zeros(len(pt))
+    for fstr, mask in [('b',absflav==5),('c',absflav==4),('udsg',(absflav!=5) & (absflav!=4))]:
+      if np.any(mask):
+        effs[mask] = self.efftables[fstr](pt[mask],eta[mask])
+    return effs
   
   def fillEffMaps(self,jets,usejec=False,tag=""):
     """Fill histograms to make efficiency map for MC, split by true jet flavor,
@@ -371,6 +554,12 @@ def flavorToFLAV(flavor):
   return FLAV_B if abs(flavor)==5 else FLAV_C if abs(flavor) in [4,15] else FLAV_UDSG       
   
 
+def flavorsToFLAV(flavors):
+  """Help function to convert an array of integer flavor IDs to BTagEntry enum values."""
+  absflav = np.abs(np.asarray(flavors,dtype='int64'))
+  return np.where(absflav==5,int(FLAV_B),np.where((absflav==4) | (absflav==15),int(FLAV_C),int(FLAV_UDSG)))
+  
+
 def flavorToString(flavor):
   """Help function to convert an integer flavor ID to a string value."""
   return 'b' if abs(flavor)==5 else 'c' if abs(flavor)==4 else 'udsg'
@@ -97,3 +97,11 @@ class ElectronSFs:
     """Get SF for electron identification + isolation."""
     return self.sftool_idiso.getSF(pt,eta)
   
+  def getTriggerSFs(self, pt, eta):
+    """Get SFs for single electron trigger for arrays of pT and eta."""
+    return self.sftool_trig.getSFs(pt,eta)
+  
+  def getIdIsoSFs(self, pt, eta):
+    """Get SFs for electron identification + isolation for arrays of pT and eta."""
+    return self.sftool_idiso.getSFs(pt,eta)
+  
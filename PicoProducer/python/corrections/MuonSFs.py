@@ -12,6 +12,7 @@
 #   https://github.com/cms-cat/nanoAOD-tools-modules/blob/master/python/modules/muonSF.py
 #   https://github.com/cms-cat/nanoAOD-tools-modules/blob/master/test/example_muonSF.py
 import os, re
+import numpy as np
 from TauFW.common.tools.log import Logger
 from TauFW.PicoProducer import datadir
 from TauFW.PicoProducer.corrections.ScaleFactorTool import ScaleFactorHTT
@@ -138,6 +139,18 @@ class MuonSFs:
     return self.sftool_id.evaluate(eta,pt,syst)*self.sftool_iso.evaluate(eta,pt,syst)
     
   
+  def getTriggerSFs(self, pt, eta):
+    """Get nominal SFs for single muon trigger for arrays of pT and eta."""
+    pt, eta = np.asarray(pt,dtype='float64'), np.asarray(eta,dtype='float64')
+    return np.asarray(self.sftool_trig.evaluate(eta,pt,'nominal')) # correctionlib & ScaleFactorHTT accept arrays
+    
+  
+  def getIdIsoSFs(self, pt, eta, syst='nominal'):
+    """Get SFs for muon identification + isolation for arrays of pT and eta."""
+    pt, eta = np.asarray(pt,dtype='float64'), np.asarray(eta,dtype='float64')
+    return np.asarray(self.sftool_id.evaluate(eta,pt,syst))*np.asarray(self.sftool_iso.evaluate(eta,pt,syst))
+    
+  
   def getIdSF(self, pt, eta, syst=None):
     """Get SF for muon identification."""
     sf = self.sftool_id.evaluate(eta,pt,'nominal')
@@ -1,6 +1,8 @@
 # Author: Izaak Neutelings (November 2018)
 import os, re
+import numpy as np
 from TauFW.PicoProducer import datadir
+from TauFW.PicoProducer.corrections.ScaleFactorTool import HistLookup
 from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.log import Logger
 datadir = os.path.join(datadir,"pileup")
@@ -77,18 +79,24 @@ class PileupWeightTool:
     self.mchist.Scale(1./self.mchist.Integral())
     self.datafile.Close()
     self.mcfile.Close()
+    self.datatable = HistLookup(self.datahist,clamp=False) # for arrays
+    self.mctable   = HistLookup(self.mchist,clamp=False)
     
   
   def getWeight(self,npu):
     """Get pileup weight for a given number of pileup interactions."""
-    data = self.datahist.GetBinContent(self.datahist.GetXaxis().FindBin(npu))
-    mc   = self.mchist.GetBinContent(self.mchist.GetXaxis().FindBin(npu))
-    if mc>0.:
-      ratio = data/mc
-      if ratio>5.: return 5.
-      return data/mc
-    LOG.warning("PileupWeightTools.getWeight: Could not make pileup weight for npu=%s data=%s, mc=%s"%(npu,data,mc))
-    return 1.
+    return float(self.getWeights(npu))
+  
+  def getWeights(self,npu):
+    """Get pileup weights for an array of numbers of pileup interactions."""
+    npu    = np.asarray(npu,dtype='float64')
+    data   = self.datatable(npu)
+    mc     = self.mctable(npu)
+    nomc   = mc<=0.
+    if np.any(nomc):
+      LOG.warning("PileupWeightTools.getWeights: Could not make pileup weight for npu=%s data=%s, mc=%s"%(npu[nomc],data[nomc],mc[nomc]))
+    ratio  = np.where(nomc,1.,data/np.where(nomc,1.,mc))
+    return np.minimum(ratio,5.)
   
   
 
@@ -1,10 +1,71 @@
 # Author: Izaak Neutelings (November 2018)
 import os, re
+import numpy as np
 from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.log import Logger
 LOG = Logger('ScaleFactorTool')
 
 
+class HistLookup:
+  """Lookup table of the bin contents of a TH1 or TH2, converted once to numpy arrays,
+  to evaluate whole arrays of values at once with np.searchsorted instead of FindBin + GetBinContent.
+  If clamp=True, values in the underflow (overflow) are assigned to the first (last) bin,
+  otherwise the content of the underflow and overflow bins is returned, like hist.GetBinContent(hist.FindBin(x))."""
+  
+  def __init__(self, hist, clamp=True):
+    self.name   = hist.GetName()
+    self.clamp  = clamp
+    self.ndim   = 2 if hist.GetDimension()==2 else 1
+    xaxis       = hist.GetXaxis()
+    self.xedges = np.array([xaxis.GetBinLowEdge(i) for i in range(1,xaxis.GetNbins()+2)],dtype='float64')
+    if self.ndim==2:
+      yaxis       = hist.GetYaxis()
+      self.yedges = np.array([yaxis.GetBinLowEdge(i) for i in range(1,yaxis.GetNbins()+2)],dtype='float64')
+      self.values = np.array([[hist.GetBinContent(ix,iy) for iy in range(0,len(self.yedges)+1)]
+                                                          for ix in range(0,len(self.xedges)+1)],dtype='float64')
+    else:
+      self.yedges = None
+      self.values = np.array([hist.GetBinContent(ix) for ix in range(0,len(self.xedges)+1)],dtype='float64')
+  
+  def __repr__(self):
+    return "<%s(%r,ndim=%d,clamp=%r) at %s>"%(self.__class__.__name__,self.name,self.ndim,self.clamp,hex(id(self)))
+  
+  def findbin(self, edges, values):
+    """Return array of bin indices like TAxis::FindBin: 0 for underflow, nbins+1 for overflow."""
+    bins = np.searchsorted(edges,np.asarray(values,dtype='float64'),side='right')
+    if self.clamp:
+      bins = np.clip(bins,1,len(edges)-1)
+    return bins
+  
+  def __call__(self, x, y=None):
+    """Return bin contents for arrays of x (and y) values."""
+    if self.ndim==2:
+      return self.values[self.findbin(self.xedges,x),self.findbin(self.yedges,y)]
+    return self.values[self.findbin(self.xedges,x)]
+  
+
+def evalgraph(xvals, yvals, x):
+  """Evaluate arrays of points (x values sorted) with linear interpolation between the closest points,
+  and linear extrapolation outside the range, like TGraph::Eval.
+  Like TGraph::Eval, a graph with one point is constant, and an empty graph returns zero."""
+  x   = np.asarray(x,dtype='float64')
+  if len(xvals)<2:
+    return np.full(x.shape,yvals[0] if len(yvals)==1 else 0.0)
+  low = np.clip(np.searchsorted(xvals,x,side='right')-1,0,len(xvals)-2)
+  x1, x2 = xvals[low], xvals[low+1]
+  y1, y2 = yvals[low], yvals[low+1]
+  yint = y1+(x-x1)*(y2-y1)/np.where(x2==x1,1.,x2-x1)
+  return np.where(x2==x1,y1,np.where(x==x2,y2,yint)) # exact value at the last point
+  
+
+def getgraphpoints(graph):
+  """Return arrays of x and y values of a TGraph, sorted by x."""
+  xvals = np.array([graph.GetPointX(i) for i in range(graph.GetN())],dtype='float64')
+  yvals = np.array([graph.GetPointY(i) for i in range(graph.GetN())],dtype='float64')
+  order = np.argsort(xvals,kind='stable')
+  return xvals[order], yvals[order]
+  
+
 class ScaleFactor:
   
   def __init__(self, filename, histname, name="<noname>", ptvseta=True, verb=0):
@@ -13,6 +74,7 @@ class ScaleFactor:
     self.ptvseta  = ptvseta
     self.filename = filename
     self.file, self.hist = self.gethist(filename,histname,verb=verb)
+    self.table    = HistLookup(self.hist,clamp=True) # for arrays
     self.getSF    = self.getSF_ptvseta if ptvseta else self.getSF_etavspt
   
   def gethist(self,filename,histname,verb=0):
@@ -41,27 +103,21 @@ class ScaleFactor:
   
   def getSF_ptvseta(self, pt, eta):
     """Get SF for a given pT, eta."""
-    xbin = self.hist.GetXaxis().FindBin(eta)
-    ybin = self.hist.GetYaxis().FindBin(pt)
-    if xbin==0: xbin = 1
-    elif xbin>self.hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>self.hist.GetYaxis().GetNbins(): ybin -= 1
-    sf = self.hist.GetBinContent(xbin,ybin)
+    sf = float(self.table(eta,pt)) # x=eta, y=pt; under- & overflow assigned to first & last bin
     #print "ScaleFactor(%s).getSF_ptvseta: pt = %6.2f, eta = %6.3f, sf = %6.3f"%(self.name,pt,eta,sf)
     return sf
   
   def getSF_etavspt(self, pt, eta):
     """Get SF for a given pT, eta."""
-    xbin = self.hist.GetXaxis().FindBin(pt)
-    ybin = self.hist.GetYaxis().FindBin(eta)
-    if xbin==0: xbin = 1
-    elif xbin>self.hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>self.hist.GetYaxis().GetNbins(): ybin -= 1
-    sf = self.hist.GetBinContent(xbin,ybin)
+    sf = float(self.table(pt,eta)) # x=pt, y=eta; under- & overflow assigned to first & last bin
     #print "ScaleFactor(%s).getSF_etavspt: pt = %6.2f, eta = %6.3f, sf = %6.3f"%(self.name,pt,eta,sf)
     return sf
+  
+  def getSFs(self, pt, eta):
+    """Get SFs for arrays of pT and eta."""
+    if self.ptvseta: # x=eta, y=pt
+      return self.table(eta,pt)
+    return self.table(pt,eta)
     
 
 class ScaleFactorHTT(ScaleFactor):
@@ -91,24 +147,32 @@ class ScaleFactorHTT(ScaleFactor):
       self.effs_data[etalabel] = self.file.Get(graphname+etalabel+"_Data")
       self.effs_mc[etalabel]   = self.file.Get(graphname+etalabel+"_MC")
     self.file.Close()
+    self.etaedges   = HistLookup(self.hist_eta).xedges # for arrays
+    self.etalabels  = [self.hist_eta.GetXaxis().GetBinLabel(i) for i in range(1,len(self.etaedges))]
+    self.points_data = { l: getgraphpoints(g) for l, g in self.effs_data.items() }
+    self.points_mc   = { l: getgraphpoints(g) for l, g in self.effs_mc.items() }
   
   def evaluate(self, eta, pt, sf='sf'):
     """For compatibility with correctionlib's Correction.evaluate for MUO POG."""
+    if np.ndim(pt)>0: # arrays
+      return self.getSFs(pt,eta)
     return self.getSF(pt,eta)
   
+  def getSFs(self, pt, eta):
+    """Get SFs for arrays of pT and eta."""
+    pt     = np.asarray(pt,dtype='float64')
+    etabin = np.clip(np.searchsorted(self.etaedges,np.abs(eta),side='right'),1,len(self.etalabels))
+    sfs    = np.ones(len(pt))
+    for ibin in np.unique(etabin):
+      mask = etabin==ibin
+      data = evalgraph(*self.points_data[self.etalabels[ibin-1]],pt[mask])
+      mc   = evalgraph(*self.points_mc[self.etalabels[ibin-1]],pt[mask])
+      sfs[mask] = np.where(mc==0,1.0,data/np.where(mc==0,1.0,mc))
+    return sfs
+  
   def getSF(self, pt, eta):
-    """Get SF for a given pT, eta."""
-    #print pt, eta
-    abseta = abs(eta)
-    etabin = self.hist_eta.GetXaxis().GetBinLabel(min(self.hist_eta.GetXaxis().GetNbins(),self.hist_eta.GetXaxis().FindBin(abseta)))
-    data   = self.effs_data[etabin].Eval(pt)
-    mc     = self.effs_mc[etabin].Eval(pt)
-    if mc==0:
-      sf = 1.0
-    else:
-      sf = data/mc
-    #print "ScaleFactorHTT(%s).getSF: pt = %6.2f, eta = %6.3f, data = %6.3f, mc = %6.3f, sf = %6.3f"%(self.name,pt,eta,data,mc,sf)
-    return sf
+    """Get SF for a given pT, eta, with the same lookup as getSFs."""
+    return float(self.getSFs([pt],[eta])[0])
   
 
 class ScaleFactorProduct:
@@ -126,6 +190,10 @@ class ScaleFactorProduct:
   def getSF(self, pt, eta):
     return self.scaleFactor1.getSF(pt,eta)*self.scaleFactor2.getSF(pt,eta)
   
+  def getSFs(self, pt, eta):
+    """Get SFs for arrays of pT and eta."""
+    return self.scaleFactor1.getSFs(pt,eta)*self.scaleFactor2.getSFs(pt,eta)
+  
 
 #def getBinsFromTGraph(graph):
 #    """Get xbins from TGraph."""
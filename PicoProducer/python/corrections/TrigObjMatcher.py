@@ -6,7 +6,8 @@
 #   https://cms-nanoaod-integration.web.cern.ch/integration/master-106X/mc106X_doc.html#TrigObj
 import os, sys, yaml #, json
 from collections import namedtuple
-from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+import numpy as np
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Object
 TriggerData = namedtuple('TriggerData',['trigdict','combdict']) # simple container class
 objectTypes = { 1: 'Jet', 6: 'FatJet', 2: 'MET', 3: 'HT', 4: 'MHT',
                 11: 'Electron', 13: 'Muon', 15: 'Tau', 22: 'Photon', } 
@@ -216,6 +217,60 @@ class TriggerFilter:
     return trigObj.DeltaR(recoObj)<dR and recoObj.pt>self.ptmin and abs(recoObj.eta)<self.etamax
   
 
+class TrigObjIndex:
+  """Class to index the trigger objects of a single event for fast matching by TrigObjMatcher:
+  The trigger objects are read once, grouped per leg by object ID, and their filter bits are
+  compared once to the filter bits of each fired trigger, so matching a (list of) reconstructed
+  object(s) only needs a vectorized deltaR matrix."""
+  
+  def __init__(self,matcher,event):
+    ntrigobjs    = event.nTrigObj
+    ids          = np.fromiter(event.TrigObj_id,dtype='int32',count=ntrigobjs)
+    etas         = np.fromiter(event.TrigObj_eta,dtype='float64',count=ntrigobjs)
+    phis         = np.fromiter(event.TrigObj_phi,dtype='float64',count=ntrigobjs)
+    bits         = np.fromiter(event.TrigObj_filterBits,dtype='int64',count=ntrigobjs)
+    self.event   = event
+    self.fired   = [t for t in matcher.triggers if t.fired(event)] # evaluate only once per event
+    self.legs    = [ ]
+    for leg, objid in enumerate(matcher.ids):
+      index      = np.nonzero(ids==objid)[0] # index of trigger objects in TrigObj collection
+      filters    = [t.filters[leg] for t in self.fired]
+      fbits      = np.array([f.bits for f in filters],dtype='int64')[:,None] # (nfired,1)
+      passbits   = (bits[index][None,:] & fbits)==fbits # (nfired,nobjs)
+      ptmins     = np.array([f.ptmin for f in filters],dtype='float64')[:,None] # (nfired,1)
+      etamaxs    = np.array([f.etamax for f in filters],dtype='float64')[:,None] # (nfired,1)
+      self.legs.append((index,etas[index],phis[index],passbits,ptmins,etamaxs))
+  
+  def __repr__(self):
+    """Returns string representation of TrigObjIndex object."""
+    return "<%s(nfired=%d,nobjs=%s) at %s>"%(self.__class__.__name__,len(self.fired),[len(l[0]) for l in self.legs],hex(id(self)))
+  
+  def getdeltaR(self,eta,phi,leg=1):
+    """Compute deltaR matrix of shape (nreco,nobjs) between arrays of reconstructed objects' eta & phi,
+    and all trigger objects of a given leg."""
+    index, etas, phis = self.legs[leg-1][:3]
+    deta = np.asarray(eta,dtype='float64')[:,None]-etas[None,:]
+    dphi = (np.asarray(phi,dtype='float64')[:,None]-phis[None,:]+np.pi)%(2*np.pi)-np.pi
+    return np.sqrt(deta**2+dphi**2)
+  
+  def match(self,recoObjs,leg=1,dR=0.2):
+    """Match list of reconstructed objects to trigger objects of a given leg.
+    Return array with index of first matched trigger object in TrigObj collection, or -1 if none.
+    Like before, the fired triggers are tried in order."""
+    nreco = len(recoObjs)
+    index, etas, phis, passbits, ptmins, etamaxs = self.legs[leg-1]
+    if nreco==0 or len(index)==0 or len(self.fired)==0:
+      return np.full(nreco,-1,dtype='int64')
+    pt, eta, phi = np.array([(o.pt,o.eta,o.phi) for o in recoObjs],dtype='float64').T
+    close   = self.getdeltaR(eta,phi,leg=leg)<dR # (nreco,nobjs)
+    offline = (pt[None,:]>ptmins) & (np.abs(eta)[None,:]<etamaxs) # (nfired,nreco)
+    matched = passbits[:,None,:] & close[None,:,:] & offline[:,:,None] # (nfired,nreco,nobjs)
+    anyobj  = matched.any(axis=2) # (nfired,nreco)
+    itrig   = np.argmax(anyobj,axis=0) # first fired trigger with a match
+    iobj    = np.argmax(matched[itrig,np.arange(nreco)],axis=1) # first trigger object
+    return np.where(anyobj.any(axis=0),index[iobj],-1)
+  
+
 class TrigObjMatcher:
   """Class to contain trigger filter(s)."""
   
@@ -291,14 +346,24 @@ class TrigObjMatcher:
       for i, filter in enumerate(trigger.filters,1):
         print("%s  leg %d: %s, %r"%(indent,i,filter.type,filter.name))
   
+  def getindex(self,event):
+    """Get TrigObjIndex of this event. It is built only once per event, and stored in the event."""
+    key   = "_trigobjindex_%x"%(id(self))
+    index = event.__dict__.get(key,None) # avoid Event.__getattr__, which tries to read a branch
+    if index==None:
+      index = TrigObjIndex(self,event)
+      event.__dict__[key] = index
+    return index
+  
   def match(self,event,recoObj,leg=1,dR=0.2):
     """Match given reconstructed object to trigger objects."""
-    leg     -= 1 # index starting at 0
-    trigObjs = [o for o in Collection(event,'TrigObj') if o.id==self.ids[leg]] # and (o.filterBits&self.bits)>0
-    for trigger in self.triggers:
-      if not trigger.fired(event): continue
-      for trigObj in trigObjs:
-        if trigger.filters[leg].matchbits(trigObj) and trigger.filters[leg].match(trigObj,recoObj,dR=dR):
-          return trigObj
-    return None
+    itrigobj = self.getindex(event).match([recoObj],leg=leg,dR=dR)[0]
+    if itrigobj<0:
+      return None
+    return Object(event,'TrigObj',index=int(itrigobj))
+  
+  def matchall(self,event,recoObjs,leg=1,dR=0.2):
+    """Match list of reconstructed objects to trigger objects in one go.
+    Return list of booleans, one per reconstructed object."""
+    return list(self.getindex(event).match(recoObjs,leg=leg,dR=dR)>=0)
   
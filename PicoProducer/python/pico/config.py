@@ -3,7 +3,6 @@ from past.builtins import basestring # for python2 compatibility
 import os, glob, json
 from TauFW.common.tools.file import ensurefile, ensureinit
 from TauFW.common.tools.string import repkey, rreplace, lreplace
-from TauFW.PicoProducer.analysis.utils import ensuremodule
 from TauFW.PicoProducer.storage.utils import getsamples
 from TauFW.PicoProducer.pico.common import *
 
@@ -62,7 +61,7 @@ def main_get(args):
   limit      = args.limit
   writedir   = args.write      # write sample file list to text file
   tag        = args.tag
-  ncores     = args.ncores     # number of cores to get nevents in parallel
+  ncores     = CONFIG.ncores if args.ncores==None else args.ncores # number of cores to get nevents in parallel
   verbosity  = args.verbosity
   getnevts   = variable in ['nevents','nevts']
   cfgname    = CONFIG._path
@@ -178,7 +177,7 @@ def main_write(args):
   retries    = args.retries    # retry if error is thrown
   getnevts   = args.getnevts   # check nevents in local files
   skipempty  = args.skipempty  # do not write empty events
-  ncores     = args.ncores     # number of cores to get nevents in parallel
+  ncores     = CONFIG.ncores if args.ncores==None else args.ncores # number of cores to get nevents in parallel
   verbosity  = args.verbosity
   cfgname    = CONFIG._path
   if verbosity>=1:
@@ -327,6 +326,7 @@ def main_link(args):
       module = rreplace(module,'.py')
       path   = os.path.join('python/analysis/','/'.join(module.split('.')[:-1]))
       ensureinit(path,by="pico.py") # ensure an __init__.py exists in path
+      from TauFW.PicoProducer.analysis.utils import ensuremodule # imports ROOT
       modobj = ensuremodule(module)
       modpath = lreplace(os.path.relpath(modobj.__file__),"../../../python/TauFW/PicoProducer/")
       print(">>> Linked to %s"%(modpath))
@@ -7,7 +7,8 @@ from TauFW.common.tools.file import ensuredir, getline
 from TauFW.common.tools.utils import execute, chunkify
 from TauFW.common.tools.string import repkey, lreplace, alphanum_key
 from TauFW.common.tools.LoadingBar import LoadingBar
-from TauFW.PicoProducer.batch.utils import getbatch, getcfgsamples, chunkify_by_evts, evtsplitexp
+from TauFW.PicoProducer.batch.utils import getbatch, getcfgsamples, chunkify_by_evts, evtsplitexp,\
+                                           parsetime, updaterate, getrate
 from TauFW.PicoProducer.storage.utils import getstorage, getsamples, isvalid, itervalid, print_no_samples
 from TauFW.PicoProducer.pico.run import getmodule
 from TauFW.PicoProducer.pico.common import *
@@ -45,14 +46,17 @@ def preparejobs(args):
   nfilesperjob = args.nfilesperjob # split jobs based on number of files
   maxevts      = args.maxevts      # split jobs based on events
   split_nfpj   = args.split_nfpj   # split failed (file-based) chunks into even smaller chunks
+  targettime   = parsetime(args.targettime) if args.targettime else None # target run time per job in seconds
   testrun      = args.testrun      # only run a few test jobs
   queue        = args.queue        # queue option for the batch system (job flavor for HTCondor)
   force        = args.force        # force submission, even if old job output exists
   prompt       = args.prompt       # ask user for confirmation
   tmpdir       = args.tmpdir or CONFIG.get('tmpskimdir',None) # temporary dir for creating skimmed file before copying to outdir
-  ncores       = args.ncores       # number of cores; validate output files in parallel
+  ncores       = CONFIG.ncores if args.ncores==None else args.ncores # number of cores; validate output files in parallel
   verbosity    = args.verbosity
   jobs         = None
+  if resubmit and checkqueue<0: # refresh index of all user's jobs once, and reuse it for all samples
+    getbatch(CONFIG,verb=verbosity).getjobs(refresh=True,verb=verbosity-1)
   
   # LOOP over ERAS
   for era in eras:
@@ -136,6 +140,21 @@ def preparejobs(args):
         logdir     = ensuredir(jobdir,"log")
         cfgname    = "%s/jobconfig%s.json"%(cfgdir,jobtag)
         joblist    = '%s/jobarglist%s.txt'%(cfgdir,jobtag)
+        
+        # EVENT RATE: record from logs of finished jobs, and split jobs to target run time
+        if targettime:
+          ratekey  = "%s:%s:%s"%(channel,module,dtype)
+          updaterate(ratekey,logdir,verb=verbosity) # only parse logs if needed
+        if targettime and maxevts==None: # user's maxevts takes priority
+          rate = getrate(ratekey,verb=verbosity)
+          if rate:
+            maxevts_ = max(1,int(rate*targettime))
+            print(">>> Splitting jobs into %d events for a target run time of %.1f hours at a measured rate of %.1f Hz"%(
+                  maxevts_,targettime/3600.,rate))
+          else:
+            LOG.warn("No measured event rate yet for %r. Run a first (test) submission, "%(ratekey)+
+                     "or set maxevts (-m) by hand. Using maxevts=%s..."%(maxevts_))
+        
         if verbosity==1:
           print(">>> %-12s = %s"%('cfgname',cfgname))
           print(">>> %-12s = %s"%('joblist',joblist))
@@ -203,7 +222,7 @@ def preparejobs(args):
         if resubmit: # resubmission
           if checkqueue==1 and jobs!=None: # check jobs only once to speed up performance
             batch = getbatch(CONFIG,verb=verbosity)
-            jobs  = batch.jobs(verb=verbosity-1)
+            jobs  = batch.getjobs(verb=verbosity-1) # from cache
           infiles, chunkdict = checkchunks(sample,channel=channel,tag=tag,jobs=jobs,checkqueue=checkqueue,checkevts=checkevts,
                                            checkexpevts=checkexpevts,das=checkdas,ncores=ncores,verb=verbosity)[:2]
           nevents = sample.jobcfg['nevents'] # updated in checkchunks
@@ -408,7 +427,7 @@ def checkchunks(sample,**kwargs):
   if checkqueue<0 or pendjobs:
     if checkqueue!=1 or not pendjobs:
       batch = getbatch(CONFIG,verb=verbosity)
-      pendjobs = batch.jobs(jobids,verb=verbosity-1) # refresh job list
+      pendjobs = batch.getjobs(jobids,verb=verbosity-1) # get job list from index of all user's jobs, refreshed once per command
     elif pendjobs:
       pendjobs = [j for j in pendjobs if j.jobid in jobids] # get new job list with right job id
   
@@ -876,13 +895,15 @@ def main_status(args):
     haddcmd      = args.haddcmd      # alternative hadd command, e.g. haddnano.py
     maxopenfiles = args.maxopenfiles # maximum number of files opened during hadd, via -n option
   dryrun         = args.dryrun       # run through routine without actually executing hadd, rm, ...
-  ncores         = args.ncores       # number of cores; validate output files in parallel
+  ncores         = CONFIG.ncores if args.ncores==None else args.ncores # number of cores; validate output files in parallel
   verbosity      = args.verbosity
   cmdverb        = max(1,verbosity)
   outdirformat   = CONFIG.outdir
   jobdirformat   = CONFIG.jobdir
   storedirformat = CONFIG.picodir
   jobs           = None
+  if checkqueue<0: # refresh index of all user's jobs once, and reuse it for all samples
+    getbatch(CONFIG,verb=verbosity).getjobs(refresh=True,verb=verbosity-1)
   if subcmd not in ['hadd','clean','haddclean']:
     if not channels:
       channels = ['*']
@@ -933,7 +954,7 @@ def main_status(args):
         # CHECK JOBS ONLY ONCE
         if checkqueue==1 and jobs!=None:
           batch = getbatch(CONFIG,verb=verbosity)
-          jobs  = batch.jobs(verb=verbosity-1)
+          jobs  = batch.getjobs(verb=verbosity-1) # from cache
         
         # HADD or CLEAN
         if subcmd in ['hadd','haddclean','clean']:
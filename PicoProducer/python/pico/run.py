@@ -1,8 +1,12 @@
 # Author: Izaak Neutelings (April 2020)
-import os, sys
+import os, sys, glob, time
+from subprocess import Popen, STDOUT
 from TauFW.common.tools.utils import execute
+from TauFW.common.tools.file import ensuredir, rmfile
+from TauFW.common.tools.math import ceil
 from TauFW.PicoProducer.analysis.utils import ensuremodule
-from TauFW.PicoProducer.storage.utils import getsamples, print_no_samples
+from TauFW.PicoProducer.storage.utils import getsamples, print_no_samples, getnevents
+from TauFW.PicoProducer.batch.utils import chunkify_by_evts, evtsplitexp
 from TauFW.PicoProducer.pico.common import *
 
 
@@ -34,6 +38,7 @@ def main_run(args):
   dryrun     = args.dryrun     # prepare and print command, without executing
   verbosity  = args.verbosity  # verbosity to print out what's going on under the hood
   preselect  = args.preselect  # extra selection string
+  ncores     = args.ncores or 1 # number of parallel processes over event ranges
   if len(filters)==0:
     filters = [None]
   
@@ -151,16 +156,24 @@ def main_run(args):
           runcmd += " -y %s -c %s -M %s -o %s"%(era,channel,module,outdir)
         if dtype:
           runcmd += " -d %r"%(dtype)
+        optstr = "" # options added last
+        if prefetch:
+          optstr += " -p"
+        if extraopts_:
+          optstr += " --opt '%s'"%("' '".join(extraopts_))
+        if ncores>=2 and infiles: # split in event ranges, run in parallel & hadd
+          evtdict = sample.filenevts if sample else { }
+          chunks  = getchunks(infiles,ncores,maxevts=maxevts,evtdict=evtdict,verb=verbosity)
+          run_parallel(runcmd,optstr,chunks,outdir,filetag,ncores=ncores,skim=skim,dryrun=dryrun,verb=verbosity)
+          print('')
+          continue
         if filetag:
           runcmd += " -t %r"%(filetag) # postfix
         if maxevts:
           runcmd += " -m %s"%(maxevts)
         if infiles:
           runcmd += " -i %s"%(' '.join(infiles))
-        if prefetch:
-          runcmd += " -p"
-        if extraopts_:
-          runcmd += " --opt '%s'"%("' '".join(extraopts_))
+        runcmd += optstr
         #elif nfiles:
         #  runcmd += " --nfiles %s"%(nfiles)
         print(">>> Executing: "+bold(runcmd))
@@ -171,6 +184,117 @@ def main_run(args):
       
 
 
+####################
+#   RUN PARALLEL   #
+####################
+
+def getchunks(infiles,ncores,maxevts=-1,evtdict=None,verb=0):
+  """Split input files into about ncores chunks of similar number of events,
+  formatted like chunkify_by_evts for batch jobs (i.e. 'fname:firstevt:maxevts' for split files).
+  Return list of (chunk,nevts)."""
+  if evtdict==None:
+    evtdict = { }
+  if maxevts and maxevts>0: # like picojob.py & skimjob.py: only process the first maxevts events of the first file
+    fname = infiles[0]
+    if fname not in evtdict:
+      evtdict[fname] = getnevents(fname,verb=verb)
+    ntot  = min(maxevts,evtdict[fname])
+    nmax  = max(1,int(ceil(float(ntot)/ncores)))
+    return [([ "%s:%d:%d"%(fname,i,min(nmax,ntot-i)) ],min(nmax,ntot-i)) for i in range(0,ntot,nmax)]
+  ntot = 0
+  for fname in infiles:
+    if fname not in evtdict: # store for possible reuse
+      evtdict[fname] = getnevents(fname,verb=verb)
+    ntot += evtdict[fname]
+  nmax = max(1,int(ceil(float(ntot)/ncores)))
+  fchunks = chunkify_by_evts(infiles[:],nmax,evtdict=evtdict,verb=verb)[1]
+  chunks  = [ ]
+  for fchunk in fchunks:
+    evtmatch = evtsplitexp.match(fchunk[0])
+    if evtmatch:
+      nevts = min(int(evtmatch.group(3)),evtdict[evtmatch.group(1)]-int(evtmatch.group(2)))
+    else:
+      nevts = sum(evtdict[f] for f in fchunk)
+    chunks.append((fchunk,nevts))
+  return chunks
+  
+
+def run_parallel(runcmd,optstr,chunks,outdir,filetag,ncores=4,skim=False,dryrun=False,verb=0):
+  """Run processor on chunks of input files (split by event ranges) in a pool of ncores local processes,
+  and hadd the output of all chunks. Each chunk's output is tagged with the chunk index, like batch jobs."""
+  ntot     = sum(n for c, n in chunks)
+  nchunks  = len(chunks)
+  outdir   = ensuredir(outdir)
+  haddcmd  = "haddnano.py" if skim else "hadd -f"
+  print(">>> Running %d chunks with %d events in total on %d cores..."%(nchunks,ntot,ncores))
+  
+  # COMMANDS per chunk
+  jobs = [ ]
+  for ichunk, (fchunk, nevts) in enumerate(chunks):
+    jobcmd   = runcmd+" -t %r"%("%s_%d"%(filetag,ichunk))
+    evtmatch = evtsplitexp.match(fchunk[0])
+    if evtmatch: # event range
+      jobcmd += " --firstevt %s -m %s -i %s"%(evtmatch.group(2),evtmatch.group(3),evtmatch.group(1))
+    else:
+      jobcmd += " -i %s"%(' '.join(fchunk))
+    jobcmd  += optstr
+    logname  = os.path.join(outdir,"log%s_%d.log"%(filetag,ichunk))
+    jobs.append((ichunk,jobcmd,logname,nevts))
+    if verb>=1 or dryrun:
+      print(">>> chunk=%d, nevts=%d, jobcmd=%r"%(ichunk,nevts,jobcmd))
+  if dryrun:
+    return None
+  
+  # RUN in pool of processes
+  time0    = time.time()
+  queue    = jobs[:]
+  running  = [ ] # list of (job, process, logfile)
+  failed   = [ ]
+  ndone    = 0
+  nevtdone = 0
+  while queue or running:
+    while queue and len(running)<ncores: # start new process
+      job     = queue.pop(0)
+      logfile = open(job[2],'w')
+      process = Popen(job[1],stdout=logfile,stderr=STDOUT,shell=True)
+      running.append((job,process,logfile))
+    time.sleep(0.5)
+    for job, process, logfile in running[:]:
+      if process.poll()==None: continue # still running
+      running.remove((job,process,logfile))
+      logfile.close()
+      ndone    += 1
+      nevtdone += job[3]
+      if process.returncode!=0:
+        failed.append(job)
+        LOG.warn("Chunk %d failed with return code %s! Please check the log file %s"%(job[0],process.returncode,job[2]))
+      else:
+        rmfile(job[2],verb=verb)
+      print(">>> Finished %d/%d chunks, %d/%d events (%.1f%%) after %.1f seconds..."%(
+        ndone,nchunks,nevtdone,ntot,100.0*nevtdone/max(ntot,1),time.time()-time0))
+  if failed:
+    LOG.warn("%d/%d chunks failed! Not merging the output..."%(len(failed),nchunks))
+    return None
+  
+  # HADD output of all chunks, removing the chunk index from the file name
+  targets = { }
+  for ichunk in range(nchunks):
+    postfix = "%s_%d.root"%(filetag,ichunk)
+    pattern = os.path.join(outdir,"*"+postfix) if skim else os.path.join(outdir,"pico"+postfix)
+    for fname in sorted(glob.glob(pattern)):
+      target = fname[:-len(postfix)]+filetag+".root"
+      targets.setdefault(target,[ ]).append(fname)
+  for target, sources in targets.items():
+    if len(sources)==1:
+      os.rename(sources[0],target)
+    else:
+      execute("%s %s %s"%(haddcmd,target,' '.join(sources)),verb=verb)
+      for fname in sources:
+        rmfile(fname,verb=verb)
+    print(">>> Created %s after %.1f seconds"%(target,time.time()-time0))
+  return list(targets.keys())
+  
+
 ##################
 #   GET MODULE   #
 ##################
@@ -189,9 +313,9 @@ def getmodule(channel,extraopts):
   ###  processor = module
   else:
     parts     = module.split(' ') # "MODULE [KEY=VALUE ...]"
-    processor = "picojob.py"
     module    = parts[0]
-    ensuremodule(module) # sanity check
+    modclass  = getattr(ensuremodule(module),module.split('.')[-1]) # sanity check
+    processor = "picojob_columnar.py" if getattr(modclass,'columnar',False) else "picojob.py"
     extrachopts.extend(parts[1:])
   procpath  = os.path.join("python/processors",processor)
   if not os.path.isfile(procpath):
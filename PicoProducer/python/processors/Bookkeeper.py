@@ -2,6 +2,7 @@
 # Description: Keep track of number of events and sum of weights before and after skimming
 from __future__ import print_function # for python3 compatibility
 import time
+import numpy as np
 import ROOT
 from ROOT import TH1D
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
@@ -75,6 +76,9 @@ class Bookkeeper(Module):
     outputFile.cutflow.SetName('cutflow')
     outputFile.cutflow.Reset()
     outputFile.cutflow.SetDirectory(outputFile)
+    self.hasgenwgt = hasattr(inputTree,'genWeight') # for (NLO) MC
+    self.nseen     = 0  # number of events seen by analyze
+    self.sumw      = 0. # sum of weights of events seen by analyze
   
   def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
     """After processing a file."""
@@ -88,32 +92,53 @@ class Bookkeeper(Module):
     if not firstEntry or firstEntry<0:
       firstEntry = 0
     elist  = inputTree._entrylist
-    nread  = min(inputTree.GetEntries()-firstEntry,maxEntries)
+    nfull  = inputTree.GetEntries()
+    nread  = min(nfull-firstEntry,maxEntries)
     nskim  = elist.GetN() if elist else nread #inputTree.GetEntries()
+    npass  = outputTree.GetEntries()
     if self.verb>=2:
-      print(">>> Bookkeeper.endFile: tree entries, input=%r, output=%r, first=%r, max=%r, nread=%r, nskim=%r"%(
-        inputTree.GetEntries(),outputTree.GetEntries(),firstEntry,maxEntries,nread,nskim))
+      print(">>> Bookkeeper.endFile: tree entries, input=%r, output=%r, first=%r, max=%r, nread=%r, nskim=%r, nseen=%r"%(
+        nfull,npass,firstEntry,maxEntries,nread,nskim,self.nseen))
     assert nread>=nskim, "Number of read entries (%s) should be the larger or equal to the number of skimmed entries (%s)..."%(nread,nskim)
     
     # UNWEIGHTED
-    cutflow.SetBinContent(self.bin_full,cutflow.GetBinContent(self.bin_full)+inputTree.GetEntries())
+    cutflow.SetBinContent(self.bin_full,cutflow.GetBinContent(self.bin_full)+nfull)
     cutflow.SetBinContent(self.bin_read,cutflow.GetBinContent(self.bin_read)+nread)
     cutflow.SetBinContent(self.bin_skim,cutflow.GetBinContent(self.bin_skim)+nskim)
-    cutflow.SetBinContent(self.bin_pass,cutflow.GetBinContent(self.bin_pass)+outputTree.GetEntries())
+    cutflow.SetBinContent(self.bin_pass,cutflow.GetBinContent(self.bin_pass)+npass)
     
     # WEIGHTED
-    if hasattr(inputTree,'genWeight'): # for (NLO) MC
+    # The sums of weights of skimmed or passed events are accumulated in the main event loop by analyze:
+    # nanoAOD-tools only calls analyze if all previous modules passed, so the Bookkeeper sees
+    # all skimmed events if it comes first, or only the passed events if it comes last.
+    # The other sums are computed from a single read of genWeight in the input tree.
+    # Empty input trees add nothing, and GetV1 returns a null buffer, so skip them.
+    if self.hasgenwgt and nfull>0:
       if self.verb>=2:
         print(">>> Bookkeeper.endFile: Getting sum of weights...")
-      #cutflow.SetBinContent(self.bin_read_wgt,inputTree.GetEntries('genWeight')+cutflow.GetBinContent(self.bin_read_wgt))
-      inputTree.Draw("%s >> +cutflow"%(self.bin_full_wgt-0.5),'genWeight','gOff')
-      inputTree.Draw("%s >> +cutflow"%(self.bin_read_wgt-0.5),'genWeight','gOff',maxEntries,firstEntry)
-      if elist: # entry list after pre-skimming (firstEntry, maxEntries, pre-selection, JSON)
-        inputTree.SetEntryList(elist)
-        inputTree.Draw("%s >> +cutflow"%(self.bin_skim_wgt-0.5),'genWeight','gOff')
+      inputTree.SetEntryList(0) # read all entries
+      inputTree.SetEstimate(nfull+1) # keep all values in memory
+      inputTree.Draw('genWeight','','goff')
+      weights = inputTree.GetV1()
+      weights.reshape((nfull,))
+      weights = np.array(weights,dtype=np.float64)
+      sumw_full = weights.sum()
+      sumw_read = weights[firstEntry:firstEntry+nread].sum()
+      if self.nseen==nskim: # Bookkeeper saw all skimmed events
+        sumw_skim = self.sumw
+      elif elist: # entry list after pre-skimming (firstEntry, maxEntries, pre-selection, JSON)
+        entries   = np.fromiter((elist.GetEntry(i) for i in range(nskim)),dtype=np.int64,count=nskim)
+        sumw_skim = weights[entries].sum()
       else: # no pre-selection or JSON
-        cutflow.SetBinContent(self.bin_skim_wgt,cutflow.GetBinContent(self.bin_read_wgt)) # reuse read sum of weights 
-    if hasattr(outputTree,'genWeight'):
+        sumw_skim = sumw_read # reuse read sum of weights
+      cutflow.SetBinContent(self.bin_full_wgt,cutflow.GetBinContent(self.bin_full_wgt)+sumw_full)
+      cutflow.SetBinContent(self.bin_read_wgt,cutflow.GetBinContent(self.bin_read_wgt)+sumw_read)
+      cutflow.SetBinContent(self.bin_skim_wgt,cutflow.GetBinContent(self.bin_skim_wgt)+sumw_skim)
+      if self.nseen==npass: # Bookkeeper saw only passed events
+        cutflow.SetBinContent(self.bin_pass_wgt,cutflow.GetBinContent(self.bin_pass_wgt)+self.sumw)
+      elif hasattr(outputTree,'genWeight'):
+        outputTree.Draw("%s >> +cutflow"%(self.bin_pass_wgt-0.5),'genWeight','gOff')
+    elif npass>0 and hasattr(outputTree,'genWeight'):
       outputTree.Draw("%s >> +cutflow"%(self.bin_pass_wgt-0.5),'genWeight','gOff')
     
     # WRITE
@@ -138,5 +163,8 @@ class Bookkeeper(Module):
   
   def analyze(self, event):
     """Process and pre-select events; fill branches and return True if the events passes, return False otherwise."""
+    self.nseen += 1
+    if self.hasgenwgt:
+      self.sumw += event.genWeight
     return True # default super class returns None
   
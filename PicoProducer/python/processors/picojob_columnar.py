@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+# Author: Izaak Neutelings (November 2023)
+# Description: Analyze nanoAOD file in chunks of events with a columnar module (see analysis/columnar.py),
+#              and store locally: same options and output as picojob.py
+import os
+import time; time0 = time.time()
+import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
+from TauFW.PicoProducer.analysis.utils import getmodule, getyear, convertstr
+from TauFW.PicoProducer.analysis.columnar import iterevents, getlumimask
+from TauFW.PicoProducer.processors import ensuredir
+from TauFW.PicoProducer.corrections.era_config import getjson
+from argparse import ArgumentParser
+parser = ArgumentParser()
+parser.add_argument('-i', '--infiles',  dest='infiles',   default=[ ], nargs='+')
+parser.add_argument('-o', '--outdir',   dest='outdir',    default='.')
+parser.add_argument('-C', '--copydir',  dest='copydir',   default=None)
+parser.add_argument('-s', '--firstevt', dest='firstevt',  type=int, default=0)
+parser.add_argument('-m', '--maxevts',  dest='maxevts',   type=int, default=None)
+parser.add_argument('-n', '--nfiles',   dest='nfiles',    type=int, default=None)
+parser.add_argument('-t', '--tag',      dest='tag',       default="")
+parser.add_argument('-d', '--dtype',    dest='dtype',     choices=['data','mc','embed'], default=None)
+parser.add_argument('-y','-e','--era',  dest='era',       default='2018')
+parser.add_argument('-M', '--module',   dest='module',    default=None)
+parser.add_argument('-c', '--channel',  dest='channel',   default=None)
+parser.add_argument('-E', '--opts',     dest='extraopts', default=[ ], nargs='+')
+parser.add_argument('-p', '--prefetch', dest='prefetch',  action='store_true', help="not used in columnar mode")
+parser.add_argument('-b', '--branchsel',dest='branchsel', default=None, help="not used in columnar mode: only needed branches are read")
+parser.add_argument('-A', '--compress', dest='compress',  help="e.g. 'LZMA:9'")
+parser.add_argument('-k', '--chunksize',dest='chunksize', type=int, default=100000, help="number of events per chunk, default=%(default)s")
+parser.add_argument('-v', '--verbose',  dest='verbosity', type=int, nargs='?', const=1, default=0)
+args = parser.parse_args()
+
+
+# SETTING
+era       = args.era      # e.g. '2017', 'UL2017', ...
+year      = getyear(era)  # integer year, e.g. 2017
+modname   = args.module   # main module to run
+channel   = args.channel  # channel
+if channel:
+  import TauFW.PicoProducer.tools.config as GLOB
+  CONFIG  = GLOB.getconfig(verb=0)
+  if not modname:
+    assert channel in CONFIG.channels, "Did not find channel '%s' in configuration. Available channels: %s"%(channel,CONFIG.channels)
+    modname = CONFIG.channels[args.channel]
+else:
+  if not modname:
+    modname = "ModuleMuTauColumnar"
+  channel = modname
+dtype     = args.dtype             # data type ('data', 'mc', 'embed')
+outdir    = ensuredir(args.outdir) # directory to create output
+copydir   = args.copydir           # directory to copy output to at end
+firstevt  = args.firstevt          # index of first event to run
+maxevts   = args.maxevts           # maximum number of events to run
+nfiles    = args.nfiles or (1 if (maxevts!=None and maxevts>0) else -1) # maximum number of files to run
+chunksize = args.chunksize         # number of events per chunk
+tag       = args.tag               # postfix tag of job output file
+if tag:
+  tag     = ('' if tag.startswith('_') else '_') + tag
+outfname  = os.path.join(outdir,"pico%s.root"%(tag))
+compress  = args.compress          # compression algorithm & level, e.g. 'LZMA:9'
+verbosity = args.verbosity         # verbosity level
+json      = None                   # JSON file of certified events
+
+# GET FILES
+infiles   = args.infiles
+assert infiles, "No input files given! Please use -i/--infiles."
+if nfiles>0:
+  infiles = infiles[:nfiles]
+if dtype==None:
+  if any(s in infiles[0] for s in ['SingleMuon',"/Tau/",'SingleElectron','EGamma']):
+    dtype = 'data'
+  else:
+    dtype = 'mc'
+if dtype=='data':
+  json = getjson(era,dtype)
+
+# EXTRA OPTIONS
+kwargs = { 'era': era, 'year': year, 'dtype': dtype, 'compress': compress, 'verb': verbosity }
+for option in args.extraopts:
+  assert '=' in option, "Extra option '%s' should contain '='! All: %s"%(option,args.extraopts)
+  split       = option.split('=')
+  key, val    = split[0], ''.join(split[1:])
+  kwargs[key] = convertstr(val) # convert to bool, float or int if possible
+
+# PRINT
+print('-'*80)
+print(">>> %-12s = %r"%('era',era))
+print(">>> %-12s = %r"%('year',year))
+print(">>> %-12s = %r"%('channel',channel))
+print(">>> %-12s = %r"%('modname',modname))
+print(">>> %-12s = %r"%('dtype',dtype))
+print(">>> %-12s = %r"%('kwargs',kwargs))
+print(">>> %-12s = %s"%('firstevt',firstevt))
+print(">>> %-12s = %s"%('maxevts',maxevts))
+print(">>> %-12s = %s"%('chunksize',chunksize))
+print(">>> %-12s = %r"%('outdir',outdir))
+print(">>> %-12s = %r"%('copydir',copydir))
+print(">>> %-12s = %s"%('infiles',infiles))
+print(">>> %-12s = %r"%('outfname',outfname))
+print(">>> %-12s = %r"%('json',json))
+print(">>> %-12s = %s"%('cwd',os.getcwd()))
+print('-'*80)
+
+# GET MODULE
+module = getmodule(modname)(outfname,**kwargs)
+assert getattr(module,'columnar',False), "Module %r does not support columnar processing! Please use picojob.py."%(modname)
+
+# RUN
+lumimask = getlumimask(json) if json else None
+nevts, npass = 0, 0
+module.beginJob()
+for events in iterevents(infiles,module.branches,chunksize=chunksize,firstevt=firstevt,maxevts=maxevts,
+                         aliases=module.aliases,verb=verbosity):
+  nevts += len(events)
+  if lumimask:
+    events = events[lumimask(events.run,events.luminosityBlock)]
+  npass += module.process(events)
+  print(">>> Processed %d events, selected %d events after %.1f seconds"%(nevts,npass,time.time()-time0))
+module.endJob()
+
+# COPY
+if copydir and outdir!=copydir:
+  print(">>> %-12s = %s"%('cwd',os.getcwd()))
+  print(">>> %-12s = %s"%('ls',os.listdir(outdir)))
+  from TauFW.PicoProducer.storage.utils import getstorage
+  from TauFW.common.tools.file import rmfile
+  store = getstorage(copydir,verb=2)
+  store.cp(outfname)
+  print(">>> Removing %r..."%(outfname))
+  rmfile(outfname)
+
+# DONE
+print(">>> picojob_columnar.py done after %.1f seconds"%(time.time()-time0))
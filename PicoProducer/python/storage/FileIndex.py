@@ -0,0 +1,115 @@
+# Author: Izaak Neutelings (November 2023)
+# Description: Persistent SQLite index of the number of events and validity of ROOT files,
+#              to avoid reopening unchanged files in repeated status/resubmit/hadd cycles
+import os, re
+import sqlite3
+from threading import Lock
+from TauFW.common.tools.file import ensuredir
+from TauFW.common.tools.log import Logger
+LOG = Logger('FileIndex')
+urlexp = re.compile(r"^\w+://[^/]+/(/.+)$") # e.g. root://eosuser.cern.ch//eos/user/... -> /eos/user/...
+_fileindex = { } # global FileIndex instance per process: { pid: FileIndex }
+
+
+class FileIndex(object):
+  """Persistent SQLite index of results of expensive file checks, like number of events,
+  cutflow bin content, or validity. Entries are keyed by the file's local path and a key string,
+  e.g. 'entries:Events' or 'valid:cutflow:1', and are only used if the file size and modification time
+  did not change. Remote files (XRootD URLs) are only indexed if they can be accessed via a local mount,
+  e.g. /eos/ or /pnfs/.
+    index = FileIndex("~/.cache/TauFW/fileindex.db")
+    nevts = index.get(fname,'entries:Events') # None if not indexed, or file changed
+    if nevts==None:
+      nevts = ... # open file
+      index.set(fname,'entries:Events',nevts)
+  """
+  version = 1 # increase to invalidate old entries after changing the keys or values
+
+  def __init__(self, path=None, verb=0):
+    if path==None:
+      path = os.environ.get('TAUFW_FILEINDEX',"~/.cache/TauFW/fileindex.db")
+    self.path      = os.path.abspath(os.path.expanduser(os.path.expandvars(path)))
+    self.verbosity = verb
+    self.nhits     = 0
+    self.nmiss     = 0
+    self.conn      = None
+    self.lock      = Lock() # allow use in threads (e.g. iterthreads)
+    try:
+      ensuredir(os.path.dirname(self.path))
+      self.conn = sqlite3.connect(self.path,timeout=60,check_same_thread=False) # wait for other processes to finish writing
+      self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT, key TEXT, size INTEGER, mtime REAL, "
+                        "value REAL, PRIMARY KEY (path, key))")
+    except (sqlite3.Error,OSError) as err: # e.g. read-only or locked file system
+      LOG.warning("FileIndex: Could not open %s: %s. Not using file index..."%(self.path,err))
+      self.conn = None
+
+  def __repr__(self):
+    return "<%s(%r) at %s>"%(self.__class__.__name__,self.path,hex(id(self)))
+
+  def getstat(self, fname):
+    """Return local path, size and modification time of a file, or None if it cannot be accessed locally."""
+    match = urlexp.match(fname)
+    path  = match.group(1) if match else fname
+    try:
+      stat = os.stat(path)
+    except OSError: # remote file, or does not exist
+      return None
+    return os.path.realpath(path), stat.st_size, stat.st_mtime
+
+  def get(self, fname, key):
+    """Return indexed value, or None if the file was not indexed or changed."""
+    if not self.conn:
+      return None
+    stat = self.getstat(fname)
+    if not stat:
+      return None
+    path, size, mtime = stat
+    try:
+      with self.lock:
+        row = self.conn.execute("SELECT size, mtime, value FROM files WHERE path=? AND key=?",
+                                (path,"%s:%s"%(self.version,key))).fetchone()
+    except sqlite3.Error as err:
+      LOG.warning("FileIndex.get: Could not read from %s: %s"%(self.path,err))
+      return None
+    if row==None or row[0]!=size or row[1]!=mtime: # not indexed, or changed
+      self.nmiss += 1
+      return None
+    self.nhits += 1
+    LOG.verb("FileIndex.get: Found %s=%r for %s"%(key,row[2],fname),self.verbosity,3)
+    return row[2]
+
+  def set(self, fname, key, value):
+    """Store value in index."""
+    if not self.conn:
+      return False
+    stat = self.getstat(fname)
+    if not stat:
+      return False
+    path, size, mtime = stat
+    try:
+      with self.lock, self.conn: # commit
+        self.conn.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?)",
+                          (path,"%s:%s"%(self.version,key),size,mtime,value))
+    except sqlite3.Error as err: # e.g. database is locked
+      LOG.warning("FileIndex.set: Could not write to %s: %s"%(self.path,err))
+      return False
+    return True
+
+  def clear(self):
+    """Remove all entries."""
+    if self.conn:
+      with self.lock, self.conn:
+        self.conn.execute("DELETE FROM files")
+
+
+def getfileindex(verb=0):
+  """Help function to get a FileIndex instance, one per process (shared by its threads),
+  as SQLite connections cannot be shared with forked processes (e.g. MultiProcessor).
+  Set the environment variable TAUFW_FILEINDEX to an empty string to disable the file index."""
+  if os.environ.get('TAUFW_FILEINDEX',None)=="":
+    return None
+  pid = os.getpid()
+  if pid not in _fileindex:
+    _fileindex[pid] = FileIndex(verb=verb)
+  return _fileindex[pid]
+
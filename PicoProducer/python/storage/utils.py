@@ -1,15 +1,16 @@
 # Author: Izaak Neutelings (May 2020)
 from past.builtins import basestring # for python2 compatibility
-import os, glob
+import os, glob, time
 import getpass, platform
 import importlib
 from fnmatch import fnmatch
 from TauFW.PicoProducer import basedir
 from TauFW.common.tools.log import Logger
 from TauFW.common.tools.file import ensurefile
-from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.string import repkey, isglob, quotestrs
-from ROOT import TFile
+from TauFW.common.tools.lazy import lazyimport
+from TauFW.PicoProducer.storage.FileIndex import getfileindex
+ROOT = lazyimport('ROOT') # only import ROOT when opening files, to speed up start of pico.py
 LOG  = Logger('Storage')
 host = platform.node()
 user = getpass.getuser()
@@ -115,9 +116,17 @@ def getsamples(era,channel="",tag="",dtype=[],filter=[],veto=[],dasfilter=[],das
   
 
 def getnevents(fname,treename='Events',verb=0):
-  """Help function to get number of entries in a tree."""
+  """Help function to get number of entries in a tree.
+  Use the file index if the file did not change since the last time."""
+  index = getfileindex()
+  key   = "entries:%s"%(treename)
+  if index:
+    nevts = index.get(fname,key)
+    if nevts!=None:
+      return int(nevts)
   if verb>=3:
     print(">>> storage.utils.getnevents: opening %s:%r"%(fname,treename))
+  from TauFW.common.tools.root import ensureTFile
   file = ensureTFile(fname)
   tree = file.Get(treename)
   if not tree:
@@ -125,14 +134,23 @@ def getnevents(fname,treename='Events',verb=0):
     return 0
   nevts = tree.GetEntries()
   file.Close()
+  if index:
+    index.set(fname,key,nevts)
   return nevts
   
 
 def isvalid(fname,hname='cutflow',bin=1):
-  """Check if a given file is valid, or corrupt."""
+  """Check if a given file is valid, or corrupt.
+  Use the file index if the file did not change since it was last found to be valid."""
+  index = getfileindex()
+  key   = "valid:%s:%s"%(hname,bin)
+  if index:
+    nevts = index.get(fname,key)
+    if nevts!=None:
+      return nevts
   nevts = -1
   try:
-    file = TFile.Open(fname,'READ')
+    file = ROOT.TFile.Open(fname,'READ')
   except OSError as err:
     print(err)
     file = None
@@ -149,38 +167,124 @@ def isvalid(fname,hname='cutflow',bin=1):
           LOG.warning("Cutflow of file %r has nevts=%s<=0..."%(fname,nevts))
       else: # corrupted ?
         LOG.warning("Could not open cutflow %s:%s..."%(fname,hname))
+  if file:
+    file.Close()
+  if index and nevts>0: # only store valid files; output of running jobs may still be incomplete
+    index.set(fname,key,nevts)
   return nevts
   
 
-def itervalid(fnames,checkevts=True,nchunks=None,ncores=4,verb=0,**kwargs):
-  """Iterate over file names and get number of events processed & check for corruption."""
+def iterthreads(func,fnames,nthreads=16,timeout=None,retries=0,default=None,verb=0,**kwargs):
+  """Apply a function to each file in a bounded pool of threads, and yield (result,fname) as soon as
+  each file is done, in order of completion. This is faster than forked processes for I/O-bound work,
+  like opening remote files via XRootD. Files that raise an exception or return a negative result
+  (e.g. failed to open) are retried up to 'retries' times. Files that take longer than 'timeout' seconds
+  after a worker picked them up are given up on. A hanging thread cannot be killed, so it is abandoned
+  and replaced by a new worker, such that queued files and retries still run. Since the workers are
+  daemon threads, hanging threads do not block the exit of the interpreter either.
+  Files that still fail or time out after all retries yield 'default' if it is given; otherwise they are
+  left out, and an IOError listing them is raised after all other files are done.
+  TFile::Open releases the GIL only while iterating, so other threads can open files simultaneously."""
+  from threading import Thread
+  try:
+    from queue import Queue, Empty
+  except ImportError: # python2
+    from Queue import Queue, Empty
+  ROOT.EnableThreadSafety()
+  tasks   = Queue() # (fname,itry)
+  results = Queue() # (fname,itry,result,error)
+  starts  = { } # start time of each running try: { (fname,itry): time }
+  pending = { } # current try of each pending file: { fname: itry }
+  threads = [ ]
+  failed  = [ ] # files that failed after all retries
+  def worker():
+    while True:
+      task = tasks.get()
+      if task==None: # stop
+        return
+      fname, itry = task
+      starts[task] = time.time()
+      try:
+        result, error = func(fname,**kwargs), None
+      except Exception as err: # e.g. OSError for failed TFile.Open
+        result, error = None, err
+      results.put((fname,itry,result,error))
+  def addworker():
+    thread = Thread(target=worker,name="iterthreads-%d"%(len(threads)))
+    thread.daemon = True # do not block exit if a thread hangs
+    thread.start()
+    threads.append(thread)
+  def submit(fname,itry):
+    pending[fname] = itry
+    tasks.put((fname,itry))
+  for fname in fnames:
+    submit(fname,0)
+  nthreads = max(1,min(nthreads,len(fnames)))
+  if verb>=2:
+    print(">>> storage.utils.iterthreads: Running %s for %d files with %d threads..."%(func.__name__,len(fnames),nthreads))
+  release = getattr(ROOT.TFile.Open,'__release_gil__',None)
+  if release!=None: # allow threads to run TFile::Open simultaneously
+    ROOT.TFile.Open.__release_gil__ = True
+  try:
+    for i in range(nthreads):
+      addworker()
+    while pending:
+      try:
+        fname, itry, result, error = results.get(timeout=(1.0 if timeout else None))
+      except Empty:
+        fname = None
+      if fname!=None and pending.get(fname,None)==itry: # ignore results of tries that were given up on
+        if (error or result==None or result<0) and itry<retries: # retry
+          LOG.verb("storage.utils.iterthreads: Retrying %s (%d/%d)..."%(fname,itry+1,retries),verb,1)
+          submit(fname,itry+1)
+        elif error or result==None:
+          pending.pop(fname)
+          LOG.warning("storage.utils.iterthreads: %s failed for %s: %s"%(func.__name__,fname,error))
+          if default==None:
+            failed.append(fname)
+          else:
+            yield default, fname
+        else:
+          pending.pop(fname)
+          yield result, fname
+      if timeout: # give up on files that take too long
+        now = time.time()
+        for fname, itry in list(pending.items()):
+          start = starts.get((fname,itry),None)
+          if start!=None and now-start>timeout:
+            starts.pop((fname,itry))
+            addworker() # replace hanging worker
+            if itry<retries:
+              LOG.verb("storage.utils.iterthreads: Timeout after %ss for %s, retrying (%d/%d)..."%(
+                       timeout,fname,itry+1,retries),verb,1)
+              submit(fname,itry+1)
+            else:
+              LOG.warning("storage.utils.iterthreads: Timeout after %ss for %s!"%(timeout,fname))
+              pending.pop(fname)
+              if default==None:
+                failed.append(fname)
+              else:
+                yield default, fname
+  finally:
+    for thread in threads: # stop idle threads; hanging daemon threads are abandoned
+      tasks.put(None)
+    if release!=None: # restore
+      ROOT.TFile.Open.__release_gil__ = release
+  if failed:
+    LOG.throw(IOError,"storage.utils.iterthreads: %s failed or timed out for %d/%d files after %d retries: %s"%(
+              func.__name__,len(failed),len(fnames),retries,', '.join(failed)))
+  
+
+def itervalid(fnames,checkevts=True,nchunks=None,ncores=4,nthreads=None,timeout=300,retries=1,verb=0,**kwargs):
+  """Iterate over file names and get number of events processed & check for corruption.
+  Files are opened in a pool of nthreads (default: 16 per core) and yielded in order of completion."""
   if not checkevts: # just skip validation step and return 0
     for fname in fnames:
       yield 0, fname
-  elif ncores>=2 and len(fnames)>5: # run validation in parallel
-    from TauFW.Plotter.plot.MultiThread import MultiProcessor
-    from TauFW.common.tools.math import partition
-    processor = MultiProcessor(max=ncores)
-    def loopvalid(fnames_,**kwargs):
-      """Help function for parallel running on subsets."""
-      return [(isvalid(f,**kwargs),f) for f in fnames_]
-    if not nchunks:
-      nchunks = 10 if len(fnames)<100 else 20 if len(fnames)<500 else 50 if len(fnames)<1000 else 100
-      nchunks = max(nchunks,2*ncores)
-    if nchunks>=len(fnames):
-      nchunks = len(fnames)-1
-    if verb>=2:
-      print(">>> storage.utils.itervalid: partitioning %d files into %d chunks for ncores=%d"%(len(fnames),nchunks,ncores))
-    for i, subset in enumerate(partition(fnames,nchunks)): # process in ncores chunks
-      if not subset: break
-      name = "itervalid_%d"%(i)
-      processor.start(loopvalid,subset,kwargs,name=name)
-    for process in processor:
-      if verb>=2:
-        print(">>> storage.utils.itervalid: joining process %r..."%(process.name))
-      nevtfiles = process.join()
-      for nevts, fname in nevtfiles:
-        yield nevts, fname
+  elif ncores>=2 and len(fnames)>5: # run validation in parallel threads
+    nthreads = nthreads or 16*ncores
+    for nevts, fname in iterthreads(isvalid,fnames,nthreads=nthreads,timeout=timeout,retries=retries,default=-1,verb=verb,**kwargs):
+      yield nevts, fname
   else:  # run validation in series
     for fname in fnames:
       if verb>=2:
@@ -189,38 +293,21 @@ def itervalid(fnames,checkevts=True,nchunks=None,ncores=4,verb=0,**kwargs):
       yield nevts, fname
   
 
-def iterevts(fnames,tree,filenevts,refresh=False,nchunks=None,ncores=0,verb=0):
+def iterevts(fnames,tree,filenevts,refresh=False,nchunks=None,ncores=0,nthreads=None,timeout=300,retries=1,verb=0):
   """Help function for Sample._getnevents to iterate over file names and get number of events processed."""
-  if ncores>=2 and len(fnames)>5: # run events check in PARALLEL
-    from TauFW.Plotter.plot.MultiThread import MultiProcessor
-    from TauFW.common.tools.math import partition
-    def loopevts(fnames_):
-      """Help function for parallel running on subsets."""
-      return [(getnevents(f,tree,verb=verb),f) for f in fnames_]
-    processor = MultiProcessor(max=ncores)
-    if not nchunks:
-      nchunks = 10 if len(fnames)<100 else 20 if len(fnames)<500 else 50 if len(fnames)<1000 else 100
-      nchunks = max(nchunks,2*ncores)
-    if nchunks>=len(fnames):
-      nchunks = len(fnames)-1
+  if ncores>=2 and len(fnames)>5: # run events check in PARALLEL threads
+    fnames_ = [ ]
+    for fname in fnames: # check cache
+      if not refresh and fname in filenevts:
+        yield filenevts[fname], fname
+      else:
+        fnames_.append(fname)
+    nthreads = nthreads or 16*ncores
     if verb>=2:
-      print(">>> storage.utils.iterevts: partitioning %d files into %d chunks for ncores=%d..."%(len(fnames),nchunks,ncores))
-    for i, subset in enumerate(partition(fnames,nchunks)): # process in ncores chunks
-      for fname in subset[:]: # check cache
-        if not refresh and fname in filenevts:
-          nevts = filenevts[fname]
-          subset.remove(fname) # don't run again
-          yield nevts, fname
-      if not subset:
-        break
-      name = "iterevts_%d"%(i)
-      processor.start(loopevts,subset,name=name)
-    for process in processor: # collect output from parallel processes
-      if verb>=2:
-        print(">>> storage.utils.iterevts: joining process %r..."%(process.name))
-      nevtfiles = process.join()
-      for nevts, fname in nevtfiles:
-        yield nevts, fname
+      print(">>> storage.utils.iterevts: retrieving number of events for %d files with %d threads..."%(len(fnames_),nthreads))
+    for nevts, fname in iterthreads(getnevents,fnames_,nthreads=nthreads,timeout=timeout,retries=retries,
+                                    verb=verb,treename=tree): # raise IOError for files that fail
+      yield nevts, fname
   else: # run events check in SERIES
     if verb>=2:
       print(">>> storage.utils.iterevts: retrieving number of events for %d files (in series)..."%(len(fnames)))
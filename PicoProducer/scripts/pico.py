@@ -6,7 +6,6 @@ try:
   from TauFW.common.tools.file import ensurefile, ensureinit
   from TauFW.common.tools.string import repkey, rreplace
   from TauFW.PicoProducer import basedir
-  from TauFW.PicoProducer.analysis.utils import ensuremodule
   from TauFW.PicoProducer.storage.utils import getsamples
   from TauFW.PicoProducer.pico.common import *
 except ImportError as err:
@@ -73,11 +72,12 @@ if __name__ == "__main__":
   parser_sam.add_argument('-E', '--opts',       dest='extraopts', type=str, nargs='+', default=[ ],
                           metavar='KEY=VALUE',  help="extra options for the skim or analysis module, "
                                                      "passed as list of 'KEY=VALUE', separated by spaces")
-  parser_sam.add_argument('-C','--ncores',      dest='ncores', type=int, default=CONFIG.ncores,
-                                                help="number of cores to run event checks or validation in parallel, default=%(default)s")
+  parser_sam.add_argument('-C','--ncores',      dest='ncores', type=int, default=None,
+                                                help="number of cores to run event checks or validation in parallel, default=%s; "%(CONFIG.ncores)+\
+                                                     "for 'run': number of parallel processes over event ranges, default=1")
   parser_job = ArgumentParser(add_help=False,parents=[parser_sam]) # common for submit, resubmit, status, ...
   parser_job.add_argument('--checkqueue',       dest='checkqueue', type=int, nargs='?', const=1, default=-1,
-                          metavar='N',          help="check job status: 0 (no check), 1 (check once, fast), -1 (check every job, slow, default)") # speed up if batch is slow
+                          metavar='N',          help="check job status: 0 (no check), 1 (check once, fast), -1 (check every job, queue queried once per command, default)") # speed up if batch is slow
   parser_job.add_argument('--skipevts',         dest='checkevts', action='store_false',
                                                 help="skip validation and counting of events in output files (faster)")
   parser_job.add_argument('--checkexpevts',     dest='checkexpevts', action='store_true', default=None,
@@ -102,6 +102,9 @@ if __name__ == "__main__":
                                                 help="number of files per job, default=%d"%(CONFIG.nfilesperjob))
   parser_job.add_argument('-m','--maxevts',     dest='maxevts', type=int, default=None,
                           metavar='NEVTS',      help="maximum number of events per job to process (split large files, group small ones), default=%d"%(CONFIG.maxevtsperjob))
+  parser_job.add_argument('--target-runtime',   dest='targettime', type=str, default=None,
+                          metavar='TIME',       help="split jobs by events to target this run time per job (e.g. '2h', '90m', '02:00:00'), "
+                                                     "using the event rate measured from the logs of earlier jobs of the same channel, module and data type")
   parser_job.add_argument('--split',            dest='split_nfpj', type=int, nargs='?', const=2, default=1,
                           metavar='NFILES',     help="divide default number of files per job, default=%(const)d")
   parser_job.add_argument('--tmpdir',           dest='tmpdir', type=str, default=None,
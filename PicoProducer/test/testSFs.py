@@ -54,6 +54,43 @@ def printtable(name,method,ptvals=None,etavals=None,etamax=3.0):
   print(">>> ")
   
 
+def checkarrays(name,tool,ptvals=None,etavals=None,tol=1e-9):
+  """Check that the array method getSFs gives the same result as the scalar method getSF."""
+  import numpy as np
+  ptvals  = ptvals or ptvals_
+  etavals = etavals or etavals_
+  etavals = [-eta for eta in reversed(etavals) if eta>0]+etavals # add negative values
+  pts     = np.array([pt for pt in ptvals for eta in etavals],dtype='float64')
+  etas    = np.array([eta for pt in ptvals for eta in etavals],dtype='float64')
+  sfs     = tool.getSFs(pts,etas)
+  nbad    = 0
+  for pt, eta, sf in zip(pts,etas,sfs):
+    sf0 = tool.getSF(pt,eta)
+    if abs(sf-sf0)>tol*max(1.,abs(sf0)):
+      nbad += 1
+      print(">>>   "+color("Mismatch for pt=%.2f, eta=%.2f: getSF=%.6g, getSFs=%.6g"%(pt,eta,sf0,sf),'red'))
+  assert nbad==0, "%s: Found %d/%d mismatches between getSF and getSFs!"%(name,nbad,len(pts))
+  print(">>>   %s: getSF and getSFs agree for %d points"%(name,len(pts)))
+  
+
+def checkevalgraph():
+  """Check evalgraph against TGraph::Eval, including graphs with one point and exact points."""
+  import numpy as np
+  from ROOT import TGraph
+  from array import array
+  from TauFW.PicoProducer.corrections.ScaleFactorTool import evalgraph, getgraphpoints
+  rng = np.random.default_rng(42)
+  for npoints in [1,2,3,10]:
+    xvals = np.sort(rng.uniform(10,200,npoints))
+    yvals = rng.uniform(0.5,1.0,npoints)
+    graph = TGraph(npoints,array('d',xvals),array('d',yvals))
+    xtest = np.concatenate([xvals,rng.uniform(0,300,20)]) # exact points, and inter-/extrapolation
+    yeval = evalgraph(*getgraphpoints(graph),xtest)
+    for x, y in zip(xtest,yeval):
+      assert abs(graph.Eval(x)-y)<1e-9, "evalgraph(%r)=%r != TGraph::Eval=%r for n=%d"%(x,y,graph.Eval(x),npoints)
+  print(">>>   evalgraph agrees with TGraph::Eval")
+  
+
 def muonPOG():
   LOG.header("muonPOG (ROOT)")
   
@@ -63,12 +100,14 @@ def muonPOG():
   sftool_trig = ScaleFactor(path+"MuonPOG/Run2017/EfficienciesAndSF_RunBtoF_Nov17Nov2017.root","IsoMu27_PtEtaBins/abseta_pt_ratio",'mu_trig',ptvseta=True)
   print(">>>   Initialized in %.1f seconds"%(time.time()-start1))
   printtable('trigger POG',sftool_trig.getSF)
+  checkarrays('trigger POG',sftool_trig)
   
   # ID (Muon POG)
   start1 = time.time()
   sftool_id  = ScaleFactor(path+"MuonPOG/Run2018/RunABCD_SF_ID.root","NUM_MediumID_DEN_genTracks_pt_abseta",'mu_id',ptvseta=False)
   print(">>>   Initialized in %.1f seconds"%(time.time()-start1))
   printtable('id POG',sftool_id.getSF)
+  checkarrays('id POG',sftool_id)
   
   # ISO (Muon POG)
   start1 = time.time()
@@ -93,6 +132,8 @@ def muonHTT():
   sftool_mu_trig_HTT = ScaleFactorHTT(pathHTT_mu+"Muon_IsoMu24orIsoMu27.root","ZMass",'mu_idiso')
   print(">>>   Initialized in %.1f seconds"%(time.time()-start1))
   printtable('trigger HTT',sftool_mu_trig_HTT.getSF)
+  checkarrays('trigger HTT',sftool_mu_trig_HTT)
+  checkevalgraph()
   
   ## ID ISO (HTT)
   #start1 = time.time()
@@ -113,6 +154,7 @@ def electronHTT():
   # ID/ISO (HTT)
   sftool_ele_idiso_HTT = ScaleFactorHTT(pathHTT_el+"Electron_IdIso_IsoLt0.15_IsoID_eff.root","ZMass",'ele_idiso')
   printtable('idiso HTT',sftool_ele_idiso_HTT.getSF)
+  checkarrays('idiso HTT',sftool_ele_idiso_HTT)
   
 
 def muonSFs_JSON(era='UL2018'):
@@ -193,6 +235,71 @@ def btagSFs(era='UL2018',tagger='DeepJet'):
   printtable('%s b'%tagger,lambda p,e: btagSFs.getSF(p,e,5,True),etamax=5)
   
 
+def btagTable(era='UL2018',tagger='DeepJet',npoints=5000,tol=1e-3):
+  """Compare b tag SFs from lookup tables (BTagSFTable) to BTagCalibrationReader on random jets."""
+  import numpy as np
+  LOG.header("btagTable")
+  start1 = time.time()
+  btag_reader = BTagWeightTool(tagger,wp='medium',era=era,channel='mutau',usetable=False)
+  btag_table  = BTagWeightTool(tagger,wp='medium',era=era,channel='mutau',usetable=True,cachedir="")
+  print(">>>   Initialized in %.1f seconds"%(time.time()-start1))
+  rng     = np.random.RandomState(42)
+  pts     = np.exp(rng.uniform(np.log(20.),np.log(1500.),npoints))
+  etas    = rng.uniform(-btag_table.maxeta,btag_table.maxeta,npoints)
+  flavors = rng.choice([0,1,2,3,4,5,21],npoints)
+  tagged  = np.ones(npoints,dtype=bool) # compare SFs, not efficiencies
+  start2  = time.time()
+  sfs_table = btag_table.getSFs(pts,etas,flavors,tagged)
+  time_table = time.time()-start2
+  start2  = time.time()
+  sfs_reader = btag_reader.getSFs(pts,etas,flavors,tagged)
+  time_reader = time.time()-start2
+  reldiff = np.abs(sfs_table-sfs_reader)/np.maximum(np.abs(sfs_reader),1e-6)
+  iworst  = int(np.argmax(reldiff))
+  print(">>>   Evaluated %d SFs in %.3f seconds with table, and %.3f seconds with reader"%(npoints,time_table,time_reader))
+  print(">>>   Largest relative difference %.3g for pt=%.2f, eta=%.3f, flavor=%d: table=%.6f, reader=%.6f"%(
+        reldiff[iworst],pts[iworst],etas[iworst],flavors[iworst],sfs_table[iworst],sfs_reader[iworst]))
+  assert reldiff[iworst]<=tol, "BTagSFTable differs from reader by %.3g > %.3g!"%(reldiff[iworst],tol)
+  
+  # EVENT WEIGHTS, as used by the columnar module
+  counts  = rng.poisson(2.,npoints)
+  njets   = int(counts.sum())
+  pts     = np.exp(rng.uniform(np.log(20.),np.log(1500.),njets))
+  etas    = rng.uniform(-3.,3.,njets) # include jets outside acceptance
+  flavors = rng.choice([0,1,2,3,4,5,21],njets)
+  tagged  = rng.uniform(0,1,njets)<0.3
+  wgts_table  = btag_table.getWeights(pts,etas,flavors,tagged,counts)
+  wgts_reader = btag_reader.getWeights(pts,etas,flavors,tagged,counts)
+  reldiff = np.abs(wgts_table-wgts_reader)/np.maximum(np.abs(wgts_reader),1e-6)
+  print(">>>   Largest relative difference of %d event weights: %.3g"%(len(counts),reldiff.max()))
+  assert reldiff.max()<=10*tol, "Event weights with BTagSFTable differ from reader by %.3g > %.3g!"%(reldiff.max(),10*tol)
+  
+
+def btagModule(era='UL2018',tagger='DeepJet'):
+  """Check that the module option -E btagtable=True reaches BTagWeightTool via ModuleTauPair,
+  for both the standard and the columnar mutau module."""
+  import os
+  from TauFW.PicoProducer.analysis.utils import getyear, convertstr
+  from TauFW.PicoProducer.analysis.ModuleMuTau import ModuleMuTau
+  LOG.header("btagModule")
+  modules = [ModuleMuTau]
+  try:
+    from TauFW.PicoProducer.analysis.ModuleMuTauColumnar import ModuleMuTauColumnar
+    modules.append(ModuleMuTauColumnar)
+  except ImportError as err:
+    print(">>>   Skipping columnar module: %s"%(err))
+  fname = "btagModule_test.root"
+  for module_ in modules:
+    for opt in ['False','True']: # as passed via -E btagtable=...
+      module = module_(fname,era=era,year=getyear(era),dtype='mc',btagtable=convertstr(opt))
+      usetable = module.btagTool.sftable!=None
+      print(">>>   %s(btagtable=%s): usetable=%s"%(module_.__name__,opt,usetable))
+      assert usetable==convertstr(opt), "%s: Option btagtable=%s did not reach BTagWeightTool!"%(module_.__name__,opt)
+      module.out.outfile.Close()
+  if os.path.isfile(fname):
+    os.remove(fname)
+  
+
 def pileupSFs(era='UL2018'):
   LOG.header("pileupSFs")
   
@@ -240,6 +347,8 @@ def main(args):
   if not tools or 'btag' in tools:
     for era in eras:
       btagSFs(era=era,tagger='DeepJet')
+      btagTable(era=era,tagger='DeepJet')
+      btagModule(era=era,tagger='DeepJet')
   
   # PU
   if not tools or 'pu' in tools:
@@ -11,7 +11,9 @@ from TauFW.Plotter.sample.SampleSet import LOG, SampleSet, Variable, deletehist,
 
 def QCD_OSSS(self, variables, selections, **kwargs):
   """Substract MC from data with same sign (SS) selection of a lepton - tau pair
-     and return a histogram of the difference."""
+     and return a histogram of the difference.
+     If a ResultScheduler is passed, the SS histograms are booked in the same event loop
+     as the OS histograms, and a ScheduledResult is returned."""
   verbosity      = LOG.getverbosity(kwargs)
   if verbosity>=2:
     LOG.header("Estimating QCD for variables %s"%(', '.join(v.filename for v in variables)))
@@ -27,6 +29,7 @@ def QCD_OSSS(self, variables, selections, **kwargs):
   shift         = kwargs.get('shift',           0.0            ) #+ self.shiftQCD # for systematics
   parallel      = kwargs.get('parallel',        False          )
   negthres      = kwargs.get('negthres',        0.25           ) # threshold for warning about negative QCD bins
+  scheduler     = kwargs.get('scheduler',       None           ) # ResultScheduler to book SS histograms in the same event loop
   
   # INVERT OS -> SS CHARGE SELECTIONS
   scale_dict = { }
@@ -40,19 +43,25 @@ def QCD_OSSS(self, variables, selections, **kwargs):
     selections_SS.append(selection_SS)
     
     # OS/SS RATIO (SS -> OS extrapolation scale)
+    scale_ = scale # reset for each selection
     if "q_1*q_2>0" in selection_OS.selection.replace(' ',''):
-      scale = 1.0 # already SS: no extra scale
-    elif not scale:
-      scale = 2.0 if "emu" in self.channel else 1.10
-    scale_dict[selection_OS] = scale
+      scale_ = 1.0 # already SS: no extra scale
+    elif not scale_:
+      scale_ = 2.0 if "emu" in self.channel else 1.10
+    scale_dict[selection_OS] = scale_
     LOG.verbose("SampleSet.QCD_OSSS: scale=%s, shift=%s, OS=%r -> SS=%r"%(
-      scale,shift,selection_OS.selection,selection_SS.selection),verbosity,level=2)
+      scale_,shift,selection_OS.selection,selection_SS.selection),verbosity,level=2)
   
   # GET SS HISTOGRAMS
   hists = self.gethists(variables,selections_SS,weight=weight,dataweight=dataweight,replaceweight=replaceweight,tag=tag,
-                        signal=False,split=False,blind=False,task="Estimating QCD: ",verbosity=verbosity-1)
+                        signal=False,split=False,blind=False,task="Estimating QCD: ",scheduler=scheduler,verbosity=verbosity-1)
+  if scheduler!=None: # subtract after running the event loop
+    return hists.addcallback(lambda h: getqcdhists(h,scale_dict,name,title,tag,shift,negthres,parallel,verbosity)) # ScheduledResult
+  return getqcdhists(hists,scale_dict,name,title,tag,shift,negthres,parallel,verbosity)
   
-  # CREATE QCD HISTS
+
+def getqcdhists(hists,scale_dict,name,title,tag="",shift=0.0,negthres=0.25,parallel=False,verbosity=0):
+  """Help function to create QCD histograms from filled SS histograms: QCD = scale * (data - MC)."""
   qcdhists = { } #HistDict()
   for selection_SS in hists:
     selection_OS = selection_SS.OS
@@ -63,8 +72,8 @@ def QCD_OSSS(self, variables, selections, **kwargs):
       
       # CHECK data
       if not datahist:
-        LOG.warning("SampleSet.QCD: No data to make DATA driven QCD!")
-        return None
+        LOG.warning("SampleSet.QCD: No data to make DATA driven QCD for %r!"%(selection_OS.selection))
+        continue # skip this selection/variable
       
       # QCD HIST = DATA - MC
       exphist = exphists[0].Clone('MC_SS')
@@ -92,15 +101,15 @@ def QCD_OSSS(self, variables, selections, **kwargs):
         LOG.warning("SampleSet.QCD_OSSS: %r has %d/%d>%.1f%% negative bins! Set to 0 +- 1."%(variable.name,nneg,nbins,100.0*negthres),pre="  ")
       
       # SCALE SS -> OS
-      scale = scale_dict[selection_OS]*(1.0+shift) # OS/SS scale & systematic variation
-      qcdhist.Scale(scale) # scale SS -> OS
+      scale_ = scale_dict[selection_OS]*(1.0+shift) # OS/SS scale & systematic variation
+      qcdhist.Scale(scale_) # scale SS -> OS
       
       # YIELDS
       if verbosity>=2:
         nexp  = exphist.Integral()
         ndata = datahist.Integral()
         nqcd  = qcdhist.Integral()
-        LOG.verbose("SampleSet.QCD_OSSS: SS yields: data=%.1f, exp=%.1f, qcd=%.1f, scale=%.3f"%(ndata,nexp,nqcd,scale),verbosity,level=2)
+        LOG.verbose("SampleSet.QCD_OSSS: SS yields: data=%.1f, exp=%.1f, qcd=%.1f, scale=%.3f"%(ndata,nexp,nqcd,scale_),verbosity,level=2)
       
       # CLEAN
       if not parallel: # avoid segmentation faults for parallel
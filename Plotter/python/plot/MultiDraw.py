@@ -5,6 +5,7 @@
 # Source: https://github.com/pwaller/minty/blob/master/minty/junk/MultiDraw.py
 from __future__ import print_function # for python3 compatibility
 import os, re, traceback
+from TauFW.common.tools.lazy import once
 from ROOT import gROOT, gSystem, gDirectory, TObject, TTree, TObjArray, TTreeFormula,\
                  TH1D, TH2D, TH2, SetOwnership, TTreeFormulaManager #, TNamed
 moddir   = os.path.dirname(os.path.realpath(__file__))
@@ -24,19 +25,23 @@ def error(string): # raise RuntimeError in red color
 def compileMultiDraw():
   print(">>> Compiling %s"%(macro))
   gROOT.ProcessLine(".L %s+O"%macro)
-try:
-  if os.path.exists(macrolib): # already compiled as library
-    try:
-      gSystem.Load(macrolib) # faster than compiling each time
-    except: # loading library failed => compile
-      compileMultiDraw()
-  else: # no library found => compile
-      compileMultiDraw()
-  from ROOT import MultiDraw as _MultiDraw
-  from ROOT import MultiDraw2D as _MultiDraw2D
-except:
-  print(traceback.format_exc())
-  raise error('MultiDraw.py: Failed to import the MultiDraw macro "%s"'%macro)
+@once
+def loadMultiDraw():
+  """Load (or compile) the MultiDraw macro on first use instead of at import."""
+  try:
+    if os.path.exists(macrolib): # already compiled as library
+      try:
+        gSystem.Load(macrolib) # faster than compiling each time
+      except: # loading library failed => compile
+        compileMultiDraw()
+    else: # no library found => compile
+        compileMultiDraw()
+    from ROOT import MultiDraw as _MultiDraw
+    from ROOT import MultiDraw2D as _MultiDraw2D
+  except:
+    print(traceback.format_exc())
+    raise error('MultiDraw.py: Failed to import the MultiDraw macro "%s"'%macro)
+  return _MultiDraw, _MultiDraw2D
   
 def makeTObjArray(theList):
   """Turn a python iterable into a ROOT TObjArray"""
@@ -215,8 +220,10 @@ def MultiDraw(self, varexps, selection='1', drawoption="", **kwargs):
       print(">>> MultiDraw: xformulae=%s, yformulae=%s, ndata=%s, varlen=%r"%([x.GetTitle() for x in xformulae],[y.GetTitle() for y in yformulae],ndata,varlen))
       print(">>> MultiDraw: weights=%s, results=%s"%([w.GetTitle() for w in weights],results))
     if len(yformulae)==0: # 1D histograms
+      _MultiDraw, _ = loadMultiDraw()
       _MultiDraw(self,commonFormula,makeTObjArray(xformulae),makeTObjArray(weights),makeTObjArray(results),len(xformulae),verbosity)
     elif len(xformulae)==len(yformulae): # 2D histograms
+      _, _MultiDraw2D = loadMultiDraw()
       _MultiDraw2D(self,commonFormula,makeTObjArray(xformulae),makeTObjArray(yformulae),makeTObjArray(weights),makeTObjArray(results),len(xformulae),verbosity)
     else:
       raise error("MultiDraw: Given a mix of arguments for 1D (%d) and 2D (%d) histograms!"%(len(xformulae),len(yformulae)))
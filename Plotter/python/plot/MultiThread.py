@@ -5,7 +5,15 @@
 from __future__ import print_function # for python3 compatibility
 #from threading import Thread as _Thread
 from multiprocessing import Process, Pipe, Manager
-manager = Manager()
+_manager = None # shared Manager, only started on first use
+
+
+def getmanager():
+  """Return shared multiprocessing Manager. Its server process is only started on first use."""
+  global _manager
+  if _manager==None:
+    _manager = Manager()
+  return _manager
 
 
 class Thread(Process):
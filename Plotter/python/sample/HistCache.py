@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Author: Izaak Neutelings (November 2023)
+# Description: Persistent on-disk cache of filled histograms, to skip the RDataFrame event loop
+#              if the input file, selection, variable, binning, and weight did not change.
+import os, glob, hashlib
+from TauFW.common.tools.file import ensuredir
+from TauFW.common.tools.root import ensureTFile
+from TauFW.Plotter.sample.utils import LOG
+from ROOT import TH1
+
+_histcaches = { } # global HistCache instances: { cachedir: HistCache }
+
+
+class HistCache(object):
+  """Content-addressed cache of filled histograms, stored as one small ROOT file per histogram:
+    cache = HistCache("~/.cache/TauFW/hists",maxsize=2000) # in units of MB
+    key   = cache.getkey(sample.filename,sample.treename,cuts,xvar,weight)
+    hist  = cache.get(key) # returns None if not cached
+    if hist==None:
+      hist = rdframe.Histo1D(...).GetValue()
+      cache.put(key,hist)
+  The key is a hash of all inputs that affect the content of the histogram,
+  including the size and modification time of the input file,
+  so the cache is automatically invalidated if the input file is reproduced.
+  The oldest (least recently used) entries are removed when storing a histogram
+  makes the total size exceed maxsize. The total size is counted while storing,
+  so the cache directory is only scanned once, and again when evicting.
+  Remote files (e.g. root://) are not cached.
+  """
+  version = 1 # increase to invalidate old cache entries after changing the key or storage format
+
+  def __init__(self, cachedir=None, maxsize=1000, verb=0):
+    if cachedir==None:
+      cachedir = os.environ.get('TAUFW_HISTCACHE',"~/.cache/TauFW/hists")
+    self.cachedir = os.path.abspath(os.path.expanduser(os.path.expandvars(cachedir)))
+    self.maxsize  = maxsize # maximum total size in units of MB
+    self.verbosity = verb
+    self.nhits    = 0
+    self.nmiss    = 0
+    self.nbytes   = None # running total size of cache in bytes, counted on first put
+
+  def __repr__(self):
+    return "<%s(%r,maxsize=%sMB) at %s>"%(self.__class__.__name__,self.cachedir,self.maxsize,hex(id(self)))
+
+  def getkey(self,filename,*args):
+    """Return hash of all inputs. Return None if the file cannot be cached.
+    The filename can also be a list of (filename,scale) pairs for chained files."""
+    if isinstance(filename,list): # chain of files
+      keys = (self.version,)
+      for fname, scale in filename:
+        if ':' in fname or not os.path.isfile(fname):
+          return None
+        stat  = os.stat(fname)
+        keys += (os.path.abspath(fname),stat.st_size,stat.st_mtime,scale)
+      keys += args
+    elif ':' in filename or not os.path.isfile(filename): # remote file (e.g. root://), or glob pattern
+      return None
+    else:
+      stat = os.stat(filename)
+      keys = (self.version,os.path.abspath(filename),stat.st_size,stat.st_mtime)+args
+    return hashlib.sha1(repr(keys).encode('utf-8')).hexdigest()
+
+  def getpath(self,key):
+    """Return path of cached ROOT file."""
+    return os.path.join(self.cachedir,key[:2],key+".root")
+
+  def get(self,key,name=None,title=None):
+    """Return copy of cached histogram, or None if not cached."""
+    if key==None:
+      return None
+    path = self.getpath(key)
+    if not os.path.isfile(path):
+      self.nmiss += 1
+      return None
+    file = ensureTFile(path,'READ')
+    hist = file.Get('hist')
+    if not hist: # corrupt file, e.g. from an interrupted write
+      file.Close()
+      LOG.warn("HistCache.get: Could not read histogram from %s! Removing..."%(path))
+      os.remove(path)
+      self.nmiss += 1
+      return None
+    hist.SetDirectory(0)
+    file.Close()
+    if name!=None:
+      hist.SetName(name)
+    if title!=None:
+      hist.SetTitle(title)
+    os.utime(path,None) # mark as recently used for LRU eviction
+    self.nhits += 1
+    LOG.verb("HistCache.get: Retrieved %r from %s"%(hist.GetName(),path),self.verbosity,2)
+    return hist
+
+  def put(self,key,hist):
+    """Store copy of histogram in cache."""
+    if key==None or not isinstance(hist,TH1):
+      return None
+    path = self.getpath(key)
+    ensuredir(os.path.dirname(path))
+    tmppath = "%s.%s.tmp"%(path,os.getpid()) # write to temporary file first to avoid corrupt entries
+    file = ensureTFile(tmppath,'RECREATE')
+    hist.Write('hist')
+    file.Close()
+    os.replace(tmppath,path)
+    LOG.verb("HistCache.put: Stored %r in %s"%(hist.GetName(),path),self.verbosity,2)
+    if self.nbytes==None: # scan cache directory only once
+      self.nbytes = sum(e[1] for e in self.entries())
+    else:
+      self.nbytes += os.path.getsize(path)
+    if self.nbytes>self.maxsize*1024**2: # remove least recently used entries
+      self.evict()
+    return path
+
+  def entries(self):
+    """Return list of (mtime,size,path) of all cached files, sorted from oldest to newest."""
+    entries = [ ]
+    for path in glob.glob(os.path.join(self.cachedir,"??","*.root")):
+      try:
+        stat = os.stat(path)
+      except OSError: # removed by other process
+        continue
+      entries.append((stat.st_mtime,stat.st_size,path))
+    return sorted(entries)
+
+  def size(self):
+    """Return total size of cache in units of MB."""
+    return sum(e[1] for e in self.entries())/1024.**2
+
+  def evict(self,maxsize=None):
+    """Remove least recently used entries until the total size is below maxsize (in MB)."""
+    maxsize  = self.maxsize if maxsize==None else maxsize
+    entries  = self.entries()
+    maxbytes = maxsize*1024**2
+    totsize  = sum(e[1] for e in entries)
+    for mtime, size, path in entries: # oldest first
+      if totsize<=maxbytes: break
+      LOG.verb("HistCache.evict: Removing %s..."%(path),self.verbosity,3)
+      try:
+        os.remove(path)
+      except OSError: # removed by other process
+        pass
+      totsize -= size
+    self.nbytes = totsize
+    return totsize
+
+  def clear(self):
+    """Remove all entries."""
+    return self.evict(maxsize=0)
+
+
+class CachedResult():
+  """Wrap histogram retrieved from HistCache to behave like RDF.RResultPtr<T>.
+  It is skipped by ResultDict.run, so no event loop is needed."""
+
+  def __init__(self,hist):
+    self.hist = hist
+
+  def __repr__(self):
+    return "<CachedResult(%r)>"%(self.hist)
+
+  def __iter__(self):
+    """Yield nothing, as there is nothing to run by ResultDict.run -> RDF.RunGraphs."""
+    return iter(( ))
+
+  def GetValue(self):
+    return self.hist
+
+
+class CachingResult():
+  """Wrap RDF.RResultPtr<T> to store its value in the HistCache
+  after the event loop has run."""
+
+  def __init__(self,result,cache,key):
+    self.result = result # RDF.RResultPtr<T>
+    self.cache  = cache # HistCache
+    self.key    = key
+    self.stored = False
+
+  def __repr__(self):
+    return "<CachingResult(%r)>"%(self.result)
+
+  def __iter__(self):
+    """Yield result for ResultDict.run -> RDF.RunGraphs."""
+    yield self.result
+
+  def GetValue(self):
+    value = self.result.GetValue() # NOTE: This triggers event loop if not run before !
+    if not self.stored:
+      self.cache.put(self.key,value)
+      self.stored = True
+    return value
+
+
+def gethistcache(cache=True,**kwargs):
+  """Help function to get HistCache instance from a flag, directory, or HistCache instance."""
+  if not cache:
+    return None
+  elif isinstance(cache,HistCache):
+    return cache
+  cachedir = cache if isinstance(cache,str) else None
+  if cachedir not in _histcaches:
+    _histcaches[cachedir] = HistCache(cachedir,**kwargs)
+  return _histcaches[cachedir]
+
@@ -19,6 +19,7 @@ class HistSet(object):
     self.sig  = sig or [ ] # list of signal TH1D histograms (for new physics searches), to be overlaid
     self.var  = var  # Variable object
     self.sel  = sel  # Selection object for changing variable context
+    self.variations = { } # systematic variations: { 'name:tag': HistSet }
     if isinstance(data,dict): # data = { sample: hist } dictionary
       self.data = None
       for sample, hist in data.items():
@@ -38,10 +39,33 @@ class HistSet(object):
     for hist in self.sig:
       yield hist
   
+  def add(self, sample, hist):
+    """Add histogram of given sample to the right list."""
+    if sample.isdata: # observed data
+      self.data = hist
+    elif sample.issignal: # signal
+      self.sig.append(hist)
+    else: # exp (background)
+      self.exp.append(hist)
+    return hist
+  
+  def insert(self, idx, hist):
+    """Insert histogram in list of background histograms. If index is negative: count from end of list."""
+    idx_ = idx if idx>=0 else len(self.exp)+1+idx
+    self.exp.insert(idx_,hist)
+    return hist
+  
   def all(self):
     """Return list of all histgrams."""
     return list(iter(self))
   
+  def free(self):
+    """Remove references to all histograms (incl. variations) to free memory."""
+    self.data = None
+    self.exp  = [ ]
+    self.sig  = [ ]
+    self.variations = { }
+  
   def display(self):
     """Print tables of histogram yields (for debugging)."""
     TAB = LOG.table("%13.2f %13d %13.3f   %r")
@@ -84,6 +108,50 @@ class HistSet(object):
     return stack # return THStack object
   
 
+class LazyHistSet(HistSet):
+  """HistSet that only retrieves, merges & styles its histograms on first access of
+  data, exp, sig or variations, by calling a given function loader(histset).
+  Use HistSet.free after processing the histograms (e.g. writing them to file),
+  so only the histograms of one HistSet are kept in memory at the same time."""
+  
+  def __init__(self, loader, var=None, sel=None):
+    self.var      = var  # Variable object
+    self.sel      = sel  # Selection object for changing variable context
+    self._loader  = loader # function to fill this HistSet
+    self._inserts = [ ] # histograms to be inserted after loading
+  
+  def __getattr__(self, attr):
+    """Load histograms on first access."""
+    if attr in ['data','exp','sig','variations'] and '_loader' in self.__dict__:
+      self.load()
+      return getattr(self,attr)
+    raise AttributeError("%r object has no attribute %r"%(self.__class__.__name__,attr))
+  
+  def load(self):
+    """Retrieve histograms with loader function."""
+    loader = self.__dict__.pop('_loader',None)
+    if loader!=None:
+      HistSet.__init__(self,var=self.var,sel=self.sel)
+      loader(self)
+      for idx, hist in self._inserts:
+        HistSet.insert(self,idx,hist)
+      self._inserts = [ ]
+    return self
+  
+  def insert(self, idx, hist):
+    """Insert histogram in list of background histograms after loading."""
+    if '_loader' in self.__dict__: # not loaded yet
+      self._inserts.append((idx,hist))
+      return hist
+    return HistSet.insert(self,idx,hist)
+  
+  def free(self):
+    """Remove references to all histograms, and do not load them anymore."""
+    self.__dict__.pop('_loader',None)
+    self._inserts = [ ]
+    return HistSet.free(self)
+  
+
 class HistDict(object):
   """Container class for nested dictionaries of HistSets.
   HistDict is basically a set of nested dictionaries plus some helper functions:
@@ -159,9 +227,8 @@ class HistDict(object):
         assert variable in self._dict[selection], "HistDict.insert: Unrecognized variable %r for selection%r... hist_dict=%r, self._dict=%r"%(
           variable,selection,hist_dict,self._dict)
         hist = hist_dict[selection][variable] # TH1D histogram
-        idx_ = idx if idx>=0 else len(self._dict[selection][variable].exp)+1+idx # if index negative: count from end of list
-        LOG.verb("HistDict.insert: Inserting=%r at index %r (%r)"%(hist,idx_,idx),verb,2)
-        self._dict[selection][variable].exp.insert(idx_,hist)
+        LOG.verb("HistDict.insert: Inserting=%r at index %r"%(hist,idx),verb,2)
+        self._dict[selection][variable].insert(idx,hist) # if index negative: count from end of list
   
   def results(self,singlevar=False,singlesel=False,popvar=None):
     """Return simple nested dictionaries. { selection: { variable: HistSet } }
@@ -141,13 +141,17 @@ class MergedSample(Sample):
     return cfhist
   
   def getrdframe(self,variables,selections,**kwargs):
-    """Create RDataFrames for list of variables and selections."""
+    """Create RDataFrames for list of variables and selections.
+    If chain=True, subsamples with the same tree, cuts, weights & aliases (e.g. stitched DY or W+jets samples)
+    are read by one RDataFrame over all their files, with the normalization applied per file,
+    instead of one RDataFrame per subsample."""
     verbosity = LOG.getverbosity(kwargs)
     name      = kwargs.get('name',   self.name ) # hist name
     name     += kwargs.get('tag',    ""        ) # tag for hist name
     scales    = kwargs.get('scales', None      ) # list of scale factors, one for each subsample
     split     = kwargs.get('split',  False     ) and len(self.splitsamples)>=1 # split sample into components (e.g. with cuts on genmatch)
     scale     = kwargs.get('scale', 1.0) * self.scale * self.norm # common scale to pass down
+    chain     = kwargs.get('chain',  False     ) and not split # chain files of similar subsamples into one RDataFrame
     
     # PREPARE SETTING for subsamples
     hkwargs = kwargs.copy()
@@ -158,6 +162,7 @@ class MergedSample(Sample):
     hkwargs['scale']    = scale # pass common scale down
     hkwargs['weight']   = joinweights(kwargs.get('weight', ""),self.weight) # pass weight down
     hkwargs['rdf_dict'] = kwargs.get('rdf_dict', { } ) # optimization & debugging: reuse RDF for the same filename / selection in all subsamples
+    hkwargs.pop('chain',None) # only chain subsamples of this MergedSample
     LOG.verb("MergedSample.getrdframe: Creating RDataFrame for %s ('%s'), cuts=%r, weight=%r, scale=%r, nsamples=%r, split=%r"%(
              color(name,'grey',b=True),color(self.title,'grey',b=True),
              hkwargs['cuts'],hkwargs['weight'],hkwargs['scale'],len(self.samples),split),verbosity,1)
@@ -165,13 +170,26 @@ class MergedSample(Sample):
     # CREATE RDataFrames per SUBSAMPLE
     res_dict = ResultDict() # { selection : { variable: { subsample: hist } } } }
     samples  = self.splitsamples if split else self.samples
+    groups   = [ ] # groups of subsamples to chain
     for i, subsample in enumerate(samples):
-      if 'name' in kwargs: # prevent memory leaks (confusing of histograms)
-        hkwargs['name'] = makehistname(kwargs['name'],subsample.name)
       if scales: # apply extra scale factor per subsample
-        hkwargs['scale'] = scale*scales[i] # assume scales is a length with the samen length as samples
         LOG.verb("MergedSample.getrdframe: Scaling subsample %r by %s (total %s)"%(subsample.name,scales[i],scale),verbosity,1)
-      res_dict += subsample.getrdframe(variables,selections,**hkwargs)
+      groups.append([(subsample,scales[i] if scales else 1.0)])
+    if chain:
+      groups = groupchains(groups,verb=verbosity)
+    for group in groups:
+      subsample, sscale = group[0]
+      if 'name' in kwargs: # prevent memory leaks (confusing of histograms)
+        hkwargs['name'] = makehistname(kwargs['name'],subsample.name)
+      if len(group)>=2: # chain files; normalization per file
+        hkwargs['scale'] = scale
+        norm = kwargs.get('norm',True)
+        hkwargs['chain'] = [(s,f*s.scale*(s.norm if norm else 1.0)) for s, f in group]
+        res_dict += subsample.getrdframe(variables,selections,**hkwargs)
+        hkwargs.pop('chain')
+      else:
+        hkwargs['scale'] = scale*sscale # assume scales is a length with the samen length as samples
+        res_dict += subsample.getrdframe(variables,selections,**hkwargs)
     if not split: # merge RDF.RResultPtr<T> into MergedResults list so they can be added coherently later
       hname = name if 'name' in kwargs else "$VAR_"+name # histogram name
       res_dict.merge(self,name=hname,title=self.title,verb=verbosity) # { selection : { variable: { self: hist } } } }
@@ -179,6 +197,23 @@ class MergedSample(Sample):
     return res_dict
   
 
+def groupchains(groups,verb=0):
+  """Help function to join groups of (Sample,scale) pairs with the same tree, cuts, weights & aliases,
+  which can be chained into one RDataFrame. MergedSamples are never chained."""
+  chains = { } # { key: [(sample,scale),...] }
+  for group in groups:
+    sample = group[0][0]
+    if isinstance(sample,MergedSample) or sample.isdata:
+      key = id(sample) # do not chain
+    else:
+      key = (sample.treename,sample.cuts,sample.weight,sample.extraweight,tuple(sorted(sample.aliases.items())))
+    chains.setdefault(key,[ ]).extend(group)
+  for chain in chains.values():
+    if len(chain)>=2:
+      LOG.verb("groupchains: Chaining %s"%(', '.join(repr(s.name) for s, _ in chain)),verb,1)
+  return list(chains.values())
+  
+
 def unpack_MergedSamples_args(*args,**kwargs):
   """
   Help function to unpack arguments for MergedSamples initialization:
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+# Author: Izaak Neutelings (November 2023)
+# Description: Columnar backend with NumPy & uproot as alternative to RDataFrame,
+#              to avoid JIT-compiling selections, weights and variables for short interactive plots.
+# Usage: Use backend='numpy' in Sample.getrdframe or SampleSet.gethists, e.g.
+#   hists = sampleset.gethists(variables,selections,backend='numpy')
+import re
+from array import array
+from TauFW.Plotter.sample.utils import LOG
+from ROOT import TH1D, TH2D
+try:
+  import numpy as np
+  import uproot
+except ImportError:
+  np = uproot = None
+
+
+###############################
+#   C++ -> NumPy TRANSLATOR   #
+###############################
+
+_tokenexp = re.compile(r"""\s*(?:
+  (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[fFlLuU]*) |
+  (?P<id>[A-Za-z_]\w*(?:\s*::\s*[A-Za-z_]\w*)*) |
+  (?P<op>\|\||&&|==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^?:(),\[\]])
+)""",re.VERBOSE)
+_binops = [ # C++ binary operators from lowest to highest precedence
+  ['||'], ['&&'], ['|'], ['^'], ['&'], ['==','!='], ['<','<=','>','>='], ['<<','>>'], ['+','-'], ['*','/','%'],
+]
+_casts = { # C++ types for casting
+  'int': 'int', 'Int_t': 'int', 'long': 'int', 'Long64_t': 'int', 'short': 'int', 'unsigned': 'int', 'UInt_t': 'int',
+  'float': 'float', 'Float_t': 'float', 'double': 'float', 'Double_t': 'float', 'bool': 'bool', 'Bool_t': 'bool',
+}
+_funcs = { } # C++ function name -> NumPy function, filled below
+_exprcache = { } # cache of translated & compiled expressions: { expr: (code, columns) }
+
+
+def tokenize(expr):
+  """Split C++ expression into list of (type,token) tuples."""
+  tokens = [ ]
+  pos = 0
+  expr = expr.rstrip()
+  while pos<len(expr):
+    match = _tokenexp.match(expr,pos)
+    if not match or match.end()==pos:
+      raise SyntaxError("tokenize: Could not parse %r at position %d: %r"%(expr,pos,expr[pos:pos+10]))
+    pos = match.end()
+    for ttype in ['num','id','op']:
+      if match.group(ttype)!=None:
+        token = match.group(ttype)
+        if ttype=='id':
+          token = re.sub(r"\s*::\s*","::",token)
+        tokens.append((ttype,token))
+        break
+  return tokens
+
+
+class ExprTranslator(object):
+  """Recursive-descent parser to translate a C++ expression (as used in RDataFrame's
+  Filter and Define) to an equivalent vectorized NumPy expression, e.g.
+    "pt_1>20 && abs(eta_1)<2.1 ? 1.0 : 0.5"
+  becomes
+    "where(logical_and((_col['pt_1']>20),(_f['abs'](_col['eta_1'])<2.1)),1.0,0.5)"
+  Every subexpression is put in parentheses to ensure C++ operator precedence.
+  NOTE: Division is always floating-point, unlike C++ integer division."""
+
+  def __init__(self, expr):
+    self.expr    = expr
+    self.tokens  = tokenize(expr)
+    self.pos     = 0
+    self.columns = [ ] # list of column names used in the expression
+
+  def peek(self):
+    return self.tokens[self.pos] if self.pos<len(self.tokens) else (None,None)
+
+  def next(self):
+    token = self.peek()
+    self.pos += 1
+    return token
+
+  def expect(self,op):
+    ttype, token = self.next()
+    if token!=op:
+      raise SyntaxError("ExprTranslator: Expected %r in %r, got %r"%(op,self.expr,token))
+
+  def translate(self):
+    """Return translated expression."""
+    pyexpr = self.ternary()
+    if self.pos<len(self.tokens):
+      raise SyntaxError("ExprTranslator: Could not parse %r after %r"%(self.expr,self.tokens[self.pos][1]))
+    return pyexpr
+
+  def ternary(self):
+    cond = self.binary(0)
+    if self.peek()[1]=='?':
+      self.next()
+      val1 = self.ternary()
+      self.expect(':')
+      val2 = self.ternary()
+      return "where(%s,%s,%s)"%(cond,val1,val2)
+    return cond
+
+  def binary(self,level):
+    if level>=len(_binops):
+      return self.unary()
+    left = self.binary(level+1)
+    while self.peek()[0]=='op' and self.peek()[1] in _binops[level]:
+      op = self.next()[1]
+      right = self.binary(level+1)
+      if op=='||':
+        left = "logical_or(%s,%s)"%(left,right)
+      elif op=='&&':
+        left = "logical_and(%s,%s)"%(left,right)
+      else:
+        left = "(%s%s%s)"%(left,op,right)
+    return left
+
+  def unary(self):
+    ttype, token = self.peek()
+    if token=='!':
+      self.next()
+      return "logical_not(%s)"%(self.unary())
+    elif token in ['-','+','~']:
+      self.next()
+      return "(%s%s)"%(token,self.unary())
+    elif token=='(' and self.pos+2<len(self.tokens) and self.tokens[self.pos+1][1] in _casts and self.tokens[self.pos+2][1]==')':
+      ctype = _casts[self.tokens[self.pos+1][1]]
+      self.pos += 3
+      return "_f[%r](%s)"%('('+ctype+')',self.unary())
+    return self.primary()
+
+  def primary(self):
+    ttype, token = self.next()
+    if ttype=='num':
+      return token.rstrip('fFlLuU') or '0'
+    elif ttype=='id':
+      if token in ['true','false']:
+        return token.capitalize()
+      if self.peek()[1]=='(': # function call
+        self.next()
+        if token not in _funcs:
+          raise NotImplementedError("ExprTranslator: Function %r in %r is not supported!"%(token,self.expr))
+        args = [ ]
+        if self.peek()[1]!=')':
+          args.append(self.ternary())
+          while self.peek()[1]==',':
+            self.next()
+            args.append(self.ternary())
+        self.expect(')')
+        return "_f[%r](%s)"%(token,','.join(args))
+      if self.peek()[1]=='[':
+        raise NotImplementedError("ExprTranslator: Indexing arrays in %r is not supported!"%(self.expr))
+      if '::' in token:
+        raise NotImplementedError("ExprTranslator: Identifier %r in %r is not supported!"%(token,self.expr))
+      if token not in self.columns:
+        self.columns.append(token)
+      return "_col[%r]"%(token)
+    elif token=='(':
+      inner = self.ternary()
+      self.expect(')')
+      return "(%s)"%(inner)
+    raise SyntaxError("ExprTranslator: Unexpected token %r in %r"%(token,self.expr))
+
+
+def translate(expr):
+  """Translate C++ expression to NumPy expression.
+  Return NumPy expression and list of column names."""
+  translator = ExprTranslator(expr)
+  return translator.translate(), translator.columns
+
+
+def compileexpr(expr):
+  """Translate and compile C++ expression. Return code object and list of column names."""
+  expr = str(expr)
+  if expr not in _exprcache:
+    pyexpr, columns = translate(expr)
+    _exprcache[expr] = (compile(pyexpr,"<%s>"%(expr),'eval'), columns)
+  return _exprcache[expr]
+
+
+def getcolumns(expr):
+  """Return list of column names used in C++ expression."""
+  return compileexpr(expr)[1]
+
+
+if np!=None:
+  def _dmmap(dm):
+    return np.select([dm==0,(dm==1)|(dm==2),dm==10,dm==11],[0,1,2,3],4).astype(np.float32)
+  for _names, _func in [
+      (['abs','fabs','std::abs','std::fabs','TMath::Abs'],         np.abs),
+      (['sqrt','std::sqrt','TMath::Sqrt'],                         np.sqrt),
+      (['pow','std::pow','TMath::Power'],                          np.power),
+      (['exp','std::exp','TMath::Exp'],                            np.exp),
+      (['log','std::log','TMath::Log'],                            np.log),
+      (['log10','std::log10','TMath::Log10'],                      np.log10),
+      (['cos','std::cos','TMath::Cos'],                            np.cos),
+      (['sin','std::sin','TMath::Sin'],                            np.sin),
+      (['tan','std::tan','TMath::Tan'],                            np.tan),
+      (['acos','std::acos','TMath::ACos'],                         np.arccos),
+      (['asin','std::asin','TMath::ASin'],                         np.arcsin),
+      (['atan','std::atan','TMath::ATan'],                         np.arctan),
+      (['atan2','std::atan2','TMath::ATan2'],                      np.arctan2),
+      (['cosh','std::cosh','TMath::CosH'],                         np.cosh),
+      (['sinh','std::sinh','TMath::SinH'],                         np.sinh),
+      (['tanh','std::tanh','TMath::TanH'],                         np.tanh),
+      (['floor','std::floor','TMath::Floor'],                      np.floor),
+      (['ceil','std::ceil','TMath::Ceil'],                         np.ceil),
+      (['min','std::min','TMath::Min'],                            np.minimum),
+      (['max','std::max','TMath::Max'],                            np.maximum),
+      (['isnan','std::isnan','TMath::IsNaN'],                      np.isnan),
+      (['TMath::Pi'],                                              lambda: np.pi),
+      (['sign'],                                                   lambda x: np.where(x<0,-1.,1.)), # see common/python/tools/RDataFrame.py
+      (['dmmap'],                                                  _dmmap),
+      (['(int)'],                                                  lambda x: np.trunc(x).astype(np.int64)),
+      (['(float)'],                                                lambda x: np.asarray(x,dtype=np.float64)),
+      (['(bool)'],                                                 lambda x: np.asarray(x)!=0),
+    ]:
+    for _name in _names:
+      _funcs[_name] = _func
+  _globals = { '__builtins__': { }, 'where': np.where, 'logical_and': np.logical_and,
+               'logical_or': np.logical_or, 'logical_not': np.logical_not, '_f': _funcs }
+
+
+##################
+#   NUMPYFRAME   #
+##################
+
+class ColumnLookup(object):
+  """Help class to look up columns during the evaluation of an expression at a given node:
+  first in the columns defined upstream, then in the branches of the current chunk."""
+
+  def __init__(self,node,chunk):
+    self.node  = node
+    self.chunk = chunk # NumpyChunk
+
+  def __getitem__(self,name):
+    return self.chunk.getcolumn(self.node,name)
+
+
+class NumpyChunk(object):
+  """Container of arrays of a chunk of events, with caches of evaluated masks and defined columns."""
+
+  def __init__(self,arrays,nevts):
+    self.arrays  = arrays # { branch: np.array }
+    self.nevts   = nevts
+    self.masks   = { } # { node: boolean np.array }
+    self.columns = { } # { (node,name): np.array }
+
+  def evaluate(self,node,expr):
+    """Evaluate C++ expression in the context of a given node (with all upstream definitions)."""
+    code, _ = compileexpr(expr)
+    with np.errstate(all='ignore'): # both branches of where are evaluated
+      value = eval(code,dict(_globals,_col=ColumnLookup(node,self)))
+    value = np.asarray(value)
+    if value.ndim==0: # constant: broadcast to number of events
+      value = np.full(self.nevts,value)
+    return value
+
+  def getcolumn(self,node,name):
+    """Get column from nearest upstream definition, or else from branches."""
+    defnode = node.getdefinition(name)
+    if defnode==None:
+      if name not in self.arrays:
+        raise KeyError("NumpyChunk.getcolumn: Column %r not found in tree or definitions!"%(name))
+      return self.arrays[name]
+    key = (defnode,name)
+    if key not in self.columns:
+      self.columns[key] = self.evaluate(defnode.parent,defnode.expr)
+    return self.columns[key]
+
+  def getmask(self,node):
+    """Get boolean mask of events passing all filters up to a given node."""
+    if node.kind=='root':
+      return None
+    if node not in self.masks:
+      mask = self.getmask(node.parent)
+      if node.kind=='filter':
+        passed = self.evaluate(node.parent,node.expr).astype(bool)
+        mask = passed if mask is None else (mask & passed)
+      self.masks[node] = mask
+    return self.masks[node]
+
+
+class NumpyFrame(object):
+  """Node of a lazy computation graph mimicking the subset of the RDataFrame interface
+  that is used by Sample.getrdframe: Filter, Define, HasColumn, Histo1D, Histo2D, Sum, Mean, Count.
+  Expressions are C++ strings, translated to vectorized NumPy expressions.
+  Only the branches needed by all booked results are read with uproot,
+  in chunks, when the first result is requested via GetValue:
+    rdframe = NumpyFrame('tree',"DY.root")
+    rdf_sel = rdframe.Filter("pt_1>20 && q_1*q_2<0").Define("wgt","genweight*idweight_2")
+    result  = rdf_sel.Histo1D(hmodel,"m_vis","wgt") # NumpyResult
+    hist    = result.GetValue() # TH1D
+  """
+
+  def __init__(self, *args, **kwargs):
+    if len(args)>=2 and isinstance(args[0],str): # root node: NumpyFrame(treename,filename)
+      if np==None or uproot==None:
+        LOG.throw(ImportError,"NumpyFrame: Please install numpy and uproot to use the numpy backend!")
+      self.kind     = 'root'
+      self.parent   = None
+      self.root     = self
+      self.treename = args[0]
+      self.filename = args[1]
+      self.stepsize = kwargs.get('stepsize',"200 MB") # size of chunks to read with uproot
+      self.results  = [ ] # list of booked NumpyResult objects that have not run yet
+      self.branches = None # cache of branch names in tree
+    else: # child node: NumpyFrame(parent,kind,expr,name)
+      self.parent, self.kind, self.expr, self.name = args
+      self.root = self.parent.root
+
+  def __repr__(self):
+    if self.kind=='root':
+      return "<NumpyFrame(%r,%r) at %s>"%(self.treename,self.filename,hex(id(self)))
+    return "<NumpyFrame(%s,%r) at %s>"%(self.kind,self.name,hex(id(self)))
+
+  def Filter(self,expr,name=None):
+    """Filter events with C++ expression."""
+    return NumpyFrame(self,'filter',expr,name)
+
+  def Define(self,name,expr):
+    """Define new column with C++ expression."""
+    return NumpyFrame(self,'define',expr,name)
+
+  def getdefinition(self,name):
+    """Return nearest upstream node that defines a column name."""
+    node = self
+    while node.kind!='root':
+      if node.kind=='define' and node.name==name:
+        return node
+      node = node.parent
+    return None
+
+  def GetColumnNames(self):
+    """Return list of branch names in tree (cached)."""
+    root = self.root
+    if root.branches==None:
+      with uproot.open(root.filename) as file:
+        root.branches = list(file[root.treename].keys())
+    return root.branches
+
+  def HasColumn(self,name):
+    return self.getdefinition(name)!=None or name in self.GetColumnNames()
+
+  def GetColumnType(self,name):
+    LOG.throw(NotImplementedError,"NumpyFrame.GetColumnType: Not supported by the numpy backend (e.g. for RDataFrame.Vary)!")
+
+  def Vary(self,*args,**kwargs):
+    LOG.throw(NotImplementedError,"NumpyFrame.Vary: Systematic variations are not supported by the numpy backend!")
+
+  def book(self,kind,*args):
+    result = NumpyResult(self,kind,*args)
+    self.root.results.append(result)
+    return result
+
+  def Histo1D(self,model,xname,wname=None):
+    """Book 1D histogram from a RDF.TH1DModel."""
+    return self.book('hist1d',model,[xname],wname)
+
+  def Histo2D(self,model,xname,yname,wname=None):
+    """Book 2D histogram from a RDF.TH2DModel."""
+    return self.book('hist2d',model,[xname,yname],wname)
+
+  def Sum(self,name):
+    return self.book('sum',None,[name],None)
+
+  def Mean(self,name):
+    return self.book('mean',None,[name],None)
+
+  def Count(self):
+    return self.book('count',None,[ ],None)
+
+  def getexprs(self):
+    """Return list of all C++ expressions of filters and definitions upstream."""
+    exprs = [ ]
+    node = self
+    while node.kind!='root':
+      exprs.append(node.expr)
+      node = node.parent
+    return exprs
+
+  def run(self,verb=0):
+    """Read needed branches in chunks with uproot and fill all booked results."""
+    root = self.root
+    results, root.results = root.results, [ ]
+    if not results:
+      return
+    branches = set(self.GetColumnNames())
+    needed = set()
+    for result in results:
+      for expr in result.node.getexprs()+result.columns:
+        needed.update(getcolumns(expr))
+    needed &= branches # remove defined columns
+    LOG.verb("NumpyFrame.run: Reading %d/%d branches from %s: %s"%(
+      len(needed),len(branches),root.filename,', '.join(sorted(needed))),verb,1)
+    with uproot.open(root.filename) as file:
+      tree = file[root.treename]
+      if needed:
+        for arrays in tree.iterate(sorted(needed),step_size=root.stepsize,library='np'):
+          nevts = len(next(iter(arrays.values())))
+          chunk = NumpyChunk(arrays,nevts)
+          for result in results:
+            result.fill(chunk)
+      else: # e.g. only Count without selections
+        chunk = NumpyChunk({ },tree.num_entries)
+        for result in results:
+          result.fill(chunk)
+    for result in results:
+      result.finalize()
+
+
+class NumpyResult(object):
+  """Lazy result booked in a NumpyFrame, mimicking RDF.RResultPtr<T>.
+  NOTE: Calling NumpyResult.GetValue triggers the event loop of all results booked on the same file."""
+
+  def __init__(self,node,kind,model,columns,wname=None):
+    self.node    = node # NumpyFrame
+    self.kind    = kind
+    self.model   = model # RDF.TH1DModel or RDF.TH2DModel
+    self.columns = list(columns)
+    self.wname   = wname
+    self.value   = None
+    self.edges   = [ ]
+    self.sumw    = 0 # partial sums, accumulated over chunks
+    self.sumw2   = 0
+    self.stats   = np.zeros(7) if np!=None else None # sumw, sumw2, sumwx, sumwx2, sumwy, sumwy2, sumwxy
+    self.nevts   = 0
+    if kind=='hist1d':
+      self.edges = [getedges(model.fNbinsX,model.fXLow,model.fXUp,model.fBinXEdges)]
+    elif kind=='hist2d':
+      self.edges = [getedges(model.fNbinsX,model.fXLow,model.fXUp,model.fBinXEdges),
+                    getedges(model.fNbinsY,model.fYLow,model.fYUp,model.fBinYEdges)]
+
+  def __repr__(self):
+    return "<NumpyResult(%s,%r) at %s>"%(self.kind,self.columns,hex(id(self)))
+
+  def fill(self,chunk):
+    """Fill partial result for a chunk of events."""
+    mask   = chunk.getmask(self.node)
+    values = [chunk.getcolumn(self.node,c) for c in self.columns]
+    weight = chunk.getcolumn(self.node,self.wname) if self.wname else None
+    if mask is not None:
+      values = [v[mask] for v in values]
+      if weight is not None:
+        weight = weight[mask]
+    nevts = int(mask.sum()) if mask is not None else chunk.nevts
+    self.nevts += nevts
+    if self.kind=='count':
+      return
+    elif self.kind in ['sum','mean']:
+      self.sumw += values[0].sum(dtype=np.float64)
+      return
+    if weight is None:
+      weight = np.ones(nevts)
+    weight = weight.astype(np.float64)
+    index  = np.zeros(nevts,dtype=np.int64)
+    stride = 1
+    for value, edges in zip(values,self.edges): # ROOT's global bin = ix + (nx+2)*iy
+      index += stride*np.searchsorted(edges,value,side='right') # underflow=0, overflow=nbins+1
+      stride *= len(edges)+1
+    self.sumw  = self.sumw  + np.bincount(index,weights=weight,minlength=stride)
+    self.sumw2 = self.sumw2 + np.bincount(index,weights=weight**2,minlength=stride)
+    inrange = np.ones(nevts,dtype=bool) # statistics only within range, like TH1::Fill
+    for value, edges in zip(values,self.edges):
+      inrange &= (value>=edges[0]) & (value<edges[-1])
+    w, x = weight[inrange], values[0][inrange].astype(np.float64)
+    stats = [w.sum(),(w**2).sum(),(w*x).sum(),(w*x*x).sum()]
+    if self.kind=='hist2d':
+      y = values[1][inrange].astype(np.float64)
+      stats += [(w*y).sum(),(w*y*y).sum(),(w*x*y).sum()]
+    self.stats[:len(stats)] += stats
+
+  def finalize(self):
+    """Convert accumulated arrays to final result."""
+    if self.kind=='count':
+      self.value = self.nevts
+    elif self.kind=='sum':
+      self.value = float(self.sumw)
+    elif self.kind=='mean':
+      self.value = float(self.sumw)/self.nevts if self.nevts>0 else 0.0
+    else:
+      model = self.model
+      if self.kind=='hist1d':
+        xbins = array('d',self.edges[0])
+        hist  = TH1D(model.fName,model.fTitle,len(xbins)-1,xbins)
+        stats = self.stats[:4]
+      else:
+        xbins = array('d',self.edges[0])
+        ybins = array('d',self.edges[1])
+        hist  = TH2D(model.fName,model.fTitle,len(xbins)-1,xbins,len(ybins)-1,ybins)
+        stats = self.stats
+      hist.SetDirectory(0)
+      hist.Sumw2()
+      sumw, sumw2 = np.broadcast_to(self.sumw,(hist.GetNcells(),)), np.broadcast_to(self.sumw2,(hist.GetNcells(),))
+      for i in range(hist.GetNcells()):
+        hist.SetBinContent(i,sumw[i])
+        hist.SetBinError(i,np.sqrt(sumw2[i]))
+      hist.PutStats(array('d',stats))
+      hist.SetEntries(self.nevts)
+      self.value = hist
+    self.sumw = self.sumw2 = 0 # clean memory
+
+  def GetValue(self):
+    """Return result. NOTE: This triggers the event loop if not run before !"""
+    if self.value is None:
+      self.node.run()
+    return self.value
+
+
+def getedges(nbins,xmin,xmax,edges):
+  """Help function to get bin edges from RDF.TH1DModel attributes."""
+  if edges is not None and len(edges)>=2: # variable binning
+    return np.array(list(edges),dtype=np.float64)
+  return np.linspace(xmin,xmax,nbins+1)
+
+
+def runnumpyresults(results,verb=0):
+  """Run all NumpyResults in list, once per file."""
+  roots = [ ]
+  for result in results:
+    if result.node.root not in roots:
+      roots.append(result.node.root)
+  for root in roots:
+    root.run(verb=verb)
+  return results
+
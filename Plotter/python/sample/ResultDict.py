@@ -27,6 +27,69 @@ class MeanResult():
     return self.mean.GetValue()
   
 
+class VariedResult():
+  """Store a nominal RDF.RResultPtr<T> together with its systematic variations,
+  booked with RDF.Experimental.VariationsFor in the same event loop (see Sample.getrdframe).
+  Variations are retrieved with keys 'name:tag', e.g. 'shape_tes:Up'."""
+  
+  def __init__(self,result,keys):
+    self.result = result # nominal RDF.RResultPtr<T>
+    self.keys   = list(keys) # only keep variations that apply to this sample
+    self.varmap = VariationsFor(result) # RDF.Experimental.RResultMap<T>
+  
+  def __repr__(self):
+    return "<VariedResult(%r,%r)>"%(self.result,self.keys)
+  
+  def __iter__(self):
+    """Yield nominal result for ResultDict.run -> RDF.RunGraphs."""
+    yield self.result
+  
+  def variations(self):
+    """Return set of variation keys."""
+    return set(self.keys)
+  
+  def GetValue(self,variation=None):
+    """Call GetValue of nominal result, or get (a clone of) the varied result."""
+    if variation==None or variation=='nominal':
+      return self.result.GetValue()
+    if variation in self.keys:
+      obj = self.varmap[variation] # NOTE: This triggers event loop if not run before !
+    else: # sample not affected by this variation: use nominal
+      obj = self.result.GetValue()
+    return clonevalue(obj,variation)
+  
+
+def VariationsFor(result):
+  """Help function to book systematic variations of a result (available since ROOT v6.26)."""
+  if not hasattr(RDF,'Experimental') or not hasattr(RDF.Experimental,'VariationsFor'):
+    LOG.throw(ImportError,"VariationsFor: RDF.Experimental.VariationsFor is not available in ROOT %s! Please use ROOT v6.26 or newer."%(
+      ROOT.gROOT.GetVersion()))
+  return RDF.Experimental.VariationsFor(result)
+  
+
+def getvariations(result):
+  """Help function to return set of variation keys of a result."""
+  if hasattr(result,'variations'): # VariedResult or MergedResult
+    return result.variations()
+  return set()
+  
+
+def clonevalue(obj,variation):
+  """Help function to clone varied result, so the nominal or RResultMap object is not modified."""
+  if hasattr(obj,'Clone'):
+    return obj.Clone("%s_%s"%(obj.GetName(),variation.replace(':','')))
+  return obj
+  
+
+def getvalue(result,variation=None):
+  """Help function to get (varied) value of any result."""
+  if variation==None:
+    return result.GetValue()
+  elif isinstance(result,(VariedResult,MergedResult)):
+    return result.GetValue(variation=variation)
+  return clonevalue(result.GetValue(),variation) # not affected by variation: use nominal
+  
+
 class MergedResult():
   """Container class for list of RDF.RResultPtr<T> (and other MergedResult) objects.
   If MergedResult.GetValue is called, it will add together the results.
@@ -56,22 +119,33 @@ class MergedResult():
         yield result.mean
         if result._sumw:
           yield result._sumw
+      elif isinstance(result,(VariedResult,CachedResult,CachingResult)):
+        for subresult in result: # nothing to run for CachedResult
+          yield subresult
       else:
         yield result
   
+  def variations(self):
+    """Return union of variation keys of all results."""
+    keys = set()
+    for result in self._list:
+      keys.update(getvariations(result))
+    return keys
+  
   def append(self,result):
     """Add RDF.RResultPtr<T> or MergedResult to list."""
     self._list.append(result)
     return result
   
-  def GetValue(self,verb=0):
+  def GetValue(self,verb=0,variation=None):
     """Call GetValue for each object and add together.
+    If variation is given, add the varied results (or nominal if a result is not varied).
     Return sum."""
     totsumw = 0 # weighted normalization for MeanResult
     sumobj  = None
     verb    = max(self.verb,verb)
     for result in self._list: # iterate over RDF.RResultPtr<T> (or other MergedResult) objects
-      obj  = result.GetValue() # NOTE: This triggers event loop if not run before !
+      obj  = getvalue(result,variation) # NOTE: This triggers event loop if not run before !
       sumw = result.sumw if hasattr(result,'sumw') else 0 # sum-of-weights for normalization
       if sumobj==None: # initialize sumobj
         if sumw==0:
@@ -82,7 +156,7 @@ class MergedResult():
           sumobj  = sumw*obj # weighted (total sum will be normalized)
           totsumw = sumw # for later normalization
         if isinstance(self.name,str) and hasattr(sumobj,'SetName'):
-          sumobj.SetName(self.name)
+          sumobj.SetName(self.name if variation==None else "%s_%s"%(self.name,variation.replace(':','')))
         if isinstance(self.title,str) and hasattr(sumobj,'SetTitle'):
           sumobj.SetTitle(self.title)
       elif hasattr(obj,'Add'): # add other object, e.g. a TH1
@@ -183,7 +257,7 @@ class ResultDict(): #object
             if style: # set fill/line/marker color
               sample.stylehist(value)
             yield sel, var, sample, value # 3 keys, 1 value
-          elif isinstance(result,MergedResult):
+          elif isinstance(result,(MergedResult,VariedResult,CachedResult,CachingResult)):
             for subresult in result: # note: can be recursive
               yield sel, var, sample, subresult # 3 keys, 1 value (RDF.RResultPtr)
           else: # assume RDF.RResultPtr<T>
@@ -250,25 +324,21 @@ class ResultDict(): #object
           self._dict[sel].pop(var,None)
     return hist_dict
   
-  def gethistsets(self,style=True,clean=False):
-    """Organize histograms into HistSet objects."""
+  def gethistsets(self,style=True,clean=False,lazy=False):
+    """Organize histograms into HistSet objects.
+    Systematic variations booked with RDataFrame.Vary (see VariedResult) are
+    organized into separate HistSet objects in HistSet.variations.
+    If lazy=True, the histograms are only retrieved, merged & styled when the HistSet is accessed
+    (see LazyHistSet), so they can be processed one by one, and freed with HistSet.free."""
     histset_dict = HistDict() # { selection : { variable: HistSet } }
     for sel in self._dict:
       histset_dict[sel] = { }
       for var in list(self._dict[sel].keys()):
-        histset = HistSet(var=var,sel=sel)
-        for sample, result in self._dict[sel][var].items():
-          # NOTE: This triggers event loop if not run before !
-          # NOTE: If MergedResult, its histograms are (recursively) summed
-          hist = result.GetValue() # get values via RDF.RResultPtr<TH1D>.GetValue or MergedResult.GetValue
-          if style: # set fill/line/marker color
-            sample.stylehist(hist)
-          if sample.isdata: # observed data
-            histset.data = hist
-          elif sample.issignal: # signal
-            histset.sig.append(hist)
-          else: # exp (background)
-            histset.exp.append(hist)
+        results = self._dict[sel][var] # { sample: result }
+        if lazy: # retrieve histograms on first access
+          histset = LazyHistSet(lambda h, r=results: fillhistset(h,r,style=style),var=var,sel=sel)
+        else:
+          histset = fillhistset(HistSet(var=var,sel=sel),results,style=style)
         histset_dict[sel][var] = histset
         if clean: # remove nested dictionary to clean memory
           self._dict[sel].pop(var,None)
@@ -342,44 +412,85 @@ class ResultDict(): #object
   
   def run(self,graphs=True,rdf_dict=None,dot=False,verb=0):
     """Run RDataFrame events loops (filling histograms, etc.)."""
-    
-    # PREPARE REPORTS & DOT GRAPH
-    reports = [ ]
-    if (dot or verb>=2) and isinstance(rdf_dict,dict): # add RDataFrame reports of selections
-      for keys, value in rdf_dict.items():
-        if len(keys)==2 and isinstance(value,RDataFrame):
-          reports.append((keys[1],value.Report()))
-          if dot: # make graphical representation of RDataFrame's structure
-            if isinstance(dot,str): # print to file
-              name  = keys[1].split('/')[-1].replace('.root','')
-              fname = dot.replace('$NAME',name)
-              print(">>> ResultDict.run: dot for %r, print to dot=%r"%(keys[1],fname))
-              RDF.SaveGraph(value,fname)
-            else: # print to screen
-              print(">>> ResultDict.run: dot for %r, dot=%r"%(keys[1],dot))
-              RDF.SaveGraph(value) # display with e.g. https://edotor.net
-    
-    # RUN ALL RDATAFRAMES
     results = self.results() # get list of RDF.RResultPtr<T> objects
-    start = time.time(), time.process_time() # wall-clock & CPU time
-    if not results:
+    if not results and len(self)>=1: # e.g. all histograms were retrieved from HistCache
+      LOG.verb("ResultDict.run: No results to run (all cached)...",verb,1)
+      return self
+    elif not results:
       LOG.warn("ResultDict.run: Did not get any results to run... self._dict=%r"%(self._dict))
-    elif graphs: # should be faster for large number of results in parallel
-      LOG.verb("ResultDict.run: Start RunGraphs of %s results with %s threads..."%(len(results),ROOT.GetThreadPoolSize()),verb,1)
-      RDF.RunGraphs(results) # run results concurrently
-    else: # trigger sequentially (might be slower)
-      LOG.verb("ResultDict.run: Start GetValue of %s RDF results with %s threads..."%(len(results),ROOT.GetThreadPoolSize()),verb,1)
-      for result in results: # run results one-by-one
-        result.GetValue() # trigger event loop
-    RDF.StopProgressBar(" in %s with %s threads"%(took(*start),ROOT.GetThreadPoolSize()))
-    
-    # PRINT REPORTS
-    for fname, report in reports:
-      print(">>> ResultDict.run: Report %r:"%(fname))
-      printRDFReport(report,reorder=True)
-    
+    runresults(results,graphs=graphs,rdf_dict=rdf_dict,dot=dot,verb=verb)
     return self
     
 
+def fillhistset(histset,results,style=True):
+  """Help function to fill HistSet with the histograms of a dictionary of results { sample: result }."""
+  for sample, result in results.items():
+    # NOTE: This triggers event loop if not run before !
+    # NOTE: If MergedResult, its histograms are (recursively) summed
+    hist = result.GetValue() # get values via RDF.RResultPtr<TH1D>.GetValue or MergedResult.GetValue
+    if style: # set fill/line/marker color
+      sample.stylehist(hist)
+    histset.add(sample,hist)
+    for variation in sorted(getvariations(result)): # only samples affected by this variation
+      varhist = result.GetValue(variation=variation)
+      if style: # set fill/line/marker color
+        sample.stylehist(varhist)
+      varset = histset.variations.setdefault(variation,HistSet(var=histset.var,sel=histset.sel))
+      varset.add(sample,varhist)
+  return histset
+  
+
+def runresults(results,graphs=True,rdf_dict=None,dot=False,verb=0):
+  """Run RDataFrame events loops for a list of results (RDF.RResultPtr<T>),
+  e.g. from one or more ResultDict objects."""
+  
+  # PREPARE REPORTS & DOT GRAPH
+  reports = [ ]
+  if (dot or verb>=2) and isinstance(rdf_dict,dict): # add RDataFrame reports of selections
+    for keys, value in rdf_dict.items():
+      if len(keys)==2 and isinstance(value,RDataFrame):
+        reports.append((keys[1],value.Report()))
+        if dot: # make graphical representation of RDataFrame's structure
+          if isinstance(dot,str): # print to file
+            name  = keys[1].split('/')[-1].replace('.root','')
+            fname = dot.replace('$NAME',name)
+            print(">>> runresults: dot for %r, print to dot=%r"%(keys[1],fname))
+            RDF.SaveGraph(value,fname)
+          else: # print to screen
+            print(">>> runresults: dot for %r, dot=%r"%(keys[1],dot))
+            RDF.SaveGraph(value) # display with e.g. https://edotor.net
+  
+  # RUN NUMPY BACKEND (see NumpyFrame.py)
+  npresults = [r for r in results if isinstance(r,NumpyResult)]
+  if npresults:
+    LOG.verb("runresults: Start filling %s results with numpy..."%(len(npresults)),verb,1)
+    runnumpyresults(npresults,verb=verb)
+    results = [r for r in results if not isinstance(r,NumpyResult)]
+    if not results:
+      return npresults
+  
+  # RUN ALL RDATAFRAMES
+  start = time.time(), time.process_time() # wall-clock & CPU time
+  if not results:
+    LOG.verb("runresults: No results to run...",verb,1)
+  elif graphs: # should be faster for large number of results in parallel
+    LOG.verb("runresults: Start RunGraphs of %s results with %s threads..."%(len(results),ROOT.GetThreadPoolSize()),verb,1)
+    RDF.RunGraphs(results) # run results concurrently
+  else: # trigger sequentially (might be slower)
+    LOG.verb("runresults: Start GetValue of %s RDF results with %s threads..."%(len(results),ROOT.GetThreadPoolSize()),verb,1)
+    for result in results: # run results one-by-one
+      result.GetValue() # trigger event loop
+  RDF.StopProgressBar(" in %s with %s threads"%(took(*start),ROOT.GetThreadPoolSize()))
+  
+  # PRINT REPORTS
+  for fname, report in reports:
+    print(">>> runresults: Report %r:"%(fname))
+    printRDFReport(report,reorder=True)
+  
+  return results
+  
+
 from TauFW.Plotter.sample.utils import LOG
-from TauFW.Plotter.sample.HistSet import HistSet, HistDict # to contain histograms
+from TauFW.Plotter.sample.HistSet import HistSet, LazyHistSet, HistDict # to contain histograms
+from TauFW.Plotter.sample.HistCache import CachedResult, CachingResult # for histograms cached on disk
+from TauFW.Plotter.sample.NumpyFrame import NumpyResult, runnumpyresults # for numpy backend
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Author: Izaak Neutelings (November 2023)
+# Description: Collect booked RDataFrame results from many calls and run them simultaneously.
+import time
+from TauFW.common.tools.string import took
+from TauFW.Plotter.sample.ResultDict import runresults
+
+
+class ScheduledResult():
+  """Placeholder for the final result of a booked ResultDict (e.g. a nested dictionary of HistSets),
+  which is only available after ResultScheduler.run.
+  NOTE: Calling ScheduledResult.GetValue triggers the event loop if not run before."""
+
+  def __init__(self,scheduler,res_dict,callback=None):
+    self.scheduler = scheduler # ResultScheduler
+    self.res_dict  = res_dict  # ResultDict
+    self.callbacks = [callback] if callback else [ ] # functions to process ResultDict after running, e.g. convert to HistSets
+    self.value     = None
+    self.done      = False
+
+  def __repr__(self):
+    return "<ScheduledResult(%r,done=%r)>"%(self.callbacks,self.done)
+
+  def addcallback(self,callback):
+    """Add function to further process the value after running, e.g. to write histograms to file.
+    The function takes the output of the previous callback as argument."""
+    if self.done:
+      self.value = callback(self.value)
+    else:
+      self.callbacks.append(callback)
+    return self
+
+  def process(self):
+    """Process results after running."""
+    if not self.done:
+      value = self.res_dict
+      for callback in self.callbacks:
+        value = callback(value)
+      self.value = value
+      self.done  = True
+      self.res_dict = None # clean memory
+    return self.value
+
+  def GetValue(self):
+    """Get processed result. NOTE: This triggers event loop if not run before !"""
+    if not self.done:
+      self.scheduler.run()
+    return self.value
+
+
+class ResultScheduler():
+  """Session-level scheduler to collect booked RDF results (ResultDict) from many calls
+  of e.g. SampleSet.gethists or createinputs, and trigger a single RDF.RunGraphs
+  for all of them, so the thread pool stays saturated over all files:
+
+    scheduler = ResultScheduler()
+    hists1 = sampleset.gethists(variables,selections,scheduler=scheduler) # ScheduledResult
+    hists2 = sampleset_TES.gethists(variables,selections,scheduler=scheduler) # ScheduledResult
+    scheduler.run() # one event loop per file
+    hists1 = hists1.GetValue() # { selection: { variable: HistSet } }
+
+  RDataFrames of the same file are shared between calls via ResultScheduler.rdf_dict.
+  """
+
+  def __init__(self,**kwargs):
+    self.rdf_dict  = kwargs.get('rdf_dict', { }   ) # shared RDataFrames for the same filename / selection
+    self.dot       = kwargs.get('dot',      False ) # name for dot graph (e.g. "graph_$NAME.dot")
+    self.verbosity = kwargs.get('verb',     0     ) # verbosity level
+    self.queue     = [ ] # list of ScheduledResult
+
+  def __repr__(self):
+    return "<ResultScheduler(%d booked) at %s>"%(len(self.queue),hex(id(self)))
+
+  def __len__(self):
+    return len(self.queue)
+
+  def book(self,res_dict,callback=None):
+    """Book ResultDict with a function to process it after the run.
+    Return ScheduledResult to retrieve the processed value later."""
+    result = ScheduledResult(self,res_dict,callback)
+    self.queue.append(result)
+    return result
+
+  def run(self,verb=0):
+    """Run all booked results in one RDF.RunGraphs call, and process them in the order they were booked."""
+    verbosity = max(self.verbosity,verb)
+    queue = self.queue
+    self.queue = [ ] # allow booking new results during processing
+    if not queue:
+      return [ ]
+    results = [r for s in queue for r in s.res_dict.results()] # list of RDF.RResultPtr<T>
+    start = time.time(), time.process_time() # wall-clock & CPU time
+    LOG.verb("ResultScheduler.run: Running %d booked ResultDicts with %d results..."%(len(queue),len(results)),verbosity,1)
+    runresults(results,graphs=True,rdf_dict=self.rdf_dict,dot=self.dot,verb=verbosity)
+    self.rdf_dict.clear() # RDataFrames have been run: do not reuse for newly booked results
+    values = [scheduled.process() for scheduled in queue]
+    LOG.verb("ResultScheduler.run: Done in %s"%(took(*start)),verbosity,1)
+    return values
+
+
+from TauFW.Plotter.sample.utils import LOG
@@ -3,12 +3,17 @@
 import os, re
 from TauFW.Plotter.sample.utils import *
 from TauFW.common.tools.math import round2digit, reldiff
-from TauFW.common.tools.RDataFrame import RDF, RDataFrame, AddRDFColumn
-from TauFW.Plotter.sample.ResultDict import ResultDict, MeanResult # for containing RDataFRame RResultPtr
+from TauFW.common.tools.RDataFrame import RDF, RDataFrame, AddRDFColumn, AddRDFFilter
+from TauFW.Plotter.sample.ResultDict import ResultDict, MeanResult, VariedResult # for containing RDataFRame RResultPtr
+from TauFW.Plotter.sample.Variation import Variation, vary # for systematic variations with RDataFrame.Vary
+from TauFW.Plotter.sample.HistCache import CachedResult, CachingResult, gethistcache # for caching filled histograms
+from TauFW.Plotter.sample.NumpyFrame import NumpyFrame # columnar backend with numpy & uproot
 from TauFW.Plotter.plot.string import *
 from TauFW.Plotter.plot.utils import deletehist, printhist
 from TauFW.Plotter.sample.SampleStyle import *
 from ROOT import TTree, TFile
+_rootnames   = { } # cache of identifiers declared to ROOT (functions & constants): { name: bool }
+_branchnames = { } # cache of branch names: { (treename,filename): list }
 
 
 class Sample(object):
@@ -193,6 +198,15 @@ class Sample(object):
     selectbranches(tree,self.branchsels,verb=verbosity)
     return file, tree
   
+  def getbranchnames(self):
+    """Return list of branch names in tree (cached)."""
+    key = (self.treename,self.filename)
+    if key not in _branchnames:
+      file = self.getfile()
+      _branchnames[key] = [b.GetName() for b in file.Get(self.treename).GetListOfBranches()]
+      file.Close()
+    return _branchnames[key]
+  
   def getentries_from_tree(self,cut=None):
     file  = self.getfile()
     if cut==None:
@@ -594,6 +608,34 @@ class Sample(object):
     self.splitsamples = splitsamples # save list of split samples
     return splitsamples
   
+  def checkbranches(self,branches,variables,selections,aliases={ },exprs=[ ],samples=[ ],verb=0):
+    """Statically collect all branches used by the selections, variables, weights & aliases,
+    report how many of the available branches are read, and warn about unknown identifiers
+    (e.g. typos) before they cause obscure errors during the JIT compilation of RDataFrame."""
+    exprs = list(exprs)
+    for sample in (samples or [self]):
+      exprs.extend([sample.cuts,sample.weight,sample.extraweight])
+    for selection in selections:
+      exprs.extend([selection.selection,selection.weight])
+    for variable in variables:
+      for var in (variable if isinstance(variable,tuple) else [variable]):
+        exprs.extend([var.name,var.cut,var.weight,var.dataweight])
+        for context in [var.ctxcut,var.ctxweight]: # context-dependent cuts & weights, see Variable.changecontext
+          if context:
+            exprs.extend([context.default]+list(context.context.values()))
+    branches = set(branches)
+    used, unknown = getbranches(exprs,branches,aliases,verb=verb)
+    for name in unknown:
+      if name not in _rootnames: # lookup in ROOT (Cling) is slow
+        _rootnames[name] = hasattr(ROOT,name)
+    unknown = [n for n in sorted(unknown) if not _rootnames[n]] # ignore functions & constants declared to ROOT
+    LOG.verb("Sample.checkbranches: Reading %d/%d branches from %s: %s"%(
+             len(used),len(branches),self.filename,', '.join(sorted(used))),verb,1)
+    if unknown:
+      LOG.warn("Sample.checkbranches: Unknown identifiers %s for %r (not a branch nor an alias)! Used in %r"%(
+               ', '.join(unknown),self.name,[e for e in exprs if e and any(n in str(e) for n in unknown)]))
+    return used, unknown
+  
   def getrdframe(self,variables,selections,**kwargs):
     """Create RDataFrame for list of selections and variables.
     The basic structure is:
@@ -632,6 +674,29 @@ class Sample(object):
           res_dict[selection][variable][self] = result # RDF.RResultPtr<TH2D>
       ...
     
+    Systematic variations (list of Variation objects, e.g. weight replacements or column shifts)
+    are booked with RDataFrame.Vary in the same event loop as the nominal histograms:
+    
+      rdf_alias = rdf_alias.Vary("m_vis","ROOT::RVec<float>{m_vis_ResUp,m_vis_ResDown}",['Up','Down'],"shape_res")
+      ...
+          rdf_sam = rdf_sam.Vary("sam_wgt","ROOT::RVec<double>{wgtUp,wgtDown}",['Up','Down'],"shape_id")
+          ...
+            result = VariedResult(rdf_var.Histo1D(hmodel,variable.name,weight),keys)
+    
+    If cache=True (or a directory or HistCache object), filled histograms are stored on disk,
+    and retrieved the next time with the same inputs (file, selection, variable, binning, weights),
+    without booking them in the RDataFrame, so the event loop can be skipped.
+    
+    If chain is a list of (Sample,scale) pairs (e.g. subsamples of a stitched MergedSample with the same
+    tree, cuts and weights), their files are read by one RDataFrame, and the normalization of each file
+    is applied via a column defined per file with RDataFrame.DefinePerSample:
+    
+      rdframe = RDataFrame(treename,[filename1,filename2,...])
+      rdframe = rdframe.DefinePerSample("_rdf_file_scale",'rdfsampleinfo_.Contains("filename1") ? 0.23 : ...')
+    
+    If backend='numpy', a NumpyFrame is used instead of RDataFrame, which has the same interface,
+    but evaluates the C++ expressions as vectorized NumPy expressions on branches read with uproot.
+    
     """
     verbosity     = LOG.getverbosity(kwargs)
     name          = kwargs.get('name',     self.name   ) # hist name
@@ -640,6 +705,9 @@ class Sample(object):
     norm          = kwargs.get('norm',     True        ) # normalize to cross section
     norm          = self.norm if norm else 1.0
     scale         = kwargs.get('scale',     1.0        ) * self.scale * norm # total scale
+    chain         = kwargs.get('chain',    None        ) # list of (Sample,scale) to chain their files into one RDataFrame with per-file scales
+    if chain: # normalization & scale per file is applied via column _rdf_file_scale
+      scale       = kwargs.get('scale',     1.0        )
     split         = kwargs.get('split',    False       ) and len(self.splitsamples)>=1 # split sample into components (e.g. with cuts on genmatch)
     blind         = kwargs.get('blind',    self.isdata ) # blind data in some given range: self.blinddict={xvar:(xmin,xmax)}
     rdf_dict      = kwargs.get('rdf_dict', None        ) # reuse RDF for the same filename / selection (used for optimizing split MergedSamples)
@@ -649,6 +717,10 @@ class Sample(object):
     dosumw        = kwargs.get('sumw',     False       ) # get sum of event weights (e.g. for cutflows)
     replaceweight = kwargs.get('replaceweight', None   ) # replace weight, e.g. replaceweight=('idweight_2','idweightUp_2')
     preselection  = kwargs.get('preselect', None       ) # pre-selection string (common pre-filter, before aliases all other selections)
+    variations    = kwargs.get('variations', None      ) or [ ] # systematic variations with RDataFrame.Vary, list of Variation objects
+    cache         = kwargs.get('cache',    False       ) # cache filled histograms on disk (True, directory or HistCache)
+    backend       = kwargs.get('backend',  'rdf'       ) # 'rdf' (RDataFrame) or 'numpy' (NumpyFrame)
+    checkbranch   = kwargs.get('checkbranches', True   ) # statically check that all expressions only use existing branches
     alias_dict    = self.aliases
     if hasattr(preselection,'selection'): # ensure string
       preselection = preselection.selection
@@ -656,9 +728,22 @@ class Sample(object):
       alias_dict  = alias_dict.copy()
       alias_dict.update(kwargs['alias'])
     extracuts     = joincuts(kwargs.get('cuts',""),kwargs.get('extracuts',""))
+    cache         = gethistcache(cache,verb=verbosity)
     samples       = self.splitsamples if split else [self]
-    rdfkey_main   = (self.treename,self.filename)
-    rdfkey_alias  = (self.treename,self.filename,'alias') # for common preselection & aliases
+    variations    = [v for v in variations if any(v.appliesto(s) for s in samples)]
+    shifts        = [v for v in variations if v.shifts] # column shifts (common to all subsamples)
+    shiftkey      = tuple(v.name for v in shifts)
+    rdfkey_main   = (self.treename,self.filename) if backend=='rdf' else (self.treename,self.filename,backend)
+    if chain:
+      rdfkey_main = (self.treename,tuple(s.filename for s, _ in chain))
+    rdfkey_alias  = rdfkey_main+('alias',preselection,tuple(sorted(alias_dict.items())))+shiftkey # for common preselection, aliases & column shifts
+    if variations and backend!='rdf':
+      LOG.throw(NotImplementedError,"Sample.getrdframe: Systematic variations are only supported by the RDataFrame backend, not %r!"%(backend))
+    if chain and (backend!='rdf' or split):
+      LOG.throw(NotImplementedError,"Sample.getrdframe: Chaining files is only supported by the RDataFrame backend without splitting!")
+    if checkbranch: # validate expressions before JIT compilation
+      self.checkbranches(self.getbranchnames(),variables,selections,alias_dict,
+                         exprs=[preselection,extracuts,kwargs.get('weight',"")],samples=samples,verb=verbosity)
     if verbosity>=1:
       LOG.verb("Sample.getrdframe: Creating RDataFrame for %s ('%s'): %s, split=%r, extracuts=%r, presel=%r"%(
                color(name,'grey',b=True),color(title,'grey',b=True),self.filename,split,extracuts,preselection),verbosity,1)
@@ -685,7 +770,7 @@ class Sample(object):
         cuts = joincuts(cuts,self.cuts) # apply now to minimize number of filters
       
       ##### REUSE RDataFrame to optimize event loop for same file ########################################
-      rdfkey_sel = (self.filename,cuts,tuple(variables)) # key for finding common RDataFrame in rdf_dict
+      rdfkey_sel = (rdfkey_alias,cuts,tuple(variables)) # key for finding common RDataFrame in rdf_dict
       variables_ = [ ] # list of variables filtered for this selection
       expr_dict  = { } # expression -> unique name of RDF column
       if rdf_dict!=None and rdfkey_sel in rdf_dict:
@@ -701,6 +786,19 @@ class Sample(object):
         if rdframe==None:
           if rdf_dict!=None and rdfkey_main in rdf_dict:
             rdframe = rdf_dict[rdfkey_main] # reuse shared RDataFrame for improved performance
+          elif backend=='numpy': # create main NumpyFrame common to all selections
+            rdframe = NumpyFrame(self.treename,self.filename)
+            if rdf_dict!=None:
+              rdf_dict[rdfkey_main] = rdframe # store for reuse
+          elif chain: # create one RDataFrame for the files of all samples in the chain
+            LOG.verb("Sample.getrdframe:   Chaining %d files with scales %s"%(
+                     len(chain),', '.join("%s=%.6g"%(s.name,f) for s, f in chain)),verbosity,1)
+            rdframe = RDataFrame(self.treename,ROOT.std.vector('string')([s.filename for s, _ in chain]))
+            nevts = sum(s.getentries_from_tree() for s, _ in chain) # get total number of events to process
+            RDF.AddProgressBar(rdframe,nevts,": "+task+name)
+            rdframe = rdframe.DefinePerSample("_rdf_file_scale",getfilescale(chain))
+            if rdf_dict!=None:
+              rdf_dict[rdfkey_main] = rdframe # store for reuse & reporting, etc.
           else: # create main RDataFrame common to all selections
             rdframe = RDataFrame(self.treename,self.filename) # save for next iteration on selection
             nevts = self.getentries_from_tree() # get total number of events to process
@@ -715,9 +813,13 @@ class Sample(object):
           rdframe_alias = rdframe
           if preselection: # apply common preselection/filter (before aliases!)
             LOG.verb("Sample.getrdframe:   Adding common preselection %r..."%(preselection),verbosity,1)
-            rdframe_alias = rdframe_alias.Filter(preselection)
+            rdframe_alias = AddRDFFilter(rdframe_alias,preselection)
           for alias, expr in alias_dict.items(): # define aliases as new columns (assume used downstream in selection, variable, and/or weight) !
             rdframe_alias, _ = AddRDFColumn(rdframe_alias,expr,alias,expr_dict=expr_dict,exact=True,verb=verbosity-3)
+          for variation in shifts: # vary columns (before selections, which may depend on them)
+            for column, varied in variation.varycolumns():
+              LOG.verb("Sample.getrdframe:   Varying column %r -> %r (%s)..."%(column,varied,variation.name),verbosity,1)
+              rdframe_alias = vary(rdframe_alias,column,varied,variation.tags,variation.name)
           if rdf_dict!=None:
             rdf_dict[rdfkey_alias] = rdframe_alias # store for reuse
         
@@ -725,7 +827,7 @@ class Sample(object):
         rdf_sel = rdframe_alias # RDataFrame specific to this selection (filter)
         if cuts: # add fiter
           #LOG.verb("Sample.getrdframe:   Applying filter for cuts=%r..."%(cuts),verbosity,3)
-          rdf_sel = rdf_sel.Filter(cuts,repr(selection.selection))
+          rdf_sel = AddRDFFilter(rdf_sel,cuts,repr(selection.selection))
         
         # VARIABLES: (1) Filter variables, and (2) define common variables
         for variable in variables:
@@ -766,7 +868,7 @@ class Sample(object):
       # APPLY EXTRA CUTS if RDataFrame is shared
       if rdf_dict!=None and extracuts:
         LOG.verb("Sample.getrdframe:   Applying filter for extracuts=%r..."%(extracuts),verbosity,1)
-        rdf_sel = rdf_sel.Filter(extracuts,"Extra %r"%extracuts)
+        rdf_sel = AddRDFFilter(rdf_sel,extracuts,"Extra %r"%extracuts)
       
       # RUN over subsamples (to allow for splitting)
       for sample in samples:
@@ -791,14 +893,15 @@ class Sample(object):
         rdf_sam = rdf_sel # RDataFrame specific to this (sub)sample
         if split: # add filters of sample-specific cuts
           if sample.cuts:
-            rdf_sam = rdf_sam.Filter(sample.cuts,"Split %r"%sample.cuts)
+            rdf_sam = AddRDFFilter(rdf_sam,sample.cuts,"Split %r"%sample.cuts)
           else: # should not happen ! Split samples should always have some cut, otherwise, what is the point? :p
             LOG.warn("Sample.getrdframe: Preparing subsample %r, but no cuts were defined!"%(sample))
         
         # ADD WEIGHTS: common + selection + sample-specific
         # NOTE: key-word 'weight' is also applied to data samples
         wname = "" # weight column name
-        wexpr = joinweights(kwargs.get('weight',""),sample.weight,sample.extraweight,selection.weight,scale_)
+        wexpr = joinweights(kwargs.get('weight',""),sample.weight,sample.extraweight,selection.weight,scale_,
+                            "_rdf_file_scale" if chain else "")
         if replaceweight: # replace patterns, e.g. replaceweight=('idweight_2','idweightUp_2')
           wexpr = replacepattern(wexpr,replaceweight)
         if wexpr: # if mathematical expression: compile & define column in RDF with unique column name
@@ -806,6 +909,21 @@ class Sample(object):
         if wname and verbosity>=1:
           LOG.verb("Sample.getrdframe:   Common/sample/selection weight: %s=%r"%(wname,wexpr),verbosity,1)
         
+        # ADD VARIATIONS of weights
+        varkeys = [ ] # keys of variations affecting this sample
+        for variation in variations:
+          if not variation.appliesto(sample): continue
+          if variation.shifts: # column shift (already applied)
+            varkeys.extend(variation.keys())
+            continue
+          wvars = variation.varyweight(wexpr) # list of varied weight expressions
+          if wvars==None: # weight not affected
+            LOG.verb("Sample.getrdframe:   Weight not affected by variation %r..."%(variation.name),verbosity,2)
+            continue
+          LOG.verb("Sample.getrdframe:   Varying weight %s=%r -> %r (%s)"%(wname,wexpr,wvars,variation.name),verbosity,1)
+          rdf_sam = vary(rdf_sam,wname,wvars,variation.tags,variation.name)
+          varkeys.extend(variation.keys())
+        
         # COMPUTE SUM OF WEIGHTS
         res_sumw = None
         if dosumw:
@@ -830,16 +948,32 @@ class Sample(object):
           rdf_var = rdf_sam # RDataFrame specific to this variable
           wname2  = wname # column name for total event weight
           if self.isdata: # add data-specific weights, and blinding cuts
-            wexpr2  = joinweights(wname,xvar.dataweight) # add variable-specific weight for data
+            wvar    = xvar.dataweight
             cut_var = xvar.cut
             if blind:
               blindcuts = xvar.blind(blinddict=self.blinddict) # ensure the cuts match the bin edges
               cut_var = joincuts(xvar.cut,xvar.blindcuts) # add blinding cuts (if applicable)
           else: # add MC-specific weight
-            wexpr2  = joinweights(wname,xvar.weight) # add variable-specific weight for MC
+            wvar    = xvar.weight
             cut_var = xvar.cut
+          wexpr2 = joinweights(wname,wvar) # add variable-specific weight
+          
+          # RETRIEVE histogram from CACHE
+          ckey = None # cache key
+          if cache and not domean and not varkeys:
+            varkey = (xvar.name,xvar.getbins()) if yvar==None else (xvar.name,xvar.getbins(),yvar.name,yvar.getbins())
+            cfile  = [(s.filename,f) for s, f in chain] if chain else self.filename
+            ckey   = cache.getkey(cfile,self.treename,preselection,sorted(alias_dict.items()),
+                                  cuts,extracuts,sample.cuts if split else "",wexpr,wvar,cut_var,varkey)
+            hname  = makehistname(xvar,name_) if yvar==None else makehistname(yvar,'vs',xvar,name_)
+            hist   = cache.get(ckey,name=hname,title=title_)
+            if hist!=None:
+              LOG.verb("Sample.getrdframe:     Retrieved hist %r from cache..."%(hname),verbosity,1)
+              res_dict.add(selection,variable,sample,CachedResult(hist))
+              continue
+          
           if cut_var: # add filter to RDataFrame
-            rdf_var = rdf_var.Filter(cut_var,"Var %r"%cut_var)
+            rdf_var = AddRDFFilter(rdf_var,cut_var,"Var %r"%cut_var)
           if wexpr2 and wexpr2!=wname2: # if mathematical expression: compile & define column in RDF with unique column name
             rdf_var, wname2 = AddRDFColumn(rdf_var,wexpr2,"_rdf_var_wgt",verb=verbosity-3) # ensure unique column name
           
@@ -882,6 +1016,12 @@ class Sample(object):
             else: # no weight
               result = rdf_var.Histo2D(hmodel,xname,yname)
           
+          # BOOK VARIATIONS
+          if varkeys and not domean:
+            result = VariedResult(result,varkeys) # book varied results via RDF.Experimental.VariationsFor
+          elif ckey: # store in cache after filling
+            result = CachingResult(result,cache,ckey)
+          
           #print(">>> Sample.getrdframe:     Adding to results: sel={selection!r}, var={variable!r}, sam={sample!r}, res={result!r}")
           res_dict.add(selection,variable,sample,result) # add RDF.RResultPtr<TH1D> to dict
     
@@ -980,4 +1120,14 @@ def MC(*args,**kwargs):
   return Sample(*args,**kwargs)
   
 
+def getfilescale(chain):
+  """Help function to create C++ expression for RDataFrame.DefinePerSample that returns the scale of
+  each file in a chain of (Sample,scale) pairs. Longer filenames are checked first, in case one
+  filename is contained in another, as RSampleInfo.Contains does a substring search."""
+  expr = "0."
+  for sample, scale in sorted(chain,key=lambda c: len(c[0].filename)): # build from inside out
+    expr = 'rdfsampleinfo_.Contains("%s") ? %r : (%s)'%(sample.filename,float(scale),expr)
+  return expr
+  
+
 from TauFW.Plotter.sample.MergedSample import MergedSample
@@ -5,6 +5,9 @@ from math import sqrt
 from copy import copy, deepcopy
 from TauFW.Plotter.sample.utils import *
 from TauFW.Plotter.sample.HistSet import HistSet, HistDict
+from TauFW.Plotter.sample.ResultDict import ResultDict
+from TauFW.Plotter.sample.ResultScheduler import ResultScheduler, ScheduledResult
+from TauFW.Plotter.sample.HistCache import gethistcache
 from TauFW.Plotter.plot.string import makelatex, maketitle, makehistname
 from TauFW.Plotter.plot.Variable import Variable
 from TauFW.Plotter.plot.Stack import Stack
@@ -251,15 +254,11 @@ class SampleSet(object):
     newset = SampleSet(datasample,expsamples,sigsamples,**kwargs)
     return newset
   
-  def gethists(self, *args, **kwargs):
-    """Create and fill histograms for all samples for given lists of variables and selections
-    with RDataFrame and return nested dictionary of histogram set (HistSet)."""
+  def getrdframe(self, variables, selections, **kwargs):
+    """Create RDataFrames for all samples for given lists of variables and selections,
+    and book histograms without running the event loop.
+    Return ResultDict of booked histograms (RDF.RResultPtr<TH1D>)."""
     verbosity     = LOG.getverbosity(kwargs,self)
-    LOG.verb("SampleSet.gethists: args=%r"%(args,),verbosity,1)
-    variables, selections, issinglevar, issinglesel = unpack_gethist_args(*args)
-    if not variables or not selections:
-      LOG.warn("SampleSet.gethists: No variables or selections to make histograms for... Got args=%r"%(args,))
-      return { }
     dodata        = kwargs.get('data',          True     ) # create data hists
     domc          = kwargs.get('mc',            True     ) # create expected (SM background) hists
     doexp         = kwargs.get('exp',           domc     ) # create expected (SM background) hists
@@ -267,25 +266,25 @@ class SampleSet(object):
     weight        = kwargs.get('weight',        ""       ) # extra weight (for MC only)
     dataweight    = kwargs.get('dataweight',    ""       ) # extra weight for data
     replaceweight = kwargs.get('replaceweight', None     ) # replace substring of weight
+    variations    = kwargs.get('variations',    None     ) # systematic variations with RDataFrame.Vary (for MC only)
     split         = kwargs.get('split',         True     ) # split samples into components (e.g. by genmatch)
     blind         = kwargs.get('blind',         True     ) # blind data in some given range: blind={xvar:(xmin,xmax)}
     sigscale      = kwargs.get('sigscale',      None     ) # scale up signal histograms to make visible in plot
     nthreads      = kwargs.get('parallel',      None     ) # alias
     nthreads      = kwargs.get('nthreads',      nthreads ) # number of threads: serial if nthreads==0 or 1, default 8 if nthreads==True
     tag           = kwargs.get('tag',           ""       ) # extra tag for all histograms
-    method        = kwargs.get('method',        None     ) # data-driven method; 'QCD_OSSS', 'QCD_ABCD', 'JTF', 'FakeFactor', ...
-    imethod       = kwargs.get('imethod',       -1       ) # position on list; -1 = last (bottom of stack)
     filters       = kwargs.get('filter',        None     ) or [ ] # filter these samples
     vetoes        = kwargs.get('veto',          None     ) or [ ] # filter out these samples
     task          = kwargs.get('task',          ""       ) # task name for progress bar
-    dotgraph      = kwargs.get('dot',           False    ) # name for dot graph (e.g. "graph_$NAME.dot")
-    #reset         = kwargs.get('reset',         False    ) # reset scales
-    #sysvars       = kwargs.get('sysvars',       { }      ) # list or dict to be filled up with systematic variations
-    #addsys        = kwargs.get('addsys',        True     )
+    rdf_dict      = kwargs.get('rdf_dict',      None     ) # optimization & debugging: reuse RDataFrames for the same filename / selection
+    cache         = kwargs.get('cache',         False    ) # cache filled histograms on disk (True, directory or HistCache)
+    backend       = kwargs.get('backend',       'rdf'    ) # 'rdf' (RDataFrame) or 'numpy' (NumpyFrame)
+    chain         = kwargs.get('chain',         False    ) # chain files of similar subsamples of MergedSamples into one RDataFrame
     filters       = ensurelist(filters)
+    cache         = gethistcache(cache,verb=verbosity)
     vetoes        = ensurelist(vetoes)
-    if method and not hasattr(self,method):
-      ensuremodule(method,'Plotter.methods') # load SampleSet class method from TauFW.Plotter.methods
+    if rdf_dict==None:
+      rdf_dict = { }
     
     # FILTER
     samples = [ ] # (filtered) list of samples to create histograms fo
@@ -302,43 +301,105 @@ class SampleSet(object):
         samples.append(subsample)
     
     # GET RDATAFRAMES
-    rdf_dict = { } # optimization & debugging: reuse RDataFrames for the same filename / selection
     res_dict = ResultDict() # dictionary of booked histograms (as RResultPtr<TH1D>)
     res_dict.setnthreads(nthreads,verb=verbosity+1) # set before creating RDataFrame
     for sample in samples:
-      rkwargs = { }
+      rkwargs = { 'cache': cache, 'backend': backend }
+      if chain and isinstance(sample,MergedSample):
+        rkwargs['chain'] = True
       if dodata and sample.isdata:   # (OBSERVED) DATA
         rkwargs.update({ 'weight': dataweight, 'blind': blind })
       elif doexp and sample.isexp:     # EXPECTED (SM BACKGROUND)
-        rkwargs.update({ 'weight': weight, 'replaceweight': replaceweight }) #'nojtf': nojtf
+        rkwargs.update({ 'weight': weight, 'replaceweight': replaceweight, 'variations': variations }) #'nojtf': nojtf
       elif dosignal and sample.issignal: # SIGNAL
-        rkwargs.update({ 'weight': weight, 'replaceweight': replaceweight, 'scale': sigscale })
+        rkwargs.update({ 'weight': weight, 'replaceweight': replaceweight, 'variations': variations, 'scale': sigscale })
       res_dict += sample.getrdframe(variables,selections,split=False,task=task,tag=tag,
                                     rdf_dict=rdf_dict,verb=verbosity,**rkwargs)
     if verbosity>=2:
-      print(">>> SampleSet.gethists: Got res_dict:")
+      print(">>> SampleSet.getrdframe: Got res_dict:")
       res_dict.display() # print full dictionary
+    return res_dict
+  
+  def gethists(self, *args, **kwargs):
+    """Create and fill histograms for all samples for given lists of variables and selections
+    with RDataFrame and return nested dictionary of histogram set (HistSet).
+    Systematic variations passed with variations=[Variation(...),...] are filled in the same
+    event loop, and stored per variation key in HistSet.variations.
+    If a ResultScheduler is passed (scheduler=...), the histograms are only booked,
+    and a ScheduledResult is returned, whose value is available after ResultScheduler.run.
+    Data-driven methods (e.g. method='QCD_OSSS') book their control regions in the same event loop,
+    and the subtraction is done afterwards on the filled histograms."""
+    verbosity     = LOG.getverbosity(kwargs,self)
+    LOG.verb("SampleSet.gethists: args=%r"%(args,),verbosity,1)
+    variables, selections, issinglevar, issinglesel = unpack_gethist_args(*args)
+    if not variables or not selections:
+      LOG.warn("SampleSet.gethists: No variables or selections to make histograms for... Got args=%r"%(args,))
+      return { }
+    method        = kwargs.get('method',        None     ) # data-driven method; 'QCD_OSSS', 'QCD_ABCD', 'JTF', 'FakeFactor', ...
+    imethod       = kwargs.get('imethod',       -1       ) # position on list; -1 = last (bottom of stack)
+    dotgraph      = kwargs.get('dot',           False    ) # name for dot graph (e.g. "graph_$NAME.dot")
+    lazy          = kwargs.get('lazy',          False    ) # only retrieve histograms when accessed (see LazyHistSet)
+    #reset         = kwargs.get('reset',         False    ) # reset scales
+    #sysvars       = kwargs.get('sysvars',       { }      ) # list or dict to be filled up with systematic variations
+    #addsys        = kwargs.get('addsys',        True     )
+    if method and not hasattr(self,method):
+      ensuremodule(method,'Plotter.methods') # load SampleSet class method from TauFW.Plotter.methods
     
-    # RUN RDataFrame events loops to fill histograms
-    res_dict.run(graphs=True,rdf_dict=rdf_dict,dot=dotgraph,verb=verbosity)
-    
-    # CONVERT TO HISTSET
-    # NOTE: in case of many subsamples of MergedSamples,
-    # this parts should remove some histograms from the memory
-    histset_dict = res_dict.gethistsets(style=True,clean=True) # { selection : { variable: HistSet } } }
+    # GET RDATAFRAMES
+    scheduler = kwargs.pop('scheduler',None) # ResultScheduler to run with results of other calls
+    rdf_dict  = kwargs.pop('rdf_dict',None) # optimization & debugging: reuse RDataFrames for the same filename / selection
+    if scheduler!=None:
+      rdf_dict = scheduler.rdf_dict # share RDataFrames with other calls
+    elif rdf_dict==None:
+      rdf_dict = { }
+    res_dict = self.getrdframe(variables,selections,rdf_dict=rdf_dict,**kwargs)
     
-    # EXTRA METHODS (e.g. QCD estimation from OS/SS)
+    # BOOK EXTRA METHODS (e.g. QCD estimation from OS/SS) in the same event loop
+    method_res = None # ScheduledResult of method
+    runnow     = scheduler==None # run event loops in this call
     if method:
-      LOG.verb("SampleSet.gethists: method %r"%(method),verbosity,1)
-      hist_dict = getattr(self,method)(variables,selections,rdf=True,**kwargs) # { selection : { variable: TH1D } } }
-      histset_dict.insert(hist_dict,imethod,verb=verbosity) # weave/insert histograms from hist_dict into histset_dict
+      LOG.verb("SampleSet.gethists: Booking method %r"%(method),verbosity,1)
+      if scheduler==None: # run method's results together with res_dict
+        scheduler = ResultScheduler(rdf_dict=rdf_dict,dot=dotgraph,verb=verbosity)
+      mkwargs = kwargs.copy()
+      mkwargs.pop('variations',None) # methods only for nominal
+      method_res = getattr(self,method)(variables,selections,rdf=True,scheduler=scheduler,**mkwargs) # booked before res_dict
+    
+    def gethistsets(res_dict):
+      """Convert results to HistSets after running the event loops."""
+      
+      # CONVERT TO HISTSET
+      # NOTE: in case of many subsamples of MergedSamples,
+      # this parts should remove some histograms from the memory
+      histset_dict = res_dict.gethistsets(style=True,clean=True,lazy=lazy) # { selection : { variable: HistSet } } }
+      
+      # EXTRA METHODS (e.g. QCD estimation from OS/SS)
+      if method:
+        LOG.verb("SampleSet.gethists: method %r"%(method),verbosity,1)
+        hist_dict = method_res # { selection : { variable: TH1D } } }
+        if isinstance(hist_dict,ScheduledResult): # already processed, as it was booked before res_dict
+          hist_dict = hist_dict.GetValue()
+        histset_dict.insert(hist_dict,imethod,verb=verbosity) # weave/insert histograms from hist_dict into histset_dict
+      
+      # YIELDS
+      if verbosity>=3:
+        histset_dict.display()
+      
+      # RETURN nested dictionarys of HistSets:  { selection: { variable: HistSet } }
+      return histset_dict.results(singlevar=issinglevar,singlesel=issinglesel)
     
-    # YIELDS
-    if verbosity>=3:
-      histset_dict.display()
+    # SCHEDULE to run later together with other results
+    if scheduler!=None:
+      LOG.verb("SampleSet.gethists: Booking %d results in %r..."%(len(res_dict),scheduler),verbosity,1)
+      result = scheduler.book(res_dict,gethistsets) # ScheduledResult
+      if not runnow:
+        return result
+      scheduler.run() # run all booked results (incl. method) at once
+      return result.GetValue()
     
-    # RETURN nested dictionarys of HistSets:  { selection: { variable: HistSet } }
-    return histset_dict.results(singlevar=issinglevar,singlesel=issinglesel)
+    # RUN RDataFrame events loops to fill histograms
+    res_dict.run(graphs=True,rdf_dict=rdf_dict,dot=dotgraph,verb=verbosity)
+    return gethistsets(res_dict)
   
   def getstack(self, *args, **kwargs):
     """Create and fill histograms for each given variable, selection with SampleSet.gethists,
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Author: Izaak Neutelings (November 2023)
+# Description: Lookup table of stitching weights, declared once as a compiled C++ function
+#              for RDataFrame, and evaluated as a NumPy gather by the columnar backend.
+import hashlib
+from TauFW.Plotter.sample.utils import LOG
+import ROOT
+from ROOT import gInterpreter
+try:
+  import numpy as np
+except ImportError:
+  np = None
+_declared = set() # names of declared C++ functions
+
+
+class StitchTable(object):
+  """Lookup table of stitching weights, indexed by (sample ID, mutau flag, number of partons),
+  to replace long nested conditional weight strings that RDataFrame needs to jit for every sample, e.g.
+    (NUP==0||NUP>4 ? (mutaufilter ? 0.5 : 0.8) : 1) * (NUP==1 ? (mutaufilter ? 0.3 : 0.2) : 1) * ...
+  The table is filled by evaluating one function per sample for all possible numbers of partons,
+  and declared once as a C++ function with a unique name based on the content:
+    table  = StitchTable([wfunc_incl,wfunc_1j,...],nmax=4,npart='NUP',mutau='mutaufilter')
+    weight = table.getweight(0) # "_taufw_stitch_<hash>(0,NUP,mutaufilter)"
+    sample_incl.addweight(weight)
+  All numbers of partons larger than nmax share the last bin; negative values have their own bin.
+  """
+  prefix = "_taufw_stitch_"
+
+  def __init__(self, wfuncs, nmax=4, npart='NUP', mutau=None, verb=0):
+    self.npartvar  = npart # variable name of number of partons in tree; 'NUP', 'LHE_Njets', ...
+    self.mutauvar  = mutau # variable name of mutau filter flag in tree, or None if not used
+    self.nmax      = nmax  # values above nmax are treated as nmax
+    self.nbins     = nmax+2 # 0, ..., nmax, and negative
+    self.verbosity = verb
+    nparts = list(range(nmax+1))+[-1] # representative value per bin
+    mutaus = [False,True] if mutau else [False]
+    self.table = [[[float(wfunc(n,m)) for n in nparts] for m in mutaus] for wfunc in wfuncs] # [sample][mutau][bin]
+    key = hashlib.sha1(repr((self.nbins,self.table)).encode('utf-8')).hexdigest()[:16]
+    self.name   = self.prefix+key
+    self._array = None # NumPy array of table, created on first use
+    self.declare()
+
+  def __repr__(self):
+    return "<%s(%r,nsamples=%d) at %s>"%(self.__class__.__name__,self.name,len(self.table),hex(id(self)))
+
+  def __len__(self):
+    return len(self.table)
+
+  def declare(self):
+    """Declare C++ lookup function once, and register as NumPy function for the columnar backend."""
+    if self.name in _declared:
+      return True
+    values = ', '.join("%.9g"%(w) for wsample in self.table for wmutau in wsample for w in wmutau)
+    nmutau = len(self.table[0])
+    code = ("float %s(int isample, int npart, bool mutau) {\n"%(self.name)+
+            "  static const float table[%d] = { %s };\n"%(len(self.table)*nmutau*self.nbins,values)+
+            "  const int ibin = (npart<0 ? %d : (npart>%d ? %d : npart));\n"%(self.nbins-1,self.nmax,self.nmax)+
+            "  return table[(isample*%d+(%s))*%d+ibin];\n"%(nmutau,"mutau ? 1 : 0" if nmutau>1 else "0",self.nbins)+
+            "}")
+    LOG.verb("StitchTable.declare: Declaring\n%s"%(code),self.verbosity,2)
+    if not hasattr(ROOT,self.name) and not gInterpreter.Declare(code):
+      LOG.throw(RuntimeError,"StitchTable.declare: Could not declare %r!"%(self.name))
+    if np is not None:
+      from TauFW.Plotter.sample.NumpyFrame import _funcs
+      _funcs[self.name] = self.evaluate
+    _declared.add(self.name)
+    return True
+
+  def getweight(self, isample):
+    """Return weight expression for a given sample index."""
+    mutau = self.mutauvar if self.mutauvar else '0'
+    return "%s(%d,%s,%s)"%(self.name,isample,self.npartvar,mutau)
+
+  def getbins(self, npart):
+    """Return bin indices for an array of number of partons."""
+    npart = np.asarray(npart)
+    return np.where(npart<0,self.nbins-1,np.minimum(npart,self.nmax)).astype(np.int64)
+
+  def evaluate(self, isample, npart, mutau=False):
+    """Gather weights for arrays of number of partons and mutau flags with NumPy."""
+    if self._array is None:
+      self._array = np.asarray(self.table,dtype=np.float32)
+    table  = self._array
+    imutau = np.asarray(mutau,dtype=bool).astype(np.int64) if len(self.table[0])>1 else 0
+    return table[int(isample),imutau,self.getbins(npart)]
+
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Author: Izaak Neutelings (November 2023)
+# Description: Container class for systematic variations booked with RDataFrame.Vary
+from TauFW.common.tools.utils import ensurelist, islist
+from TauFW.Plotter.plot.string import replacepattern
+
+
+class Variation(object):
+  """Container class for a systematic variation that can be booked with RDataFrame.Vary
+  in the same event loop as the nominal histograms, e.g. a weight replacement
+    Variation('shape_id',weight=[('idweight_2','idweightUp_2'),('idweight_2','idweightDown_2')],procs=['ZTT'])
+  or a column shift (the shifted columns must exist in the tree)
+    Variation('shape_res',shift=['_ResUp','_ResDown'],columns=['m_vis','pt_2'],procs=['ZTT','ZL'])
+  Every variation has one tag per varied value (default 'Up' and 'Down'),
+  and the varied results are retrieved with the keys 'name:tag', e.g. 'shape_id:Up'.
+  """
+
+  def __init__(self, name, *args, **kwargs):
+    self.name    = name.lstrip('_')
+    self.tags    = list(kwargs.get('tags',    ['Up','Down'] )) # one tag per varied value
+    self.weights = kwargs.get('weight',  None          ) # list of weight replacements, one per tag
+    self.shifts  = kwargs.get('shift',   None          ) # list of column suffixes, one per tag
+    self.columns = kwargs.get('columns', [ ]           ) # columns to shift
+    self.procs   = kwargs.get('procs',   [ ]           ) # search terms for samples to vary (if empty: all MC)
+    self.regex   = kwargs.get('regex',   False         ) # weight replacements are regular expressions
+    self.columns = ensurelist(self.columns)
+    self.procs   = ensurelist(self.procs)
+    if self.weights and not islist(self.weights[0]): # assume (oldweight,newweight1,newweight2,...)
+      self.weights = [(self.weights[0],w) for w in self.weights[1:]]
+    if self.weights and self.regex: # (oldweight,newweight,regexp)
+      self.weights = [(w[0],w[1],True) for w in self.weights]
+    for values in [self.weights,self.shifts]:
+      if values and len(values)!=len(self.tags):
+        raise IOError("Variation.__init__: Number of values (%d) does not match number of tags %r for %r"%(
+          len(values),self.tags,self.name))
+    if self.shifts and not self.columns:
+      raise IOError("Variation.__init__: No columns given to shift for %r!"%(self.name))
+
+  def __repr__(self):
+    return "<%s(%r,%r) at %s>"%(self.__class__.__name__,self.name,self.tags,hex(id(self)))
+
+  def keys(self):
+    """Return keys of varied results, as used by RDF.Experimental.VariationsFor."""
+    return ["%s:%s"%(self.name,t) for t in self.tags]
+
+  def appliesto(self,sample):
+    """Check if this variation should be applied to a given sample."""
+    if sample.isdata:
+      return False
+    return not self.procs or sample.match(*self.procs)
+
+  def varyweight(self,weight):
+    """Return list of varied weight expressions, or None if the weight is unaffected."""
+    if not self.weights or not weight:
+      return None
+    weights = [replacepattern(weight,p) for p in self.weights]
+    if all(w==weight for w in weights):
+      return None
+    return weights
+
+  def varycolumns(self):
+    """Return list of (column, varied columns) for column shifts."""
+    if not self.shifts:
+      return [ ]
+    return [(c,[c+s for s in self.shifts]) for c in self.columns]
+
+
+def vary(rdframe,column,varied,tags,name):
+  """Help function to register a systematic variation of a given column in a RDataFrame.
+  The varied expressions are cast to the nominal type, as required by RDataFrame.Vary."""
+  ctype = rdframe.GetColumnType(column)
+  expr  = "ROOT::RVec<%s>{%s}"%(ctype,', '.join("(%s)(%s)"%(ctype,v) for v in varied))
+  return rdframe.Vary(column,expr,list(tags),name)
+
@@ -4,6 +4,7 @@ import os, re, glob
 from TauFW.common.tools.utils import isnumber, islist, ensurelist, unpacklistargs, quotestrs, repkey, getyear
 from TauFW.common.tools.file import ensuredir, ensuremodule
 from TauFW.common.tools.root import ensureTFile, loadmacro
+from TauFW.common.tools.RDataFrame import getidentifiers
 from TauFW.common.tools.log import Logger, color
 from TauFW.Plotter.plot.Variable import Variable, Var, ensurevar
 from TauFW.Plotter.plot.Selection import Selection, Sel
@@ -409,6 +410,7 @@ def stitch(samplelist,*searchterms,**kwargs):
     return samplelist
   
   # FIND INCLUSIVE SAMPLE
+  from TauFW.Plotter.sample.StitchTable import StitchTable
   sample_incl = None
   sample_mutau = None #"DYJetsToMuTauh_M-50"
   if "2022" in era or "2023" in era: # DYto2L-4Jets_MLL-50_*J, WJetstoLNu-4Jets_*J
@@ -529,50 +531,43 @@ def stitch(samplelist,*searchterms,**kwargs):
       wMuTau_njet[njets] = sample.lumi * kfactor * sample.xsec * 1000. * effMuTau_njet[njets] / ( effMuTau_njet[njets]*sample.sumweights + effMuTauNjet_excl[njets]*sample_mutau.sumweights + effMuTauNjet_incl[njets]*sample_incl.sumweights )
       print("Inclusive mutau %i jets weight = %.6g"%(njets,wMuTau_njet[njets]))
   
-  conditionalWeight_incl = ""
-  if sample_mutau:
-    if len(sample_njet)>0:
-      conditionalWeight_incl = "(%s==0||%s>4 ? (mutaufilter ? %.6g : %.6g) : 1)"%(npartvar, npartvar, wIncl_mutau, wIncl)
-    else:
-      conditionalWeight_incl = "(mutaufilter ? %.6g : %.6g)"%(wIncl_mutau, wIncl)
+  # STITCHING WEIGHTS: lookup table indexed by (sample, mutau flag, number of partons)
+  def wfunc_incl(npart,mutau):
+    weight = (wIncl_mutau if mutau else wIncl) if (npart==0 or npart>4 or not sample_njet) else 1.
     for njets in sample_njet:
-      conditionalWeight_incl += " * (%s==%i ? (mutaufilter ? %.6g : %.6g) : 1)"%(npartvar, njets, wMuTau_njet[njets], wIncl_njet[njets])
-  else:
-    if len(sample_njet)>0:
-      conditionalWeight_incl = "(%s==0||%s>4 ? %.6g : 1)"%(npartvar, npartvar, wIncl)
-    else:
-      conditionalWeight_incl = "(%.6g)"%(wIncl)
+      if npart==njets:
+        weight *= wMuTau_njet[njets] if mutau else wIncl_njet[njets]
+    return weight
+  def wfunc_mutau(npart,mutau):
+    if not mutau:
+      return 0.
+    weight = wIncl_mutau if (npart==0 or npart>4 or not sample_njet) else 1.
     for njets in sample_njet:
-      conditionalWeight_incl += " * (%s==%i ? %.6g : 1)"%(npartvar, njets, wIncl_njet[njets])
-  conditionalWeight_incl = "("+conditionalWeight_incl+")"
-  sample_incl.norm = 1.0
-  sample_incl.addweight(conditionalWeight_incl)
-  
-  conditionalWeight_mutau = ""
+      if npart==njets:
+        weight *= wMuTau_njet[njets]
+    return weight
+  def wfunc_njet(njets):
+    return lambda npart, mutau: wMuTau_njet[njets] if mutau else wIncl_njet[njets]
+  stitchsamples = [sample_incl]
+  wfuncs = [wfunc_incl]
   if sample_mutau:
-    if len(sample_njet)>0:
-      conditionalWeight_mutau = "mutaufilter * (%s==0||%s>4 ? %.6g : 1)"%(npartvar, npartvar, wIncl_mutau)
-    else:
-      conditionalWeight_mutau = "mutaufilter * %.6g"%(wIncl_mutau)
-    for njets in sample_njet:
-      conditionalWeight_mutau += " * (%s==%i ? %.6g : 1)"%(npartvar, njets, wMuTau_njet[njets])
-    conditionalWeight_mutau = "("+conditionalWeight_mutau+")"
-    sample_mutau.norm = 1.0
-    sample_mutau.addweight(conditionalWeight_mutau)
-  
+    stitchsamples.append(sample_mutau)
+    wfuncs.append(wfunc_mutau)
   for njets in sample_njet:
-    if sample_mutau:
-      conditionalWeight_njet = "(mutaufilter ? %.6g : %.6g)"%(wMuTau_njet[njets], wIncl_njet[njets])
-    else:
-      conditionalWeight_njet = "%.6g"%wIncl_njet[njets]
-    sample_njet[njets].norm = 1.0
-    sample_njet[njets].addweight(conditionalWeight_njet)
-    print("sample_njet[njets].weight = ",sample_njet[njets].weight)
+    stitchsamples.append(sample_njet[njets])
+    wfuncs.append(wfunc_njet(njets))
+  nmax  = max([4]+list(sample_njet.keys()))+1 # all larger values have the same weights
+  table = StitchTable(wfuncs,nmax=nmax,npart=npartvar,mutau=('mutaufilter' if sample_mutau else None),verb=verbosity-2)
+  for isample, sample in enumerate(stitchsamples):
+    sample.norm = 1.0
+    sample.addweight(table.getweight(isample))
+    LOG.verb("stitch: %s weight = %r"%(sample.name,sample.weight),verbosity,level=2)
   
   # JOIN
   join(samplelist,*searchterms,name=name,title=title,verbosity=5)
   newsample = findsample(samplelist,name,unique=True)
   newsample.sample_incl = sample_incl # for gethist_from_file
+  newsample.stitchtable = table
   print("samplelist = ",samplelist)
   return samplelist
   
@@ -635,6 +630,29 @@ def selectbranches(tree,selections,verb=0):
   return tree
   
 
+def getbranches(exprs,branches,aliases={ },verb=0):
+  """Statically collect the branches that are used in a list of C++ expressions
+  (selections, weights, variables, ...), resolving aliases recursively.
+  Return set of used branches, and set of unknown identifiers (not a branch nor an alias)."""
+  used    = set() # branches used in expressions
+  unknown = set() # not a branch nor an alias (e.g. typo, or a constant defined in a macro)
+  done    = set() # identifiers already processed
+  todo    = [str(e) for e in exprs if e]
+  while todo:
+    expr = todo.pop()
+    for name in getidentifiers(expr):
+      if name in done: continue
+      done.add(name)
+      if name in aliases: # resolve alias
+        todo.append(str(aliases[name]))
+      elif name in branches:
+        used.add(name)
+      else:
+        unknown.add(name)
+  LOG.verb("getbranches: Found %d used branches, and %d unknown identifiers %s"%(len(used),len(unknown),sorted(unknown)),verb,3)
+  return used, unknown
+  
+
 from TauFW.Plotter.sample.Sample import *
 from TauFW.Plotter.sample.MergedSample import MergedSample
 from TauFW.Plotter.sample.SampleSet import SampleSet
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# Author: Izaak Neutelings (November 2023)
+# Description: Test the columnar NumpyFrame backend by filling the same selections and variables
+#              as with RDataFrame, and comparing the bin contents
+#   test/testNumpyFrame.py
+#   test/testNumpyFrame.py -n 200000 -v 2
+import time
+import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True # to avoid conflict with argparse
+from ROOT import RDataFrame, RDF
+from TauFW.common.tools.file import ensuredir
+from TauFW.Plotter.plot.utils import LOG
+from TauFW.Plotter.sample.NumpyFrame import NumpyFrame, translate, runnumpyresults
+
+
+# CUSTUM FUNCTIONs to mimic C++ macro
+ROOT.gInterpreter.Declare("""
+  Float_t dmmap(Int_t dm) {
+    return dm==0 ? 0 : (dm==1 || dm==2) ? 1 : dm==10 ? 2 : dm==11 ? 3 : 4;
+  };
+""")
+selections = [ # filters to compare, covering &&, ||, !, and ternaries
+  "",
+  "pt_1>30 && pt_2>30",
+  "pt_1>30 && (q_1*q_2<0 || dm_2==10)",
+  "!(abs(eta_1)>2.1) && iso_1<0.15 && njets>=1",
+  "(q_1>0 ? pt_1 : pt_2)>40 || m_vis<60",
+]
+variables = [ # (expression, nbins, xmin, xmax)
+  ('m_vis',                                   40,   0, 200),
+  ('pt_1+pt_2',                               40,   0, 300),
+  ('sqrt(pt_1*pt_2)',                         40,   0, 150),
+  ('pow(pt_1,2)/1000.',                       40,   0,  10),
+  ('std::abs(eta_1-eta_2)',                   30,   0,   5),
+  ('TMath::Abs(eta_2)',                       25,   0, 2.5),
+  ('min(eta_1,eta_2)',                        30,  -3,   3),
+  ('std::max(pt_1,pt_2)',                     40,   0, 200),
+  ('exp(-iso_1)',                             20, 0.5, 1.0),
+  ('log(pt_1)',                               20,   2,   7),
+  ('log10(m_vis)',                            20,   1,   3),
+  ('cos(phi_1-phi_2)',                        20,  -1,   1),
+  ('atan2(sin(phi_1),cos(phi_1))',            20,  -4,   4),
+  ('floor(pt_2/10.)',                         20,   0,  20),
+  ('(int)(pt_1/10.)',                         20,   0,  20),
+  ('q_1>0 ? pt_1 : -pt_1',                    40,-200, 200),
+  ('dm_2==0 ? 0 : (dm_2==1 || dm_2==2) ? 1 : dm_2==10 ? 2 : dm_2==11 ? 3 : 4', 6, 0, 6),
+  ('dmmap(dm_2)',                              6,   0,   6),
+  ('njets>=2 && pt_1>40',                      2,   0,   2),
+]
+weights = [ "", "genweight", "genweight*(q_1*q_2<0 ? 1.0 : 0.5)" ]
+unsupported = [ # expressions that the translator should refuse, instead of silently giving wrong results
+  "jpt[0]>30",
+  "ROOT::VecOps::Sum(jpt)",
+  "myfunc(pt_1)",
+]
+
+
+def makefile(fname,nevts=50000,verb=0):
+  """Create tree with random values, with double, integer and vector branches."""
+  LOG.verb("makefile: Creating %s with %d events..."%(fname,nevts),verb,1)
+  ROOT.gRandom.SetSeed(12345)
+  rdframe = RDataFrame(nevts)
+  rdframe = rdframe.Define('pt_1',      "20.+gRandom->Exp(30.)")
+  rdframe = rdframe.Define('pt_2',      "20.+gRandom->Exp(25.)")
+  rdframe = rdframe.Define('eta_1',     "gRandom->Uniform(-2.5,2.5)")
+  rdframe = rdframe.Define('eta_2',     "gRandom->Uniform(-2.3,2.3)")
+  rdframe = rdframe.Define('phi_1',     "gRandom->Uniform(-3.14159,3.14159)")
+  rdframe = rdframe.Define('phi_2',     "gRandom->Uniform(-3.14159,3.14159)")
+  rdframe = rdframe.Define('m_vis',     "10.+gRandom->Landau(60.,12.)")
+  rdframe = rdframe.Define('iso_1',     "gRandom->Exp(0.1)")
+  rdframe = rdframe.Define('genweight', "gRandom->Gaus(1.,0.2)")
+  rdframe = rdframe.Define('q_1',       "(Int_t)(gRandom->Rndm()<0.5 ? -1 : 1)")
+  rdframe = rdframe.Define('q_2',       "(Int_t)(gRandom->Rndm()<0.5 ? -1 : 1)")
+  rdframe = rdframe.Define('dm_2',      "const Int_t dms[5] = {0,1,2,10,11}; return dms[(Int_t)(5*gRandom->Rndm())];")
+  rdframe = rdframe.Define('njets',     "(Int_t)gRandom->Poisson(1.5)")
+  rdframe = rdframe.Define('jpt',       "ROOT::RVecD v(njets); for(auto &x: v) x = 20.+gRandom->Exp(40.); return v;")
+  rdframe.Snapshot('tree',fname)
+  return fname
+
+
+def compare(hist1,hist2,tol=1e-7):
+  """Compare bin contents and errors (including under- and overflow). Return list of mismatching bins."""
+  bad = [ ]
+  assert hist1.GetNcells()==hist2.GetNcells(), "Different number of bins: %s vs. %s"%(hist1.GetNcells(),hist2.GetNcells())
+  for i in range(hist1.GetNcells()):
+    for val1, val2 in [(hist1.GetBinContent(i),hist2.GetBinContent(i)),(hist1.GetBinError(i),hist2.GetBinError(i))]:
+      if abs(val1-val2)>tol*max(1.,abs(val1),abs(val2)):
+        bad.append((i,val1,val2))
+  return bad
+
+
+def test_translate(verb=0):
+  """Check translation of some C++ expressions, and that unsupported ones are refused."""
+  LOG.header("test_translate")
+  for expr, *_ in variables:
+    pyexpr, columns = translate(expr)
+    LOG.verb(">>> %-40s -> %s (columns=%s)"%(expr,pyexpr,columns),verb,1)
+  for expr in unsupported:
+    try:
+      translate(expr)
+    except NotImplementedError as err:
+      LOG.verb(">>> Refused %r: %s"%(expr,err),verb,1)
+    else:
+      raise AssertionError("Translator should refuse unsupported expression %r!"%(expr))
+  print(">>> test_translate: Translated %d expressions, and refused %d unsupported ones"%(len(variables),len(unsupported)))
+
+
+def test_compare(fname,verb=0):
+  """Fill the same selections, variables and weights with NumpyFrame and RDataFrame, and compare."""
+  LOG.header("test_compare")
+  rdf_results = [ ]
+  npf_results = [ ]
+  rdframe = RDataFrame('tree',fname)
+  npframe = NumpyFrame('tree',fname)
+  for isel, selection in enumerate(selections):
+    rdf_sel = rdframe.Filter(selection) if selection else rdframe
+    npf_sel = npframe.Filter(selection) if selection else npframe
+    for iwgt, weight in enumerate(weights):
+      if weight:
+        rdf_wgt = rdf_sel.Define('_wgt',weight)
+        npf_wgt = npf_sel.Define('_wgt',weight)
+      for ivar, (expr, nbins, xmin, xmax) in enumerate(variables):
+        hname   = "h_%d_%d_%d"%(isel,iwgt,ivar)
+        model   = RDF.TH1DModel(hname,expr,nbins,xmin,xmax)
+        rdf_var = (rdf_wgt if weight else rdf_sel).Define('_var',expr)
+        npf_var = (npf_wgt if weight else npf_sel).Define('_var',expr)
+        if weight:
+          rdf_results.append(rdf_var.Histo1D(model,'_var','_wgt'))
+          npf_results.append(npf_var.Histo1D(model,'_var','_wgt'))
+        else:
+          rdf_results.append(rdf_var.Histo1D(model,'_var'))
+          npf_results.append(npf_var.Histo1D(model,'_var'))
+    model2d = RDF.TH2DModel("h2d_%d"%(isel),"2D",20,0,200,10,-2.5,2.5)
+    rdf_results.append(rdf_sel.Histo2D(model2d,'m_vis','eta_1'))
+    npf_results.append(npf_sel.Histo2D(model2d,'m_vis','eta_1'))
+    rdf_results.append(rdf_sel.Count())
+    npf_results.append(npf_sel.Count())
+    rdf_results.append(rdf_sel.Sum('pt_1'))
+    npf_results.append(npf_sel.Sum('pt_1'))
+
+  # RUN
+  start = time.time()
+  ROOT.RDF.RunGraphs(rdf_results)
+  time_rdf = time.time()-start
+  start = time.time()
+  runnumpyresults(npf_results,verb=verb)
+  time_npf = time.time()-start
+  print(">>> test_compare: Filled %d results with RDataFrame in %.2fs, and with NumpyFrame in %.2fs"%(
+        len(rdf_results),time_rdf,time_npf))
+
+  # COMPARE
+  nbad = 0
+  for rdf_res, npf_res in zip(rdf_results,npf_results):
+    rdf_val, npf_val = rdf_res.GetValue(), npf_res.GetValue()
+    if isinstance(rdf_val,ROOT.TH1):
+      bad = compare(rdf_val,npf_val)
+      name = "%s (%r)"%(rdf_val.GetName(),rdf_val.GetTitle())
+      if rdf_val.GetEntries()!=npf_val.GetEntries():
+        bad.append(('entries',rdf_val.GetEntries(),npf_val.GetEntries()))
+    else: # Count or Sum
+      rdf_val, npf_val = float(rdf_val), float(npf_val)
+      bad = [ ] if abs(rdf_val-npf_val)<=1e-7*max(1.,abs(rdf_val)) else [(None,rdf_val,npf_val)]
+      name = repr(npf_res)
+    if bad:
+      nbad += 1
+      LOG.warn("test_compare: Mismatch for %s: %s"%(name,', '.join("bin %s: %s vs. %s"%b for b in bad[:5])))
+    else:
+      LOG.verb(">>> test_compare: Match for %s"%(name),verb,2)
+  assert nbad==0, "Found %d/%d mismatching results between NumpyFrame and RDataFrame!"%(nbad,len(rdf_results))
+  print(">>> test_compare: All %d results match!"%(len(rdf_results)))
+
+
+def main(args):
+  verbosity = args.verbosity
+  outdir    = ensuredir("plots/test")
+  fname     = "%s/testNumpyFrame.root"%(outdir)
+  makefile(fname,nevts=args.nevts,verb=verbosity)
+  test_translate(verb=verbosity)
+  test_compare(fname,verb=verbosity)
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test NumpyFrame against RDataFrame."""
+  parser = ArgumentParser(description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',    type=int, default=50000, action='store',
+                                          help="number of events to generate" )
+  parser.add_argument('-v', '--verbose',  dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                          help="set verbosity" )
+  args = parser.parse_args()
+  main(args)
+  print("\n>>> Done!")
@@ -145,6 +145,19 @@ def test_getrdframe(samples,variables,selections,outdir="plots/test",split=False
     plot.close()
   
 
+def test_getrdframe_single(sample,variables,selections,verb=0):
+  """Smoke test: Build RDataFrame for a single sample and check that all booked histograms are filled."""
+  LOG.header("test_getrdframe_single")
+  start    = time.time(), time.process_time() # wall-clock & CPU time
+  res_dict = sample.getrdframe(variables,selections,verb=verb)
+  assert len(res_dict)>=1, "Sample.getrdframe did not book any results for %r!"%(sample)
+  res_dict.run(graphs=True,verb=verb)
+  for selection, variable, samples, hists in res_dict.iterhists():
+    for hist in hists:
+      assert hist.GetEntries()>0, "Histogram %r for %r is empty!"%(hist.GetName(),selection.selection)
+  print(f">>> test_getrdframe_single: Booking and running {len(res_dict)} results for {sample.name!r} took {took(*start)}")
+  
+
 def test_getrdframe2D(sample,variables,selections,outdir="plots/test",split=False,tag="",rungraphs=True,verb=0):
   """Test Sample.getrdframe for 2D."""
   LOG.header("test_getrdframe2D")
@@ -312,6 +325,7 @@ def main(args):
     RDF.SetNumberOfThreads(ncores,verb=verbosity)
   
   # TEST Sample.getrdframe
+  test_getrdframe_single(expsamples[1],variables,selections,verb=verbosity) # smoke test
 #   test_getrdframe(expsamples,variables,selections,outdir,rungraphs=rungraphs,split=False,tag="_nosplit",verb=verbosity)
 #   test_getrdframe(expsamples,variables,selections,outdir,rungraphs=rungraphs,split=True, tag="_split",  verb=verbosity)
   
@@ -1,55 +1,62 @@
 # -*- coding: utf-8 -*-
 # Author: Izaak Neutelings (November 2023)
-import os
+import os, re, glob, hashlib
 import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True # to avoid conflict with argparse
-from ROOT import gROOT, gInterpreter, RDataFrame, RDF
+from ROOT import gROOT, gSystem, gInterpreter, RDataFrame, RDF
+from TauFW.common.tools.lazy import once
 
-# REPRESENTATION: shorten for debugging
-RDataFrame.__repr__ = lambda o: "<%s at %s>"%(o.__class__.__name__,hex(id(o)))
-RDF.RInterface['ROOT::Detail::RDF::RJittedFilter,void'].__repr__ = lambda o: "<RInterface<RJittedFilter,void> at %s>"%(hex(id(o)))
-for temp in ['TH1D','TH2D','ULong64_t','double']: # templates
-  RDF.RResultPtr[temp].__repr__ = lambda o: "<%s at %s>"%(o.__class__.__name__,hex(id(o)))
 
-# PROGRESS BAR
-gInterpreter.Declare("""
-  // Based on https://root-forum.cern.ch/t/onpartialresult-and-progress-bar-with-pyroot/39739/4
-  // Note: Escape the '\' character in python string
-  namespace ROOT::RDF {
-    const UInt_t barWidth = 40; int everyN = 0;
-    ULong64_t processed = 0, totalEvents = 0;
-    int maxpostlen = 0; // to remove long post
-    std::string progressBar;
-    std::mutex barMutex; // to avoid concurrent printing (only one thread at a time can lock a mutex)
-    auto registerEvents = [](ULong64_t nIncrement) { totalEvents += nIncrement; };
-    RResultPtr<ULong64_t> _AddProgressBar(RNode df, int everyN=10000, int totalN=100000,std::string post="") {
-      registerEvents(totalN);
-      auto c = df.Count();
-      if(maxpostlen<post.length())
-        maxpostlen = post.length();
-      c.OnPartialResultSlot(everyN,[everyN,post](unsigned int slot, ULong64_t &cnt){
-        std::lock_guard<std::mutex> lg(barMutex); // lock the mutex at construction, releases it at destruction
-        processed += everyN; // everyN captured by value for this lambda
-        if(totalEvents==0) return;
-        progressBar = ">>> [";
-        for(UInt_t i=0; i<static_cast<UInt_t>(static_cast<Float_t>(processed)/totalEvents*barWidth); ++i){
-          progressBar.push_back('=');
-        }
-        std::cout << "\\r" << std::left << std::setw(barWidth+4) << progressBar << "] "
-                  << processed << "/" << totalEvents << std::setw(maxpostlen) << post << " " << std::flush;
-      });
-      return c;
-    };
-    void _StopProgressBar(ULong64_t ntot=totalEvents, std::string post="") {
-      if(progressBar!="" and processed>0)
-        std::cout << "\\r" << std::left << std::setw(barWidth+4) << progressBar << "] Processed "
-                  << ntot << " events"  << std::setw(maxpostlen) << post << std::flush << std::endl;
-      progressBar = ""; processed = 0; totalEvents = 0; // reset
-    };
-    void _StopProgressBar(std::string post) { _StopProgressBar(totalEvents,post); };
-   }
-   Float_t dmmap(Int_t dm) { return dm==0 ? 0 : (dm==1 || dm==2) ? 1 : dm==10 ? 2 : dm==11 ? 3 : 4; };
-   Float_t sign(Float_t x) { return x<0 ? -1 : 1; };
-""")
+@once
+def declareRDFHelpers():
+  """Declare C++ help functions (progress bar, dmmap, sign) and shorter representations.
+  This is deferred until the first RDataFrame is set up, as Cling declarations slow down imports."""
+  # REPRESENTATION: shorten for debugging
+  RDataFrame.__repr__ = lambda o: "<%s at %s>"%(o.__class__.__name__,hex(id(o)))
+  RDF.RInterface['ROOT::Detail::RDF::RJittedFilter,void'].__repr__ = lambda o: "<RInterface<RJittedFilter,void> at %s>"%(hex(id(o)))
+  for temp in ['TH1D','TH2D','ULong64_t','double']: # templates
+    RDF.RResultPtr[temp].__repr__ = lambda o: "<%s at %s>"%(o.__class__.__name__,hex(id(o)))
+
+  # PROGRESS BAR
+  gInterpreter.Declare("""
+    // Based on https://root-forum.cern.ch/t/onpartialresult-and-progress-bar-with-pyroot/39739/4
+    // Note: Escape the '\' character in python string
+    namespace ROOT::RDF {
+      const UInt_t barWidth = 40; int everyN = 0;
+      ULong64_t processed = 0, totalEvents = 0;
+      int maxpostlen = 0; // to remove long post
+      std::string progressBar;
+      std::mutex barMutex; // to avoid concurrent printing (only one thread at a time can lock a mutex)
+      auto registerEvents = [](ULong64_t nIncrement) { totalEvents += nIncrement; };
+      RResultPtr<ULong64_t> _AddProgressBar(RNode df, int everyN=10000, int totalN=100000,std::string post="") {
+        registerEvents(totalN);
+        auto c = df.Count();
+        if(maxpostlen<post.length())
+          maxpostlen = post.length();
+        c.OnPartialResultSlot(everyN,[everyN,post](unsigned int slot, ULong64_t &cnt){
+          std::lock_guard<std::mutex> lg(barMutex); // lock the mutex at construction, releases it at destruction
+          processed += everyN; // everyN captured by value for this lambda
+          if(totalEvents==0) return;
+          progressBar = ">>> [";
+          for(UInt_t i=0; i<static_cast<UInt_t>(static_cast<Float_t>(processed)/totalEvents*barWidth); ++i){
+            progressBar.push_back('=');
+          }
+          std::cout << "\\r" << std::left << std::setw(barWidth+4) << progressBar << "] "
+                    << processed << "/" << totalEvents << std::setw(maxpostlen) << post << " " << std::flush;
+        });
+        return c;
+      };
+      void _StopProgressBar(ULong64_t ntot=totalEvents, std::string post="") {
+        if(progressBar!="" and processed>0)
+          std::cout << "\\r" << std::left << std::setw(barWidth+4) << progressBar << "] Processed "
+                    << ntot << " events"  << std::setw(maxpostlen) << post << std::flush << std::endl;
+        progressBar = ""; processed = 0; totalEvents = 0; // reset
+      };
+      void _StopProgressBar(std::string post) { _StopProgressBar(totalEvents,post); };
+     }
+     Float_t dmmap(Int_t dm) { return dm==0 ? 0 : (dm==1 || dm==2) ? 1 : dm==10 ? 2 : dm==11 ? 3 : 4; };
+     Float_t sign(Float_t x) { return x<0 ? -1 : 1; };
+  """)
+  return True
 
 
 def AddProgressBar(rdframe,totalN,post="",verb=0):
@@ -57,12 +64,14 @@ def AddProgressBar(rdframe,totalN,post="",verb=0):
   everyN = min(max(400,totalN/200.),25000)
   if verb>=1:
     print(">>> AddProgressBar: Add %r with everyN=%s, totalN=%s, post=%r"%(rdframe,everyN,totalN,post))
+  declareRDFHelpers() # also declares dmmap & sign before any expressions are jitted
   return RDF._AddProgressBar(RDF.AsRNode(rdframe),int(everyN),int(totalN),ROOT.std.move(ROOT.std.string(post)))
 RDF.AddProgressBar = AddProgressBar # save as part of RDF module
 
 
 def StopProgressBar(post=""):
   """Help-function to stop progress bar after running RDataFrame."""
+  declareRDFHelpers()
   return RDF._StopProgressBar(ROOT.std.string(post))
 RDF.StopProgressBar = StopProgressBar # save as part of RDF module
 
@@ -123,6 +132,146 @@ def printRDFReport(report,reorder=False):
     printcut(cut,indent="")
   
 
+_idexp    = re.compile(r"(?<![\w.:])([A-Za-z_]\w*)\b(?!\s*(?:\(|::))") # not function or namespace
+_keywords = ['true','false','int','float','double','bool','auto','const','unsigned','long','short','char',
+             'return','if','else','and','or','not','sizeof','static_cast','nullptr']
+def getidentifiers(cexpr):
+  """Return list of unique identifiers in a C++ expression that can be column names,
+  i.e. ignoring functions, namespaces, members and keywords."""
+  names = [ ]
+  for name in _idexp.findall(cexpr):
+    if name not in names and name not in _keywords:
+      names.append(name)
+  return names
+  
+
+class ExprRegistry(object):
+  """Registry of C++ expressions used in RDataFrame.Define and Filter.
+  Each unique expression (and column types) is declared only once as a C++ function
+    auto _taufw_expr_<hash>(const float& pt_1, const int& q_1) { return pt_1>20 && q_1<0; }
+  with gInterpreter.Declare, so Cling does not have to compile the same expression
+  again for every sample's RDataFrame, and RDF only needs to jit a trivial call, e.g.
+    rdframe.Define("_rdf_col1","_taufw_expr_<hash>(pt_1,q_1)")
+  Optionally, the declared functions can be saved to disk and compiled into a shared library
+  with ACLiC, to be loaded in later sessions:
+    EXPRREGISTRY.load("~/.cache/TauFW/exprs") # at the start of the session
+    ...
+    EXPRREGISTRY.save() # at the end of the session
+  """
+  prefix   = "_taufw_expr_"
+  
+  def __init__(self,cachedir=None,enable=True,verb=0):
+    self.enabled   = enable
+    self.cachedir  = cachedir
+    self.verbosity = verb
+    self.funcs     = { } # { key: function name }
+    self.failed    = set() # keys of expressions that could not be declared
+    self.new       = [ ] # list of function definitions declared in this session
+  
+  def __repr__(self):
+    return "<%s(%d expressions) at %s>"%(self.__class__.__name__,len(self.funcs),hex(id(self)))
+  
+  def getfunc(self,rdframe,cexpr,isfilter=False):
+    """Return function name and column list for given expression,
+    and declare the function if not done before. Return None if it failed."""
+    declareRDFHelpers() # expressions may use dmmap or sign
+    if not self.enabled or '"' in cexpr or "'" in cexpr: # ignore string literals
+      return None
+    try:
+      columns = [n for n in getidentifiers(cexpr) if rdframe.HasColumn(n)]
+      if not columns or cexpr.strip() in columns: # constant or existing column: nothing to compile
+        return None
+      types = [rdframe.GetColumnType(c) for c in columns]
+    except Exception: # e.g. not a RDataFrame
+      return None
+    rtype = 'bool' if isfilter else 'auto'
+    args  = ', '.join("const %s& %s"%(t,c) for t, c in zip(types,columns))
+    key   = hashlib.sha1(("%s %s(%s){%s}"%(rtype,self.prefix,args,cexpr)).encode('utf-8')).hexdigest()[:16]
+    if key in self.failed:
+      return None
+    fname = self.prefix+key
+    if key not in self.funcs:
+      if not hasattr(ROOT,fname): # not yet loaded from a library
+        code = "%s %s(%s) { return %s; }"%(rtype,fname,args,cexpr)
+        if self.verbosity>=2:
+          print(">>> ExprRegistry.getfunc: Declaring %s"%(code))
+        if not gInterpreter.Declare(code):
+          print(">>> ExprRegistry.getfunc: Warning! Could not declare %r... Falling back to jitting RDataFrame."%(cexpr))
+          self.failed.add(key)
+          return None
+        self.new.append(code)
+      self.funcs[key] = fname
+    return fname, columns
+  
+  def Define(self,rdframe,cname,cexpr):
+    """Define column with expression via registered function if possible."""
+    func = self.getfunc(rdframe,cexpr)
+    if func:
+      cexpr = "%s(%s)"%(func[0],','.join(func[1]))
+    return rdframe.Define(cname,cexpr)
+  
+  def Filter(self,rdframe,cexpr,name=""):
+    """Filter with expression via registered function if possible."""
+    func = self.getfunc(rdframe,cexpr,isfilter=True)
+    if func:
+      return rdframe.Filter("%s(%s)"%(func[0],','.join(func[1])),name or cexpr)
+    return rdframe.Filter(cexpr,name) if name else rdframe.Filter(cexpr)
+  
+  def load(self,cachedir=None,verb=0):
+    """Load shared libraries with precompiled expressions from a cache directory."""
+    cachedir = cachedir or self.cachedir
+    if not cachedir:
+      return 0
+    self.cachedir = cachedir = os.path.expanduser(cachedir)
+    nfuncs = 0
+    for macro in glob.glob(os.path.join(cachedir,self.prefix+"*.C")):
+      if not glob.glob(macro[:-2]+"_C*.so"): # not compiled
+        continue
+      if verb>=1:
+        print(">>> ExprRegistry.load: Loading %s..."%(macro))
+      if gROOT.ProcessLine(".L %s+"%(macro))!=0: # failed to load
+        print(">>> ExprRegistry.load: Warning! Could not load %s..."%(macro))
+        continue
+      nfuncs += 1
+    return nfuncs
+  
+  def save(self,cachedir=None,verb=0):
+    """Write expressions declared in this session into a macro,
+    and compile it into a shared library for later sessions (without loading it now)."""
+    cachedir = os.path.expanduser(cachedir or self.cachedir or "")
+    if not cachedir or not self.new:
+      return None
+    if not os.path.exists(cachedir):
+      os.makedirs(cachedir)
+    code  = '\n'.join(self.new)
+    key   = hashlib.sha1(code.encode('utf-8')).hexdigest()[:16]
+    macro = os.path.join(cachedir,"%s%s.C"%(self.prefix,key))
+    with open(macro,'w') as file:
+      file.write("// Automatically generated by TauFW.common.tools.RDataFrame.ExprRegistry\n")
+      file.write("#include <ROOT/RVec.hxx>\n#include <TMath.h>\n#include <cmath>\n")
+      file.write("using namespace ROOT::VecOps;\n")
+      file.write(code+'\n')
+    if verb>=1:
+      print(">>> ExprRegistry.save: Compiling %d expressions in %s..."%(len(self.new),macro))
+    if not gSystem.CompileMacro(macro,'kOc'): # compile only, do not load in this session
+      print(">>> ExprRegistry.save: Warning! Could not compile %s..."%(macro))
+      os.remove(macro)
+      return None
+    self.new = [ ]
+    return macro
+  
+EXPRREGISTRY = ExprRegistry(cachedir=os.environ.get('TAUFW_EXPRCACHE',None)) # global registry
+if EXPRREGISTRY.cachedir:
+  EXPRREGISTRY.load()
+  
+
+def AddRDFFilter(self,cexpr,name="",verb=0):
+  """Add filter to RDF, using the expression registry to avoid compiling the same expression for each RDataFrame."""
+  if verb>=2:
+    print(">>> RDataFrame.AddRDFFilter: Filtering %r in %r..."%(cexpr,self))
+  return EXPRREGISTRY.Filter(self,cexpr,name)
+  
+
 def AddRDFColumn(self,cexpr,basename="_rdf_col",expr_dict=None,exact=False,verb=0):
   """Define new column in RDF if it does not exist, while ensuring unique column name and avoid duplicates.
   To avoid duplicate definition of the same expression, one can keep track via a dictionary (expr_dict)."""
@@ -147,7 +296,7 @@ def AddRDFColumn(self,cexpr,basename="_rdf_col",expr_dict=None,exact=False,verb=
           print(">>> AddRDFColumn: Could not uniquely define expression %r as column %r, because column %r already exists in %r! Ignoring..."%(
                 cexpr,cname,cname,rdframe))
         else: # define first time
-          rdframe = self.Define(cname,cexpr) # compile expression as new column called cname
+          rdframe = EXPRREGISTRY.Define(self,cname,cexpr) # compile expression as new column called cname
           if verb>=2:
             print(">>> RDataFrame.AddRDFColumn: Defining %r (exact) as %r in %r..."%(cname,cexpr,self))
       elif not self.HasColumn(cexpr): # column does not exist yet, define cexpr with column name cname
@@ -156,7 +305,7 @@ def AddRDFColumn(self,cexpr,basename="_rdf_col",expr_dict=None,exact=False,verb=
         while self.HasColumn(cname): # ensure column name is unique
           i += 1
           cname = basename+str(i)
-        rdframe = self.Define(cname,cexpr) # compile expression as new column called cname
+        rdframe = EXPRREGISTRY.Define(self,cname,cexpr) # compile expression as new column called cname
         if verb>=2:
           print(">>> RDataFrame.AddRDFColumn: Defining %r (i=%d) as %r in %r..."%(cname,i,cexpr,self))
       elif verb>=4: # column already defined !
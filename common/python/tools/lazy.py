@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Author: Izaak Neutelings (November 2023)
+# Description: Help tools to defer expensive imports (e.g. ROOT), Cling declarations
+#              and macro compilation until a code path actually needs them.
+import sys, types, importlib
+from functools import wraps
+
+
+class LazyModule(types.ModuleType):
+  """Proxy of a module that is only imported on first attribute access, e.g.
+    ROOT = lazyimport('ROOT') # does not import ROOT yet
+    def open(fname):
+      return ROOT.TFile.Open(fname) # imports ROOT now
+  Optional functions in onload are called with the module once it is imported."""
+
+  def __init__(self, name, onload=None):
+    super(LazyModule,self).__init__(name)
+    self.__dict__['_lazyname']   = name
+    self.__dict__['_lazymodule'] = None
+    self.__dict__['_lazyonload'] = onload
+
+  def __repr__(self):
+    if self._lazymodule is None:
+      return "<LazyModule(%r), not loaded>"%(self._lazyname)
+    return repr(self._lazymodule)
+
+  def _load(self):
+    """Import module, and call onload function the first time."""
+    module = self.__dict__['_lazymodule']
+    if module is None:
+      module = importlib.import_module(self.__dict__['_lazyname'])
+      self.__dict__['_lazymodule'] = module
+      onload = self.__dict__['_lazyonload']
+      if onload:
+        onload(module)
+    return module
+
+  def __getattr__(self, attr):
+    return getattr(self._load(),attr)
+
+  def __setattr__(self, attr, value):
+    setattr(self._load(),attr,value)
+
+  def __dir__(self):
+    return dir(self._load())
+
+
+def _rootonload(ROOT):
+  ROOT.PyConfig.IgnoreCommandLineOptions = True # to avoid conflict with argparse
+
+
+def lazyimport(name, onload=None):
+  """Return module if it was already imported, or else a LazyModule proxy that imports it on first use."""
+  if name in sys.modules:
+    return sys.modules[name]
+  if onload is None and name=='ROOT':
+    onload = _rootonload
+  return LazyModule(name,onload=onload)
+
+
+def isloaded(name):
+  """Check if a module was imported (and not just proxied)."""
+  return name in sys.modules
+
+
+def once(func):
+  """Decorator to run a function only once, e.g. to declare C++ code or load a macro on first use,
+  and return the result of the first call in later calls."""
+  @wraps(func)
+  def wrapper(*args,**kwargs):
+    if not wrapper.called:
+      wrapper.result = func(*args,**kwargs)
+      wrapper.called = True
+    return wrapper.result
+  wrapper.called = False
+  wrapper.result = None
+  return wrapper
+
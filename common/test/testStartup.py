@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+# Author: Izaak Neutelings (November 2023)
+# Description: Benchmark start-up time of TauFW modules and commands in a fresh python process,
+#              and check which ones load ROOT at import.
+#   test/testStartup.py
+#   test/testStartup.py -n 5 -m TauFW.PicoProducer.pico.config -c "pico.py list"
+import os, sys, time
+from subprocess import Popen, PIPE
+from TauFW.common.tools.log import Logger
+LOG = Logger('Test')
+modules = [ # modules to import in a fresh process
+  'TauFW.common.tools.utils',
+  'TauFW.PicoProducer.storage.utils',
+  'TauFW.PicoProducer.pico.config',
+  'TauFW.PicoProducer.pico.job',
+  'TauFW.common.tools.RDataFrame',
+  'TauFW.Plotter.plot.MultiDraw',
+  'TauFW.Plotter.sample.utils',
+]
+commands = [ # commands to run in a shell
+  "pico.py list",
+  "pico.py status -h",
+]
+checkcode = "import sys, time; t0 = time.time(); import %s; print('%%.3f %%d'%%(time.time()-t0,'ROOT' in sys.modules))"
+
+
+def timeimport(module,ntimes=3,verb=0):
+  """Return minimum import time in a fresh process, and whether ROOT was imported."""
+  times = [ ]
+  loaded = False
+  for i in range(ntimes):
+    proc = Popen([sys.executable,'-c',checkcode%(module)],stdout=PIPE,stderr=PIPE,universal_newlines=True)
+    out, err = proc.communicate()
+    if proc.returncode!=0:
+      LOG.warn("timeimport: Could not import %r:\n%s"%(module,err.strip().split('\n')[-1]))
+      return None, None
+    secs, loaded = out.strip().split('\n')[-1].split()
+    times.append(float(secs))
+  return min(times), loaded=='1'
+
+
+def timecommand(command,ntimes=3,verb=0):
+  """Return minimum wall-clock time of a command."""
+  times = [ ]
+  for i in range(ntimes):
+    start = time.time()
+    proc  = Popen(command,shell=True,stdout=PIPE,stderr=PIPE,universal_newlines=True)
+    out, err = proc.communicate()
+    times.append(time.time()-start)
+    if proc.returncode!=0:
+      LOG.warn("timecommand: Command %r failed:\n%s"%(command,err.strip().split('\n')[-1]))
+      return None
+  return min(times)
+
+
+def main(args):
+  ntimes  = args.ntimes
+  mods    = args.modules or modules
+  cmds    = args.commands or commands
+  LOG.header("Import time (minimum of %d)"%(ntimes))
+  print(">>> %8s %6s  %s"%('time','ROOT','module'))
+  for module in mods:
+    secs, loaded = timeimport(module,ntimes,verb=args.verbosity)
+    if secs!=None:
+      print(">>> %7.3fs %6s  %s"%(secs,"yes" if loaded else "no",module))
+  print('')
+  LOG.header("Command time (minimum of %d)"%(ntimes))
+  print(">>> %8s  %s"%('time','command'))
+  for command in cmds:
+    secs = timecommand(command,ntimes,verb=args.verbosity)
+    if secs!=None:
+      print(">>> %7.3fs  %s"%(secs,command))
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Benchmark start-up time of TauFW modules and commands."""
+  parser = ArgumentParser(prog="testStartup",description=description,epilog="Good luck!")
+  parser.add_argument('-m', '--module',  dest='modules', action='append', default=[ ],
+                                         help="module to import (default: list of common modules)" )
+  parser.add_argument('-c', '--command', dest='commands', action='append', default=[ ],
+                                         help="command to run (default: %s)"%(commands) )
+  parser.add_argument('-n', '--ntimes',  type=int, default=3,
+                                         help="number of repetitions; the minimum time is reported" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  print('')
+  main(args)
+  print('')